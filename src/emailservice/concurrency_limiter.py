@@ -0,0 +1,298 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Adaptive concurrency limit and load shedding for grpc servers.
+
+A grpc server queues calls it has no worker thread for without bound, so
+under overload latency grows until clients time out and every call fails.
+LoadSheddingInterceptor admits at most `limit` unary calls at a time,
+counting calls waiting for a thread, and rejects the others right away
+with RESOURCE_EXHAUSTED. Calls whose remaining deadline is shorter than
+the fastest recent call are rejected with DEADLINE_EXCEEDED before doing
+any work. grpc runs rejections on the server's executor too: a
+SheddingExecutor gives them threads of their own, so that they don't wait
+behind the calls that were admitted.
+
+The limit follows the gradient between the lowest latency seen recently
+(the service time without queueing) and the current one: while latency
+stays within `tolerance` times the lowest, the limit grows by about its
+square root per window; when calls queue up, it shrinks in proportion.
+
+interceptors_from_env() reads CONCURRENCY_LIMIT ("adaptive", or "off"),
+CONCURRENCY_LIMIT_INITIAL, CONCURRENCY_LIMIT_MIN, CONCURRENCY_LIMIT_MAX,
+CONCURRENCY_LIMIT_TOLERANCE and CONCURRENCY_LIMIT_MIN_DEADLINE (seconds).
+"""
+
+import inspect
+import math
+import os
+import threading
+import time
+from concurrent import futures
+
+import grpc
+
+from logger import getJSONLogger
+logger = getJSONLogger('concurrency-limiter')
+
+# never shed health checks, or overload turns into restarts
+_EXEMPT_PREFIX = '/grpc.health.v1.Health/'
+
+
+class _Permit(object):
+  __slots__ = ('_limiter', '_start', '_released')
+
+  def __init__(self, limiter):
+    self._limiter = limiter
+    self._start = time.monotonic()
+    self._released = False
+
+  def release(self, dropped=False):
+    if not self._released:
+      self._released = True
+      self._limiter._on_done(time.monotonic() - self._start, dropped)
+
+  def discard(self):
+    """Releases the permit of a call that did no work, without a latency sample."""
+    if not self._released:
+      self._released = True
+      self._limiter._on_discarded()
+
+  def __del__(self):
+    # grpc doesn't run the handler of a call cancelled while it was queued
+    self.release(dropped=True)
+
+
+class ConcurrencyLimiter(object):
+  """Gradient-based adaptive concurrency limit."""
+
+  def __init__(self, initial_limit=20, min_limit=4, max_limit=200, tolerance=2.0,
+               window=0.5, min_window_samples=10, min_rtt_reset=60.0, smoothing=0.2):
+    self._limit = float(initial_limit)
+    self._min_limit = min_limit
+    self._max_limit = max_limit
+    self._tolerance = tolerance
+    self._window = window
+    self._min_window_samples = min_window_samples
+    self._min_rtt_reset = min_rtt_reset
+    self._smoothing = smoothing
+    self._lock = threading.Lock()
+    self._inflight = 0
+    self._max_inflight = 0
+    self._min_rtt = None
+    self._min_rtt_since = time.monotonic()
+    self._window_start = time.monotonic()
+    self._window_rtts = 0.0
+    self._window_samples = 0
+    self._window_drops = 0
+    self.accepted = 0
+    self.rejected = 0
+    self.dropped = 0
+
+  @property
+  def limit(self):
+    return int(self._limit)
+
+  @property
+  def inflight(self):
+    return self._inflight
+
+  @property
+  def min_rtt(self):
+    return self._min_rtt
+
+  def acquire(self):
+    """Returns a permit to release when the call is done, or None if over the limit."""
+    with self._lock:
+      if self._inflight >= int(self._limit):
+        self.rejected += 1
+        return None
+      self._inflight += 1
+      self._max_inflight = max(self._max_inflight, self._inflight)
+      self.accepted += 1
+    return _Permit(self)
+
+  def stats(self):
+    return dict(limit=self.limit, inflight=self._inflight, min_rtt=self._min_rtt,
+                accepted=self.accepted, rejected=self.rejected, dropped=self.dropped)
+
+  def _on_discarded(self):
+    with self._lock:
+      self._inflight -= 1
+
+  def _on_done(self, rtt, dropped):
+    with self._lock:
+      self._inflight -= 1
+      if dropped:
+        self.dropped += 1
+        self._window_drops += 1
+      else:
+        self._window_rtts += rtt
+        self._window_samples += 1
+      now = time.monotonic()
+      if (now - self._window_start >= self._window
+          and self._window_samples >= self._min_window_samples):
+        self._update(now)
+
+  def _update(self, now):
+    sample_rtt = self._window_rtts / self._window_samples
+    if self._min_rtt is None or now - self._min_rtt_since >= self._min_rtt_reset:
+      # forget the old minimum now and then, the service may have become slower
+      self._min_rtt = sample_rtt
+      self._min_rtt_since = now
+    else:
+      self._min_rtt = min(self._min_rtt, sample_rtt)
+    limit = self._limit
+    if self._window_drops:
+      new_limit = limit * 0.9
+    else:
+      gradient = max(0.5, min(1.0, self._tolerance * self._min_rtt / sample_rtt))
+      new_limit = limit * gradient
+      # only grow when the limit is what holds the traffic back
+      if self._max_inflight >= limit / 2:
+        new_limit += math.sqrt(limit)
+    new_limit = (1 - self._smoothing) * limit + self._smoothing * new_limit
+    self._limit = max(self._min_limit, min(self._max_limit, new_limit))
+    if int(self._limit) != int(limit):
+      logger.debug("concurrency limit {} -> {} (rtt {:.1f}ms, min {:.1f}ms)".format(
+        int(limit), int(self._limit), sample_rtt * 1e3, self._min_rtt * 1e3))
+    self._window_start = now
+    self._window_rtts = 0.0
+    self._window_samples = 0
+    self._window_drops = 0
+    self._max_inflight = self._inflight
+
+
+def _reject(request, context):
+  context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, 'server overloaded, retry later')
+
+
+async def _reject_async(request, context):
+  await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, 'server overloaded, retry later')
+
+
+class LoadSheddingInterceptor(grpc.ServerInterceptor):
+  """Server interceptor applying a ConcurrencyLimiter to unary calls."""
+
+  def __init__(self, limiter, min_deadline=0.0):
+    self.limiter = limiter
+    self._min_deadline = min_deadline
+
+  def intercept_service(self, continuation, handler_call_details):
+    handler = continuation(handler_call_details)
+    if not _limited(handler, handler_call_details):
+      return handler
+    permit = self.limiter.acquire()
+    if permit is None:
+      return grpc.unary_unary_rpc_method_handler(_reject)
+    behavior = handler.unary_unary
+    limiter = self.limiter
+    min_deadline = self._min_deadline
+
+    def limited(request, context):
+      try:
+        if _short_deadline(context, limiter, min_deadline):
+          # says nothing about congestion, leave the limit alone
+          permit.discard()
+          context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, 'deadline too short to serve')
+        return behavior(request, context)
+      finally:
+        permit.release()
+
+    return handler._replace(unary_unary=limited)
+
+
+class AsyncLoadSheddingInterceptor(grpc.aio.ServerInterceptor):
+  """LoadSheddingInterceptor for grpc.aio servers."""
+
+  def __init__(self, limiter, min_deadline=0.0):
+    self.limiter = limiter
+    self._min_deadline = min_deadline
+
+  async def intercept_service(self, continuation, handler_call_details):
+    handler = await continuation(handler_call_details)
+    if not _limited(handler, handler_call_details):
+      return handler
+    permit = self.limiter.acquire()
+    if permit is None:
+      return grpc.unary_unary_rpc_method_handler(_reject_async)
+    behavior = handler.unary_unary
+    limiter = self.limiter
+    min_deadline = self._min_deadline
+
+    async def limited(request, context):
+      try:
+        if _short_deadline(context, limiter, min_deadline):
+          permit.discard()
+          await context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, 'deadline too short to serve')
+        response = behavior(request, context)
+        if inspect.isawaitable(response):
+          response = await response
+        return response
+      finally:
+        permit.release()
+
+    return handler._replace(unary_unary=limited)
+
+
+class SheddingExecutor(futures.ThreadPoolExecutor):
+  """Executor for grpc servers with a LoadSheddingInterceptor.
+
+  Rejected calls run on `reject_workers` threads of their own rather than
+  queueing behind admitted calls for one of the `max_workers` threads.
+  """
+
+  def __init__(self, max_workers, reject_workers=2):
+    super().__init__(max_workers=max_workers)
+    self._rejects = futures.ThreadPoolExecutor(max_workers=reject_workers,
+                                               thread_name_prefix='shed')
+
+  def submit(self, fn, *args, **kwargs):
+    # grpc passes the call's handler along with it
+    if any(arg is _reject for arg in args):
+      return self._rejects.submit(fn, *args, **kwargs)
+    return super().submit(fn, *args, **kwargs)
+
+  def shutdown(self, wait=True, **kwargs):
+    self._rejects.shutdown(wait)
+    super().shutdown(wait, **kwargs)
+
+
+def _short_deadline(context, limiter, min_deadline):
+  # a call can't finish in less than the fastest recent one took
+  remaining = context.time_remaining()
+  if remaining is None:
+    return False
+  return remaining < max(min_deadline, limiter.min_rtt or 0.0)
+
+
+def _limited(handler, handler_call_details):
+  return (handler is not None and handler.unary_unary is not None
+          and not handler_call_details.method.startswith(_EXEMPT_PREFIX))
+
+
+def interceptors_from_env(aio=False):
+  """Returns the load shedding interceptor configured by the environment, if any."""
+  if os.environ.get('CONCURRENCY_LIMIT', "adaptive").lower() in ("off", "false", "0"):
+    return []
+  limiter = ConcurrencyLimiter(
+    initial_limit=int(os.environ.get('CONCURRENCY_LIMIT_INITIAL', "20")),
+    min_limit=int(os.environ.get('CONCURRENCY_LIMIT_MIN', "4")),
+    max_limit=int(os.environ.get('CONCURRENCY_LIMIT_MAX', "200")),
+    tolerance=float(os.environ.get('CONCURRENCY_LIMIT_TOLERANCE', "2")))
+  min_deadline = float(os.environ.get('CONCURRENCY_LIMIT_MIN_DEADLINE', "0"))
+  interceptor_class = AsyncLoadSheddingInterceptor if aio else LoadSheddingInterceptor
+  return [interceptor_class(limiter, min_deadline)]
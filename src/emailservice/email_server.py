@@ -14,7 +14,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from concurrent import futures
 import argparse
 import os
 import sys
@@ -31,13 +30,15 @@ from grpc_health.v1 import health_pb2_grpc
 
 
 
-from logger import getJSONLogger
+from concurrency_limiter import SheddingExecutor, interceptors_from_env
+from metrics import (MetricsInterceptor, Registry, metrics_port, start_http_server,
+                     stats_collector)
+from profiler import install_signal_handler, profile_route
+from request_log import RequestLog, request_log_from_env, summarized
+from tracing import server_interceptors, tracer_from_env
+from logger import getJSONLogger, getLogStats
 logger = getJSONLogger('emailservice-server')
 
-#tracer_provider = TracerProvider()
-#trace.set_tracer_provider(tracer_provider)
-#tracer_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
-
 # Loads confirmation email template from file
 env = Environment(
     loader=FileSystemLoader('templates'),
@@ -102,8 +103,16 @@ class EmailService(BaseEmailService):
     return demo_pb2.Empty()
 
 class DummyEmailService(BaseEmailService):
+  def __init__(self, request_log=None):
+    # logs a sample of the requests and summarizes all of them
+    self.request_log = request_log or RequestLog(logger, 'SendOrderConfirmation',
+                                                 summary_interval=0)
+
+  @summarized
   def SendOrderConfirmation(self, request, context):
-    logger.info('A request to send order confirmation email to {} has been received.'.format(request.email))
+    self.request_log.products(item.item.product_id for item in request.order.items)
+    if self.request_log.sampled():
+      logger.info('A request to send order confirmation email to {} has been received.'.format(request.email))
     return demo_pb2.Empty()
 
 class HealthCheck():
@@ -111,11 +120,34 @@ class HealthCheck():
     return health_pb2.HealthCheckResponse(
       status=health_pb2.HealthCheckResponse.SERVING)
 
+def start_metrics(interceptors, executor):
+  registry = Registry()
+  interceptors.insert(0, MetricsInterceptor(registry))
+  for interceptor in interceptors:
+    limiter = getattr(interceptor, 'limiter', None)
+    if limiter is not None:
+      registry.add_collector(stats_collector(
+        'concurrency_limit', 'Adaptive concurrency limit', limiter.stats,
+        counters=('accepted', 'rejected', 'dropped')))
+  registry.add_collector(stats_collector(
+    'log', 'Log pipeline', getLogStats, counters=('dropped', 'written', 'batches')))
+  # calls accepted by grpc and waiting for a worker thread
+  registry.add_collector(lambda: [(
+    'grpc_server_executor_queue_depth', 'gauge', 'Calls waiting for a worker thread.',
+    [({}, executor._work_queue.qsize())])])
+  start_http_server(metrics_port(), registry, routes={'/debug/profile': profile_route})
+
 def start(dummy_mode):
-  server = grpc.server(futures.ThreadPoolExecutor(max_workers=10),)
+  # the interceptors record metrics (shed calls included), trace calls and
+  # shed calls past the adaptive concurrency limit
+  executor = SheddingExecutor(max_workers=10)
+  interceptors = server_interceptors(tracer_from_env('emailservice')) + interceptors_from_env()
+  if metrics_port() is not None:
+    start_metrics(interceptors, executor)
+  server = grpc.server(executor, interceptors=interceptors)
   service = None
   if dummy_mode:
-    service = DummyEmailService()
+    service = DummyEmailService(request_log_from_env(logger, 'SendOrderConfirmation'))
   else:
     raise Exception('non-dummy mode not implemented yet')
 
@@ -126,6 +158,8 @@ def start(dummy_mode):
   logger.info("listening on port: "+port)
   server.add_insecure_port('[::]:'+port)
   server.start()
+  # profile on SIGUSR1
+  install_signal_handler()
   try:
     while True:
       time.sleep(3600)
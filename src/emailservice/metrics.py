@@ -0,0 +1,377 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Prometheus metrics without a client library.
+
+Counters, gauges and histograms with fixed label names. Every label
+combination is a child created once; recording on a child is a bisect (for
+histograms) and an addition under a lock of its own. Values that already
+exist elsewhere, like cache statistics, are read at scrape time through
+collector functions instead of being copied on every change.
+
+MetricsInterceptor records per-method latency, in-flight calls and status
+codes of unary RPCs, and start_http_server serves the text exposition
+format on /metrics.
+"""
+
+import bisect
+import functools
+import http.server
+import inspect
+import math
+import os
+import threading
+import time
+
+import grpc
+
+from logger import getJSONLogger
+logger = getJSONLogger('metrics')
+
+# seconds; RPCs here are expected to take milliseconds
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+def _format_value(value):
+  if value == math.inf:
+    return '+Inf'
+  if value == int(value) and abs(value) < 1 << 53:
+    return str(int(value))
+  return repr(float(value))
+
+
+def _escape(value):
+  return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+  pairs = ['{}="{}"'.format(n, _escape(v)) for n, v in zip(names, values)]
+  if extra:
+    pairs.append(extra)
+  return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric(object):
+  type = None
+
+  def __init__(self, name, documentation, labelnames=()):
+    self.name = name
+    self.documentation = documentation
+    self.labelnames = tuple(labelnames)
+    self._lock = threading.Lock()
+    self._children = {}
+
+  def labels(self, *values):
+    child = self._children.get(values)
+    if child is None:
+      with self._lock:
+        child = self._children.setdefault(values, self._new_child())
+    return child
+
+  def render(self, out):
+    out.append('# HELP {} {}'.format(self.name, self.documentation))
+    out.append('# TYPE {} {}'.format(self.name, self.type))
+    for values, child in sorted(self._children.items()):
+      self._render_child(out, values, child)
+
+
+class _Value(object):
+  __slots__ = ('_lock', 'value')
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.value = 0.0
+
+  def inc(self, amount=1):
+    with self._lock:
+      self.value += amount
+
+  def dec(self, amount=1):
+    with self._lock:
+      self.value -= amount
+
+  def set(self, value):
+    self.value = value
+
+
+class Counter(_Metric):
+  type = 'counter'
+
+  def _new_child(self):
+    return _Value()
+
+  def _render_child(self, out, values, child):
+    out.append('{}{} {}'.format(
+      self.name, _format_labels(self.labelnames, values), _format_value(child.value)))
+
+
+class Gauge(Counter):
+  type = 'gauge'
+
+
+class _HistogramChild(object):
+  __slots__ = ('_lock', '_bounds', 'counts', 'sum')
+
+  def __init__(self, bounds):
+    self._lock = threading.Lock()
+    self._bounds = bounds
+    # one count per bucket, the last one for +Inf; not cumulative
+    self.counts = [0] * (len(bounds) + 1)
+    self.sum = 0.0
+
+  def observe(self, value):
+    i = bisect.bisect_left(self._bounds, value)
+    with self._lock:
+      self.counts[i] += 1
+      self.sum += value
+
+
+class Histogram(_Metric):
+  type = 'histogram'
+
+  def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    super().__init__(name, documentation, labelnames)
+    self.buckets = tuple(sorted(buckets))
+
+  def _new_child(self):
+    return _HistogramChild(self.buckets)
+
+  def _render_child(self, out, values, child):
+    with child._lock:
+      counts = list(child.counts)
+      total = child.sum
+    cumulative = 0
+    for bound, count in zip(self.buckets + (math.inf,), counts):
+      cumulative += count
+      out.append('{}_bucket{} {}'.format(
+        self.name, _format_labels(self.labelnames, values, 'le="{}"'.format(_format_value(bound))),
+        cumulative))
+    labels = _format_labels(self.labelnames, values)
+    out.append('{}_sum{} {}'.format(self.name, labels, _format_value(total)))
+    out.append('{}_count{} {}'.format(self.name, labels, cumulative))
+
+
+class Registry(object):
+  def __init__(self):
+    self._metrics = []
+    self._collectors = []
+
+  def counter(self, name, documentation, labelnames=()):
+    return self._register(Counter(name, documentation, labelnames))
+
+  def gauge(self, name, documentation, labelnames=()):
+    return self._register(Gauge(name, documentation, labelnames))
+
+  def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return self._register(Histogram(name, documentation, labelnames, buckets))
+
+  def add_collector(self, collect):
+    """Registers `collect`, called at scrape time.
+
+    It returns (name, type, documentation, samples) tuples, where samples
+    are (labels dict, value) pairs.
+    """
+    self._collectors.append(collect)
+
+  def render(self):
+    out = []
+    for metric in self._metrics:
+      metric.render(out)
+    for collect in self._collectors:
+      try:
+        families = list(collect())
+      except Exception as err:
+        logger.warning("metrics collector failed: {}".format(err))
+        continue
+      for name, metric_type, documentation, samples in families:
+        out.append('# HELP {} {}'.format(name, documentation))
+        out.append('# TYPE {} {}'.format(name, metric_type))
+        for labels, value in samples:
+          out.append('{}{} {}'.format(
+            name, _format_labels(labels.keys(), labels.values()), _format_value(value)))
+    out.append('')
+    return '\n'.join(out)
+
+  def _register(self, metric):
+    self._metrics.append(metric)
+    return metric
+
+
+def stats_collector(prefix, documentation, stats, counters=()):
+  """Returns a collector exporting the numeric entries of the dict `stats()` returns.
+
+  Keys in `counters` become `<prefix>_<key>_total` counters, the others
+  `<prefix>_<key>` gauges.
+  """
+  def collect():
+    for key, value in stats().items():
+      if isinstance(value, bool) or not isinstance(value, (int, float)):
+        continue
+      if key in counters:
+        yield ('{}_{}_total'.format(prefix, key), 'counter', '{} {}'.format(documentation, key),
+               [({}, value)])
+      else:
+        yield ('{}_{}'.format(prefix, key), 'gauge', '{} {}'.format(documentation, key),
+               [({}, value)])
+  return collect
+
+
+def state_collector(name, documentation, state, states):
+  """Returns a collector exporting a `name{state=...}` gauge per state in `states`.
+
+  The state `state()` returns is 1, the others 0.
+  """
+  def collect():
+    current = state()
+    yield (name, 'gauge', documentation,
+           [({'state': s}, int(s == current)) for s in states])
+  return collect
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+  registry = None
+  routes = {}
+
+  def do_GET(self):
+    path, _, query = self.path.partition('?')
+    if path == '/metrics':
+      status, content_type = 200, 'text/plain; version=0.0.4; charset=utf-8'
+      body = self.registry.render()
+    elif path in self.routes:
+      status, content_type, body = self.routes[path](query)
+    else:
+      self.send_error(404)
+      return
+    body = body.encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+def start_http_server(port, registry, routes=None):
+  """Serves `registry` on http://[::]:`port`/metrics from a daemon thread.
+
+  `routes` maps other paths to functions taking the query string and
+  returning the status, content type and body of the response.
+  """
+  handler = type('MetricsHandler', (_MetricsHandler,),
+                 {'registry': registry, 'routes': dict(routes or {})})
+  server = http.server.ThreadingHTTPServer(('', port), handler)
+  server.daemon_threads = True
+  threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+  logger.info("serving metrics on port: {}".format(port))
+  return server
+
+
+def metrics_port():
+  """The metrics port from METRICS_PORT (0 disables), offset by the worker index."""
+  port = int(os.environ.get('METRICS_PORT', "9464"))
+  if port <= 0:
+    return None
+  # pre-forked workers each serve their own metrics on consecutive ports
+  return port + int(os.environ.get('WORKER_INDEX', "0"))
+
+
+def _code(context, error):
+  code = context.code() if hasattr(context, 'code') else None
+  if isinstance(code, grpc.StatusCode):
+    return code.name
+  return 'UNKNOWN' if error else 'OK'
+
+
+class _RpcMetrics(object):
+  def __init__(self, registry):
+    self.latency = registry.histogram(
+      'grpc_server_handling_seconds', 'Time spent handling unary RPCs.', ('grpc_method',))
+    self.inflight = registry.gauge(
+      'grpc_server_inflight_rpcs', 'Unary RPCs being handled.', ('grpc_method',))
+    self.handled = registry.counter(
+      'grpc_server_handled_total', 'Unary RPCs completed, by status code.',
+      ('grpc_method', 'grpc_code'))
+
+  def children(self, method):
+    return self.latency.labels(method), self.inflight.labels(method)
+
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+  """Server interceptor recording latency, in-flight calls and status codes."""
+
+  def __init__(self, registry):
+    self._metrics = _RpcMetrics(registry)
+
+  def intercept_service(self, continuation, handler_call_details):
+    handler = continuation(handler_call_details)
+    if handler is None or handler.unary_unary is None:
+      return handler
+    method = handler_call_details.method
+    latency, inflight = self._metrics.children(method)
+    handled = self._metrics.handled
+    behavior = handler.unary_unary
+
+    @functools.wraps(behavior)
+    def measured(request, context):
+      inflight.inc()
+      start = time.perf_counter()
+      error = True
+      try:
+        response = behavior(request, context)
+        error = False
+        return response
+      finally:
+        latency.observe(time.perf_counter() - start)
+        inflight.dec()
+        handled.labels(method, _code(context, error)).inc()
+
+    return handler._replace(unary_unary=measured)
+
+
+class AsyncMetricsInterceptor(grpc.aio.ServerInterceptor):
+  """MetricsInterceptor for grpc.aio servers."""
+
+  def __init__(self, registry):
+    self._metrics = _RpcMetrics(registry)
+
+  async def intercept_service(self, continuation, handler_call_details):
+    handler = await continuation(handler_call_details)
+    if handler is None or handler.unary_unary is None:
+      return handler
+    method = handler_call_details.method
+    latency, inflight = self._metrics.children(method)
+    handled = self._metrics.handled
+    behavior = handler.unary_unary
+
+    @functools.wraps(behavior)
+    async def measured(request, context):
+      inflight.inc()
+      start = time.perf_counter()
+      error = True
+      try:
+        response = behavior(request, context)
+        if inspect.isawaitable(response):
+          response = await response
+        error = False
+        return response
+      finally:
+        latency.observe(time.perf_counter() - start)
+        inflight.dec()
+        handled.labels(method, _code(context, error)).inc()
+
+    return handler._replace(unary_unary=measured)
@@ -0,0 +1,259 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""On-demand, in-process stack sampling profiler.
+
+profile() starts a timer thread that, `rate` times a second for `seconds`,
+reads every other thread's stack with sys._current_frames() and counts
+identical stacks. It needs no tracing hooks, so code runs at full speed
+between samples, and it can be started in a running server:
+
+- GET /debug/profile?seconds=10&rate=100&format=collapsed on the metrics
+  port (profile_route), returning the result;
+- SIGUSR1 (install_signal_handler), writing the result to PROFILE_DIR.
+
+Results are collapsed stacks ("thread;outer;...;inner count" lines, for
+flamegraph.pl and most flame graph viewers) or speedscope JSON
+(https://www.speedscope.app). Threads waiting for work (blocked in lock,
+queue, selector, thread pool or grpc server waits) are left out unless
+`idle` is set.
+
+Under load, the cost is bounded: the rate is capped at MAX_RATE, the
+duration at MAX_SECONDS and stacks at MAX_DEPTH frames, at most
+`max_stacks` distinct stacks are kept (further samples of new stacks are
+only counted), and only one profile runs at a time.
+"""
+
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import urllib.parse
+
+from logger import getJSONLogger
+logger = getJSONLogger('profiler')
+
+MAX_RATE = 500
+MAX_SECONDS = 120
+MAX_DEPTH = 64
+
+# innermost Python frames of threads waiting for work, by file and function
+_IDLE_FRAMES = frozenset((
+  ('threading.py', 'wait'), ('threading.py', '_wait_for_tstate_lock'),
+  ('queue.py', 'get'), ('selectors.py', 'select'),
+  # ThreadPoolExecutor and grpc server threads block in C calls
+  ('thread.py', '_worker'), ('_server.py', '_serve')))
+
+_running = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+  """Raised when a profile is requested while another one is running."""
+
+
+def _idle(code):
+  return (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES
+
+
+def _frame_name(code):
+  return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                             code.co_firstlineno)
+
+
+class Profile(object):
+  """Counts of the stacks sampled, innermost frame last."""
+
+  def __init__(self, rate, max_stacks):
+    self.rate = rate
+    self.max_stacks = max_stacks
+    # (thread name, (code, ...)) -> samples
+    self.counts = {}
+    self.samples = 0
+    self.dropped = 0
+    self.seconds = 0.0
+
+  def add(self, thread, stack):
+    key = (thread, stack)
+    count = self.counts.get(key)
+    if count is not None:
+      self.counts[key] = count + 1
+    elif len(self.counts) < self.max_stacks:
+      self.counts[key] = 1
+    else:
+      self.dropped += 1
+    self.samples += 1
+
+  def collapsed(self):
+    """Returns the profile in the collapsed stack format."""
+    names = {}
+    lines = []
+    for (thread, stack), count in sorted(self.counts.items(), key=lambda x: -x[1]):
+      frames = [thread.replace(';', ':')]
+      for code in stack:
+        name = names.get(code)
+        if name is None:
+          name = names[code] = _frame_name(code).replace(';', ':')
+        frames.append(name)
+      lines.append('{} {}\n'.format(';'.join(frames), count))
+    return ''.join(lines)
+
+  def speedscope(self, name='profile'):
+    """Returns the profile as a speedscope file, in JSON."""
+    frames = []
+    indexes = {}
+
+    def index(key, frame):
+      i = indexes.get(key)
+      if i is None:
+        i = indexes[key] = len(frames)
+        frames.append(frame)
+      return i
+
+    samples = []
+    weights = []
+    for (thread, stack), count in self.counts.items():
+      sample = [index(('thread', thread), {'name': 'thread ' + thread})]
+      for code in stack:
+        sample.append(index(code, {'name': code.co_name, 'file': code.co_filename,
+                                   'line': code.co_firstlineno}))
+      samples.append(sample)
+      weights.append(count)
+    return json.dumps({
+      '$schema': 'https://www.speedscope.app/file-format-schema.json',
+      'name': name,
+      'exporter': 'profiler.py',
+      'shared': {'frames': frames},
+      'profiles': [{
+        'type': 'sampled', 'name': name, 'unit': 'none',
+        'startValue': 0, 'endValue': self.samples,
+        'samples': samples, 'weights': weights,
+      }],
+    })
+
+  def render(self, output_format, name='profile'):
+    if output_format == 'speedscope':
+      return self.speedscope(name)
+    return self.collapsed()
+
+
+def _sample(result, seconds, interval, idle):
+  own = threading.get_ident()
+  names = {}
+  start = time.monotonic()
+  deadline = start + seconds
+  next_sample = start
+  while True:
+    now = time.monotonic()
+    if now >= deadline:
+      break
+    if next_sample > now:
+      time.sleep(next_sample - now)
+    next_sample += interval
+    frames = sys._current_frames()
+    for ident, frame in frames.items():
+      if ident == own:
+        continue
+      if not idle and _idle(frame.f_code):
+        continue
+      stack = []
+      while frame is not None and len(stack) < MAX_DEPTH:
+        stack.append(frame.f_code)
+        frame = frame.f_back
+      stack.reverse()
+      name = names.get(ident)
+      if name is None:
+        names.update((t.ident, t.name) for t in threading.enumerate())
+        name = names.setdefault(ident, str(ident))
+      result.add(name, tuple(stack))
+    # don't keep the frames, and all they reference, alive until the next sample
+    frames = frame = None
+  result.seconds = time.monotonic() - start
+
+
+def profile(seconds=10.0, rate=100, idle=False, max_stacks=20000):
+  """Samples all threads' stacks for `seconds` at `rate` Hz and returns the Profile.
+
+  Raises ProfilerBusy if a profile is already running.
+  """
+  seconds = max(0.0, min(float(seconds), MAX_SECONDS))
+  rate = max(1, min(int(rate), MAX_RATE))
+  if not _running.acquire(blocking=False):
+    raise ProfilerBusy('a profile is already running')
+  try:
+    result = Profile(rate, max_stacks)
+    # a thread of its own, so that it is left out of its samples
+    sampler = threading.Thread(target=_sample, args=(result, seconds, 1.0 / rate, idle),
+                               name='profiler', daemon=True)
+    sampler.start()
+    sampler.join()
+  finally:
+    _running.release()
+  logger.info("profiled {:.1f}s at {}Hz: {} samples, {} stacks, {} dropped".format(
+    result.seconds, rate, result.samples, len(result.counts), result.dropped))
+  return result
+
+
+def profile_route(query):
+  """Handles GET /debug/profile; returns (status, content type, body)."""
+  params = urllib.parse.parse_qs(query)
+  output_format = params.get('format', ['collapsed'])[0]
+  if output_format not in ('collapsed', 'speedscope'):
+    return 400, 'text/plain', 'format must be collapsed or speedscope\n'
+  try:
+    result = profile(seconds=float(params.get('seconds', ['10'])[0]),
+                     rate=int(params.get('rate', ['100'])[0]),
+                     idle=params.get('idle', ['false'])[0].lower() in ('true', '1'))
+  except ValueError as err:
+    return 400, 'text/plain', '{}\n'.format(err)
+  except ProfilerBusy as err:
+    return 409, 'text/plain', '{}\n'.format(err)
+  if output_format == 'speedscope':
+    return 200, 'application/json', result.speedscope('pid {}'.format(os.getpid()))
+  return 200, 'text/plain', result.collapsed()
+
+
+def _profile_to_file(directory, seconds, rate, output_format):
+  try:
+    result = profile(seconds, rate)
+  except ProfilerBusy as err:
+    logger.warning("profile not started: {}".format(err))
+    return
+  extension = 'speedscope.json' if output_format == 'speedscope' else 'collapsed.txt'
+  path = os.path.join(directory, 'profile-{}-{}.{}'.format(
+    os.getpid(), time.strftime('%Y%m%d-%H%M%S'), extension))
+  with open(path, 'w') as f:
+    f.write(result.render(output_format, 'pid {}'.format(os.getpid())))
+  logger.info("profile written to {}".format(path))
+
+
+def install_signal_handler(signum=signal.SIGUSR1):
+  """Profiles on `signum` as configured by PROFILE_DIR, PROFILE_SECONDS,
+  PROFILE_RATE and PROFILE_FORMAT, writing the result to a file.
+
+  Must be called from the main thread.
+  """
+  directory = os.environ.get('PROFILE_DIR', "/tmp")
+  seconds = float(os.environ.get('PROFILE_SECONDS', "10"))
+  rate = int(os.environ.get('PROFILE_RATE', "100"))
+  output_format = os.environ.get('PROFILE_FORMAT', "collapsed")
+
+  def handle(signum, frame):
+    # the handler runs on the main thread, which must not wait for the profile
+    threading.Thread(target=_profile_to_file, args=(directory, seconds, rate, output_format),
+                     name='profile-signal', daemon=True).start()
+  signal.signal(signum, handle)
@@ -0,0 +1,184 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sampled per-request log records and periodic request summaries.
+
+Logging every request costs a formatted record per call. RequestLog lets
+handlers log only a sample of their requests, one in `every`: either
+counting calls, or by trace so that all services log the same requests
+(those whose trace id is a multiple of `every`). All requests, logged or
+not, go into a summary record emitted every `summary_interval` seconds,
+with counts, the most requested products and latency quantiles.
+
+request_log_from_env() reads REQUEST_LOG_EVERY, REQUEST_LOG_SAMPLING
+("count" or "trace") and REQUEST_LOG_SUMMARY_INTERVAL (seconds, 0 disables
+summaries).
+"""
+
+import collections
+import functools
+import inspect
+import itertools
+import os
+import random
+import threading
+import time
+
+import grpc
+
+try:
+  from opentelemetry import trace
+except ImportError:
+  trace = None
+
+
+def _quantile(values, q):
+  return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class RequestLog(object):
+  """Decides which requests to log and summarizes all of them."""
+
+  def __init__(self, logger, name, every=1, by_trace=False, summary_interval=60.0, top=5,
+               max_latencies=4096):
+    self._logger = logger
+    self.name = name
+    self._every = every
+    self._by_trace = by_trace and trace is not None
+    self._summary_interval = summary_interval
+    self._top = top
+    self._max_latencies = max_latencies
+    self._calls = itertools.count()
+    self._lock = threading.Lock()
+    self._reset(time.monotonic())
+
+  def sampled(self):
+    """Returns whether the current request should be logged."""
+    if self._every <= 1:
+      return self._every == 1
+    if self._by_trace:
+      context = trace.get_current_span().get_span_context()
+      if context.is_valid:
+        return context.trace_id % self._every == 0
+    return next(self._calls) % self._every == 0
+
+  def products(self, product_ids):
+    """Counts `product_ids` towards the summary's top products."""
+    with self._lock:
+      self._products.update(product_ids)
+
+  def observe(self, latency, failed=False):
+    """Records a finished request taking `latency` seconds."""
+    with self._lock:
+      self._requests += 1
+      self._failed += failed
+      # uniform sample of the interval's latencies, in bounded memory
+      if len(self._latencies) < self._max_latencies:
+        self._latencies.append(latency)
+      else:
+        i = random.randrange(self._requests)
+        if i < self._max_latencies:
+          self._latencies[i] = latency
+
+  def summary(self):
+    """Returns the summary of the requests since the last call, and starts a new one."""
+    now = time.monotonic()
+    with self._lock:
+      requests, failed, products, latencies = (
+        self._requests, self._failed, self._products, self._latencies)
+      seconds = now - self._since
+      self._reset(now)
+    latencies.sort()
+    summary = dict(requests=requests, failed=failed, seconds=round(seconds, 3),
+                   top_products=products.most_common(self._top))
+    if latencies:
+      summary['latency_ms'] = {
+        name: round(_quantile(latencies, q) * 1e3, 3)
+        for name, q in (('p50', .5), ('p90', .9), ('p99', .99), ('max', 1.0))}
+    return summary
+
+  def log_summary(self):
+    summary = self.summary()
+    if not summary['requests']:
+      return
+    latency = summary['latency_ms']
+    self._logger.info(
+      "{} summary: {} requests ({} failed) in {:.0f}s, p50 {}ms p99 {}ms, top {}".format(
+        self.name, summary['requests'], summary['failed'], summary['seconds'],
+        latency['p50'], latency['p99'], [p for p, _ in summary['top_products']]),
+      extra={'summary': summary})
+
+  def start(self):
+    """Starts logging summaries every `summary_interval` seconds from a daemon thread."""
+    if self._summary_interval > 0:
+      threading.Thread(target=self._run, name='request-log-summary', daemon=True).start()
+
+  def _run(self):
+    while True:
+      time.sleep(self._summary_interval)
+      self.log_summary()
+
+  def _reset(self, now):
+    self._since = now
+    self._requests = 0
+    self._failed = 0
+    self._products = collections.Counter()
+    self._latencies = []
+
+
+def _failed(context):
+  # handlers may set an error code instead of raising
+  code = context.code() if hasattr(context, 'code') else None
+  return isinstance(code, grpc.StatusCode) and code != grpc.StatusCode.OK
+
+
+def summarized(handler):
+  """Decorates a servicer method to record its latency in the servicer's `request_log`."""
+  if inspect.iscoroutinefunction(handler):
+    @functools.wraps(handler)
+    async def timed_async(self, request, context):
+      start = time.perf_counter()
+      failed = True
+      try:
+        response = await handler(self, request, context)
+        failed = _failed(context)
+        return response
+      finally:
+        self.request_log.observe(time.perf_counter() - start, failed)
+    return timed_async
+
+  @functools.wraps(handler)
+  def timed(self, request, context):
+    start = time.perf_counter()
+    failed = True
+    try:
+      response = handler(self, request, context)
+      failed = _failed(context)
+      return response
+    finally:
+      self.request_log.observe(time.perf_counter() - start, failed)
+  return timed
+
+
+def request_log_from_env(logger, name):
+  """Returns a started RequestLog configured by the environment."""
+  request_log = RequestLog(
+    logger, name,
+    every=int(os.environ.get('REQUEST_LOG_EVERY', "1")),
+    by_trace=os.environ.get('REQUEST_LOG_SAMPLING', "count").lower() == "trace",
+    summary_interval=float(os.environ.get('REQUEST_LOG_SUMMARY_INTERVAL', "60")))
+  request_log.start()
+  return request_log
@@ -0,0 +1,500 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import collections
+import itertools
+import os
+import queue
+import random
+import threading
+import time
+
+import grpc
+import demo_pb2
+from catalog_snapshot import read_snapshot, write_snapshot
+from circuit_breaker import CircuitOpenError
+from product_index import ProductIndex
+
+from logger import getJSONLogger
+logger = getJSONLogger('recommendationservice-catalog')
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls so that at most one is in flight.
+
+    Callers arriving while a call is running wait for it and share its
+    result (or its exception) instead of issuing their own.
+    """
+
+    def __init__(self, fn):
+        self._fn = fn
+        self._lock = threading.Lock()
+        self._call = None
+
+    def do(self, timeout=None):
+        """Returns the result of the shared call, waiting at most `timeout` seconds.
+
+        Raises TimeoutError when the call takes longer; it keeps running for
+        the other callers, and for the next one.
+        """
+        with self._lock:
+            call = self._call
+            leader = call is None
+            if leader:
+                call = self._call = _Call()
+        if leader and timeout is None:
+            self._run(call)
+        elif leader:
+            threading.Thread(target=self._run, args=(call,), daemon=True).start()
+        if not call.done.wait(timeout):
+            raise TimeoutError('catalog fetch still running after {:.3f}s'.format(timeout))
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def do_async(self):
+        """Starts a call in a background thread unless one is already running."""
+        with self._lock:
+            if self._call is not None:
+                return
+            call = self._call = _Call()
+        threading.Thread(target=self._run, args=(call,), daemon=True).start()
+
+    def _run(self, call):
+        try:
+            call.result = self._fn()
+        except Exception as err:
+            call.error = err
+        finally:
+            with self._lock:
+                self._call = None
+            call.done.set()
+
+
+class CatalogCache(object):
+    """In-process snapshot of the product catalog.
+
+    A daemon thread re-fetches the catalog every `interval` seconds (plus or
+    minus `jitter` as a fraction of the interval, so that replicas don't
+    refresh in lockstep). Request handlers only ever read the local snapshot
+    and never call productcatalogservice themselves once it is warm.
+
+    A snapshot older than `ttl` seconds is still served, while a refresh runs
+    in the background, until it is `max_staleness` seconds old. Past that, or
+    when there is no snapshot yet, callers wait for a fresh fetch. All fetches
+    go through a SingleFlight, so concurrent callers share one ListProducts
+    call rather than stampeding productcatalogservice.
+
+    Refreshes are read-copy-update: the new ProductIndex is built off to the
+    side and published with a single reference assignment. Readers take no
+    lock and never wait for a refresh that isn't needed to serve them. Only
+    the products that changed since the previous snapshot are applied to
+    its copy, and an unchanged catalog keeps the previous index, version
+    included, so results cached for it stay valid.
+
+    With a `snapshot_path`, every new snapshot is also written to that file,
+    and load_snapshot() serves it after a restart until the first refresh.
+
+    Every ListProducts call has a `fetch_timeout`, and callers waiting for a
+    fetch can give up earlier, e.g. when their own deadline is close. With
+    `hedge` set, a second call is sent when the first one is slower than the
+    95th percentile of recent fetches, and the first response wins. A caller
+    that can't get a fresh snapshot falls back to the last one, however
+    stale, or to an index of the `fallback_products` ids.
+
+    `fetch_latency`, e.g. a metrics.Histogram child, observes the duration
+    in seconds of every ListProducts call, failed ones included.
+
+    With a circuit_breaker.CircuitBreaker as `breaker`, fetches fail fast
+    with CircuitOpenError while productcatalogservice keeps failing or
+    timing out, and callers are served from the fallbacks above.
+
+    `stub` is a catalog_wire.ProductCatalogLiteStub or a catalog_channel.StubPool.
+    """
+
+    def __init__(self, stub, interval=60.0, jitter=0.1, ttl=120.0,
+                 max_staleness=600.0, snapshot_path=None, fetch_timeout=5.0,
+                 hedge=False, hedge_min_delay=0.05, fallback_products=None,
+                 breaker=None, fetch_latency=None):
+        self._stub = stub
+        self._fetch_latency = fetch_latency
+        self._breaker = breaker
+        self._snapshot_path = snapshot_path
+        self._fetch_timeout = fetch_timeout
+        self._hedge = hedge
+        self._hedge_min_delay = hedge_min_delay
+        # latencies of recent successful fetches, for the hedging delay
+        self._latencies = collections.deque(maxlen=100)
+        self._fallback_index = None
+        if fallback_products:
+            self._fallback_index = ProductIndex([(x, ()) for x in fallback_products], 0)
+        self.timeouts = 0
+        self.hedges = 0
+        self.fallbacks = 0
+        self._interval = interval
+        self._jitter = jitter
+        self._ttl = ttl
+        self._max_staleness = max(ttl, max_staleness)
+        # (index, fetched_at) so that readers see both in one read
+        self._snapshot = None
+        self._versions = itertools.count(1)
+        self._stats = dict(products=0, version=0, rebuilds=0, rebuild_seconds=0.0,
+                           added=0, removed=0, changed=0)
+        self._flight = SingleFlight(self._fetch)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        return self._flight.do()
+
+    def index(self, timeout=None):
+        """Returns the ProductIndex of the current catalog snapshot.
+
+        Waits at most `timeout` seconds for a fetch, if one is needed, before
+        falling back. Raises the fetch error when there is nothing to fall
+        back to.
+        """
+        index = self._cached()
+        if index is None:
+            # cold or too stale to serve: wait for the (shared) fetch
+            try:
+                index = self._flight.do(self._wait_timeout(timeout))
+            except TimeoutError as err:
+                self.timeouts += 1
+                index = self._fallback(err)
+            except (grpc.RpcError, CircuitOpenError) as err:
+                index = self._fallback(err)
+        return index
+
+    def refresh_in_background(self):
+        """Starts a refresh without waiting for it."""
+        self._revalidate()
+
+    def load_snapshot(self):
+        """Loads the snapshot file, if any; returns its index or None.
+
+        The loaded snapshot counts as stale: it is served right away, and
+        the first request that reads it triggers a refresh.
+        """
+        if self._snapshot_path is None or not os.path.exists(self._snapshot_path):
+            return None
+        try:
+            products, mtime = read_snapshot(self._snapshot_path)
+        except (OSError, ValueError) as err:
+            logger.warning("failed to load catalog snapshot: {}".format(err))
+            return None
+        index = self._publish(products, fetched_at=time.monotonic() - self._ttl, persist=False)
+        logger.info("loaded catalog snapshot: {} products, written {:.0f}s ago".format(
+            len(index), max(0.0, time.time() - mtime)))
+        return index
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='catalog-refresher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self):
+        """Size and version of the snapshot, what its last refresh changed and counters."""
+        stats = dict(self._stats, timeouts=self.timeouts, hedges=self.hedges,
+                     fallbacks=self.fallbacks)
+        if self._breaker is not None:
+            stats.update(('circuit_' + k, v) for k, v in self._breaker.stats().items())
+        return stats
+
+    def _cached(self):
+        """Returns the snapshot's index if it can be served, else None."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        index, fetched_at = snapshot
+        age = time.monotonic() - fetched_at
+        if age < self._ttl:
+            return index
+        if age < self._max_staleness:
+            # stale-while-revalidate
+            self._revalidate()
+            return index
+        return None
+
+    def _revalidate(self):
+        self._flight.do_async()
+
+    def _wait_timeout(self, timeout):
+        """`timeout`, or None when it is longer than a fetch can take.
+
+        Calls without a deadline have about 9.2e18s left, which Event.wait
+        rejects; waiting that long means waiting for the fetch to end.
+        """
+        longest = self._fetch_timeout
+        if longest is None:
+            longest = threading.TIMEOUT_MAX
+        elif self._hedge:
+            longest += self._hedge_delay()
+        if timeout is not None and timeout >= min(longest, threading.TIMEOUT_MAX):
+            return None
+        return timeout
+
+    def _fallback(self, err):
+        snapshot = self._snapshot
+        if snapshot is not None:
+            index = snapshot[0]
+        elif self._fallback_index is not None:
+            index = self._fallback_index
+        else:
+            raise err
+        self.fallbacks += 1
+        return index
+
+    def _hedge_delay(self):
+        latencies = sorted(self._latencies)
+        if not latencies:
+            return self._hedge_min_delay
+        return max(self._hedge_min_delay, latencies[int(len(latencies) * 0.95)])
+
+    def _record(self, start, err=None):
+        latency = time.monotonic() - start
+        if self._fetch_latency is not None:
+            self._fetch_latency.observe(latency)
+        if err is None:
+            self._latencies.append(latency)
+        elif isinstance(err, grpc.RpcError) and err.code() == grpc.StatusCode.DEADLINE_EXCEEDED:
+            self.timeouts += 1
+
+    def _publish(self, products, fetched_at=None, persist=True):
+        start = time.perf_counter()
+        snapshot = self._snapshot
+        if snapshot is None:
+            index = ProductIndex(products, next(self._versions))
+            added, removed, changed = len(index), 0, 0
+        else:
+            index, diff = snapshot[0].updated(products, next(self._versions))
+            added, removed, changed = len(diff.added), len(diff.removed), len(diff.changed)
+        self._stats = dict(products=len(index), version=index.version,
+                           rebuilds=self._stats['rebuilds'] + 1,
+                           rebuild_seconds=time.perf_counter() - start,
+                           added=added, removed=removed, changed=changed)
+        # readers pick up the new snapshot with a single reference read and
+        # keep the one they already hold until their request is done
+        self._snapshot = (index, time.monotonic() if fetched_at is None else fetched_at)
+        if persist and self._snapshot_path is not None and (
+                snapshot is None or snapshot[0] is not index):
+            self._persist(index)
+        return index
+
+    def _persist(self, index):
+        try:
+            write_snapshot(self._snapshot_path, zip(index.product_ids, index.categories))
+        except OSError as err:
+            logger.warning("failed to write catalog snapshot: {}".format(err))
+
+    def _fetch(self):
+        return self._publish(self._call_catalog())
+
+    def _call_catalog(self):
+        breaker = self._breaker
+        if breaker is None:
+            return self._send()
+        if not breaker.allow():
+            raise CircuitOpenError('productcatalogservice circuit is open')
+        start = time.monotonic()
+        failed = True
+        try:
+            products = self._send()
+            failed = False
+            return products
+        finally:
+            # whatever ends the call, a half-open breaker waits for its outcome
+            breaker.record(time.monotonic() - start, failed)
+
+    def _send(self):
+        stub = self._stub
+        request = demo_pb2.Empty()
+        start = time.monotonic()
+        if not self._hedge:
+            try:
+                products = stub.ListProductsLite(request, timeout=self._fetch_timeout)
+            except grpc.RpcError as err:
+                self._record(start, err)
+                raise
+            self._record(start)
+            return products
+
+        done = queue.Queue()
+        first = stub.ListProductsLite.future(request, timeout=self._fetch_timeout)
+        first.add_done_callback(done.put)
+        # call -> when it was sent, so each call's latency is its own
+        calls = {first: start}
+        try:
+            finished = done.get(timeout=self._hedge_delay())
+        except queue.Empty:
+            self.hedges += 1
+            hedged = stub.ListProductsLite.future(request, timeout=self._fetch_timeout)
+            calls[hedged] = time.monotonic()
+            hedged.add_done_callback(done.put)
+            finished = done.get()
+        # the first successful response wins, the other call is cancelled;
+        # with a StubPool, the hedged call went out on another channel
+        remaining = len(calls)
+        while True:
+            err = finished.exception()
+            self._record(calls[finished], err)
+            remaining -= 1
+            if err is None:
+                for other in calls:
+                    other.cancel()
+                return finished.result()
+            if not remaining:
+                raise err
+            finished = done.get()
+
+    def _log_refresh(self):
+        stats = self._stats
+        logger.info("refreshed product catalog: {} products, +{} -{} ~{} in {:.2f}ms".format(
+            stats['products'], stats['added'], stats['removed'], stats['changed'],
+            stats['rebuild_seconds'] * 1e3))
+
+    def _next_delay(self):
+        spread = self._interval * self._jitter
+        return max(0.0, self._interval + random.uniform(-spread, spread))
+
+    def _run(self):
+        while not self._stopped.wait(self._next_delay()):
+            try:
+                self.refresh()
+                self._log_refresh()
+            except (grpc.RpcError, CircuitOpenError) as err:
+                logger.warning("failed to refresh product catalog: {}".format(err))
+
+
+class AsyncCatalogCache(CatalogCache):
+    """CatalogCache for the grpc.aio server.
+
+    Same snapshot and staleness rules as CatalogCache, but `stub` wraps a
+    grpc.aio channel, fetches are coalesced on a shared asyncio task and the
+    refresher runs as a task on the event loop instead of a thread.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._inflight = None
+        self._task = None
+
+    async def refresh(self):
+        # shield so that a cancelled caller doesn't cancel everyone's fetch
+        return await asyncio.shield(self._start_fetch())
+
+    async def index(self, timeout=None):
+        index = self._cached()
+        if index is None:
+            try:
+                index = await asyncio.wait_for(self.refresh(), self._wait_timeout(timeout))
+            except asyncio.TimeoutError as err:
+                self.timeouts += 1
+                index = self._fallback(err)
+            except (grpc.RpcError, CircuitOpenError) as err:
+                index = self._fallback(err)
+        return index
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run_async())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def _revalidate(self):
+        self._start_fetch()
+
+    def _start_fetch(self):
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._fetch_async())
+            self._inflight.add_done_callback(self._fetch_done)
+        return self._inflight
+
+    def _fetch_done(self, task):
+        self._inflight = None
+        if not task.cancelled():
+            # retrieve the error so that an unawaited revalidation doesn't
+            # warn about it, callers that await the fetch still see it
+            task.exception()
+
+    async def _fetch_async(self):
+        return self._publish(await self._call_catalog_async())
+
+    async def _call_catalog_async(self):
+        breaker = self._breaker
+        if breaker is None:
+            return await self._send_async()
+        if not breaker.allow():
+            raise CircuitOpenError('productcatalogservice circuit is open')
+        start = time.monotonic()
+        failed = True
+        try:
+            products = await self._send_async()
+            failed = False
+            return products
+        finally:
+            # cancellation included
+            breaker.record(time.monotonic() - start, failed)
+
+    async def _send_async(self):
+        stub = self._stub
+        request = demo_pb2.Empty()
+        first = asyncio.ensure_future(stub.ListProductsLite(request, timeout=self._fetch_timeout))
+        # task -> when its call was sent, so each call's latency is its own
+        starts = {first: time.monotonic()}
+        pending = {first}
+        if self._hedge:
+            done, _ = await asyncio.wait(pending, timeout=self._hedge_delay())
+            if not done:
+                self.hedges += 1
+                hedged = asyncio.ensure_future(
+                    stub.ListProductsLite(request, timeout=self._fetch_timeout))
+                starts[hedged] = time.monotonic()
+                pending.add(hedged)
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                err = task.exception()
+                self._record(starts[task], err)
+                if err is None:
+                    for other in pending:
+                        other.cancel()
+                    return task.result()
+            if not pending:
+                raise err
+
+    async def _run_async(self):
+        while True:
+            await asyncio.sleep(self._next_delay())
+            try:
+                await self.refresh()
+                self._log_refresh()
+            except (grpc.RpcError, CircuitOpenError) as err:
+                logger.warning("failed to refresh product catalog: {}".format(err))
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Channels to productcatalogservice.
+
+A plain grpc.insecure_channel(addr) uses pick_first: one HTTP/2 connection
+to one backend for all calls. catalog_stub() builds its channels with a
+service config (round_robin by default, so that a target resolving to
+several replicas, e.g. a headless Service behind dns:///, spreads the
+calls), keepalive and message size options, and can open a pool of such
+channels that calls rotate over.
+"""
+
+import itertools
+import json
+
+import grpc
+
+from catalog_wire import ProductCatalogLiteStub
+
+
+def channel_options(lb_policy='round_robin', keepalive_time=300.0, keepalive_timeout=20.0,
+                    max_message_bytes=16 << 20, local_subchannels=False):
+    """Returns grpc channel arguments for calls to productcatalogservice.
+
+    `keepalive_time` is in seconds, 0 disables keepalive pings. Servers
+    reject clients that ping too often (grpc-go's default minimum is five
+    minutes), hence the default. `local_subchannels` gives the channel its
+    own connections instead of sharing them with identical channels.
+    """
+    options = [
+        ('grpc.service_config', json.dumps({'loadBalancingConfig': [{lb_policy: {}}]})),
+        ('grpc.max_receive_message_length', max_message_bytes),
+        ('grpc.max_send_message_length', max_message_bytes),
+    ]
+    if keepalive_time > 0:
+        options += [
+            ('grpc.keepalive_time_ms', int(keepalive_time * 1000)),
+            ('grpc.keepalive_timeout_ms', int(keepalive_timeout * 1000)),
+            ('grpc.keepalive_permit_without_calls', 0),
+            ('grpc.http2.max_pings_without_data', 0),
+        ]
+    if local_subchannels:
+        options.append(('grpc.use_local_subchannel_pool', 1))
+    return options
+
+
+class StubPool(object):
+    """Rotates calls over the stubs of several channels.
+
+    Has the ProductCatalogLiteStub interface, so it can be used wherever a
+    single stub is.
+    """
+
+    def __init__(self, stubs):
+        self._stubs = stubs
+        self._next = itertools.count()
+
+    @property
+    def ListProductsLite(self):
+        return self._stubs[next(self._next) % len(self._stubs)].ListProductsLite
+
+
+def catalog_stub(target, channels=1, aio=False, interceptors=(), **options):
+    """Returns a stub for `target` over a pool of `channels` channels.
+
+    `options` are passed to channel_options(). Calls go through the client
+    `interceptors`, grpc.aio ones if `aio` is set. Returns the stub and the
+    list of channels, for closing them.
+    """
+    # identical channels would share their connections otherwise
+    options.setdefault('local_subchannels', channels > 1)
+    args = channel_options(**options)
+    if aio:
+        pool = [grpc.aio.insecure_channel(target, options=args, interceptors=interceptors or None)
+                for _ in range(max(1, channels))]
+    else:
+        pool = [grpc.intercept_channel(grpc.insecure_channel(target, options=args), *interceptors)
+                for _ in range(max(1, channels))]
+    if len(pool) == 1:
+        return ProductCatalogLiteStub(pool[0]), pool
+    return StubPool([ProductCatalogLiteStub(channel) for channel in pool]), pool
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+from concurrent import futures
+
+import grpc
+import pytest
+
+import demo_pb2
+import demo_pb2_grpc
+from catalog_channel import StubPool, catalog_stub
+
+
+class _StandInCatalog(demo_pb2_grpc.ProductCatalogServiceServicer):
+    """Serves a one-product catalog named after the replica, and counts peers."""
+
+    def __init__(self, name, description=''):
+        self.name = name
+        self.description = description
+        self.peers = collections.Counter()
+
+    def ListProducts(self, request, context):
+        self.peers[context.peer()] += 1
+        return demo_pb2.ListProductsResponse(products=[
+            demo_pb2.Product(id=self.name, description=self.description)])
+
+
+@pytest.fixture
+def replicas():
+    servers = []
+    catalogs = []
+    ports = []
+    for n in range(3):
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+        catalog = _StandInCatalog('replica{}'.format(n), description='x' * 1000)
+        demo_pb2_grpc.add_ProductCatalogServiceServicer_to_server(catalog, server)
+        ports.append(server.add_insecure_port('127.0.0.1:0'))
+        server.start()
+        servers.append(server)
+        catalogs.append(catalog)
+    # one target resolving to all replicas, like a headless Service does
+    target = 'ipv4:' + ','.join('127.0.0.1:{}'.format(port) for port in ports)
+    yield target, catalogs
+    for server in servers:
+        server.stop(0)
+
+
+def _call(stub, n):
+    return collections.Counter(
+        stub.ListProductsLite(demo_pb2.Empty(), timeout=5)[0][0] for _ in range(n))
+
+
+def test_round_robin_spreads_calls_over_replicas(replicas):
+    target, catalogs = replicas
+    stub, channels = catalog_stub(target, lb_policy='round_robin')
+    # round_robin connects to the replicas one after another
+    for channel in channels:
+        grpc.channel_ready_future(channel).result(timeout=5)
+    served = _call(stub, 60)
+    assert set(served) == {c.name for c in catalogs}
+    assert min(served.values()) >= 10
+    for channel in channels:
+        channel.close()
+
+
+def test_pick_first_sticks_to_one_replica(replicas):
+    target, _ = replicas
+    stub, channels = catalog_stub(target, lb_policy='pick_first')
+    assert len(_call(stub, 30)) == 1
+    for channel in channels:
+        channel.close()
+
+
+def test_pool_opens_separate_connections(replicas):
+    target, catalogs = replicas
+    stub, channels = catalog_stub(target, channels=3, lb_policy='pick_first')
+    assert isinstance(stub, StubPool)
+    _call(stub, 30)
+    peers = catalogs[0].peers
+    # every channel of the pool has its own connection to the first replica
+    assert len(peers) == 3
+    assert sorted(peers.values()) == [10, 10, 10]
+    for channel in channels:
+        channel.close()
+
+
+def test_max_message_size(replicas):
+    target, _ = replicas
+    stub, channels = catalog_stub(target, max_message_bytes=100)
+    with pytest.raises(grpc.RpcError) as err:
+        stub.ListProductsLite(demo_pb2.Empty(), timeout=5)
+    assert err.value.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+    for channel in channels:
+        channel.close()
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Catalog snapshots on local disk, for serving right after a restart.
+
+File layout (little-endian):
+
+    header   magic "RCAT", version u16, payload length u32
+    payload  ListProductsResponse with only Product.id and Product.categories
+
+The payload is what catalog_wire.encode_products writes and decode_products
+reads, so it is a fraction of the size of the full catalog and is decoded
+straight from the memory-mapped file. Files are written to a temporary name
+and renamed into place, so readers see either the old or the new snapshot.
+"""
+
+import mmap
+import os
+import struct
+
+from google.protobuf.message import DecodeError
+
+from catalog_wire import decode_products, encode_products
+
+_MAGIC = b'RCAT'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHI')
+
+
+def write_snapshot(path, products):
+    """Writes `products`, (id, categories) pairs, to `path`."""
+    payload = encode_products(products)
+    # unique per process, pre-forked workers may write at the same time
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, len(payload)))
+            f.write(payload)
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def read_snapshot(path):
+    """Returns the (id, categories) pairs and the modification time of `path`.
+
+    Raises OSError if the file can't be read and ValueError if it isn't a
+    complete snapshot.
+    """
+    with open(path, 'rb') as f:
+        mtime = os.fstat(f.fileno()).st_mtime
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if len(mm) < _HEADER.size:
+                raise ValueError('{} is truncated'.format(path))
+            magic, version, length = _HEADER.unpack_from(mm, 0)
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError('{} is not a version {} catalog snapshot'.format(path, _VERSION))
+            if len(mm) != _HEADER.size + length:
+                raise ValueError('{} is truncated'.format(path))
+            # views must be released before the mapping can be closed
+            with memoryview(mm) as view, view[_HEADER.size:] as payload:
+                try:
+                    return decode_products(payload), mtime
+                except DecodeError as err:
+                    raise ValueError('{} is corrupt: {}'.format(path, err))
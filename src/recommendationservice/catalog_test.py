@@ -0,0 +1,537 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import itertools
+import logging
+import random
+import threading
+import time
+from concurrent import futures
+
+import grpc
+import pytest
+
+import demo_pb2
+from catalog import AsyncCatalogCache, CatalogCache
+from product_index import ProductIndex
+from recommendation_server import RecommendationService
+
+# simulated ListProducts round trip; a reader that ever waits for a
+# refresh shows up as a call at least this slow
+FETCH_DELAY = 0.1
+
+
+class _ChangingCatalog(object):
+    """Returns a different catalog on every call.
+
+    Every product id and one category of every product carry the number of
+    the call, so results mixing two snapshots are easy to spot.
+    """
+
+    def __init__(self, delay=FETCH_DELAY):
+        self._delay = delay
+        self._calls = itertools.count()
+
+    def ListProductsLite(self, request, timeout=None):
+        n = next(self._calls)
+        time.sleep(self._delay)
+        size = 500 + (n % 7) * 50
+        return [('v{}-P{}'.format(n, i), ('v{}'.format(n), 'c{}'.format(i % 5)))
+                for i in range(size)]
+
+
+def _snapshot_of(product_id):
+    return product_id.split('-', 1)[0]
+
+
+def _check_index(index):
+    assert len(index.ordinals) == len(index.product_ids) == len(index.categories)
+    assert index.ordinals[index.product_ids[-1]] == len(index.product_ids) - 1
+    snapshots = {_snapshot_of(x) for x in index.product_ids}
+    assert len(snapshots) == 1
+    assert list(index.postings[snapshots.pop()]) == list(range(len(index.product_ids)))
+
+
+@pytest.fixture(autouse=True)
+def quiet_request_logs():
+    server_logger = logging.getLogger('recommendationservice-server')
+    level = server_logger.level
+    server_logger.setLevel(logging.WARNING)
+    yield
+    server_logger.setLevel(level)
+
+
+def test_index_is_immutable():
+    index = ProductIndex([('P1', ('a',))], version=1)
+    with pytest.raises(AttributeError):
+        index.product_ids = ()
+    with pytest.raises(AttributeError):
+        del index.version
+
+
+def _contents(index):
+    """The index as ids and category -> ids, independent of the ordinals."""
+    assert len(index.ordinals) == len(index.product_ids)
+    assert all(index.ordinals[x] == i for i, x in enumerate(index.product_ids))
+    postings = {c: sorted(index.product_ids[i] for i in ordinals)
+                for c, ordinals in index.postings.items()}
+    return dict(zip(index.product_ids, index.categories)), postings
+
+
+def test_incremental_update_matches_full_build():
+    rng = random.Random(7)
+    catalog = {'P{}'.format(i): ('c{}'.format(i % 5),) for i in range(200)}
+    index = ProductIndex(catalog.items(), version=1)
+    for version in range(2, 50):
+        for _ in range(rng.randrange(6)):
+            action = rng.random()
+            product_id = rng.choice(sorted(catalog))
+            if action < 0.3:
+                del catalog[product_id]
+            elif action < 0.6:
+                catalog[product_id] = tuple(rng.sample(['c0', 'c1', 'c2', 'c3', 'c5'], 2))
+            else:
+                catalog['N{}-{}'.format(version, rng.random())] = ('c{}'.format(rng.randrange(6)),)
+        updated, diff = index.updated(catalog.items(), version)
+        assert _contents(updated) == _contents(ProductIndex(catalog.items()))
+        if diff.added or diff.removed or diff.changed:
+            assert updated.version == version
+        else:
+            assert updated is index
+        index = updated
+
+
+def _best_of(runs, fn):
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@pytest.mark.parametrize('churn,categories', [
+    (0.01, lambda i: ('a{}'.format(i % 10), 'b{}'.format(i % 7))),
+    (0.06, lambda i: ('a{}'.format(i % 10), 'b{}'.format(i % 7))),
+    # one posting list holds every product
+    (0.06, lambda i: ('all',)),
+])
+def test_incremental_update_is_faster_than_full_build(churn, categories):
+    rng = random.Random(3)
+    catalog = {'P{}'.format(i): categories(i) for i in range(100000)}
+    index = ProductIndex(catalog.items(), version=1)
+    removals = int(len(catalog) * churn)
+    for product_id in rng.sample(sorted(catalog), removals):
+        del catalog[product_id]
+    for i in range(removals // 2):
+        catalog['N{}'.format(i)] = categories(i)
+    diff = index.diff(catalog)
+    # small enough that updated() takes the incremental path
+    assert len(diff.removed) + len(diff.added) <= ProductIndex.FULL_REBUILD_RATIO * len(index)
+    # the diff is computed on both paths
+    incremental = _best_of(3, lambda: index._apply(diff, catalog, 2))
+    full = _best_of(3, lambda: ProductIndex(catalog.items(), 2))
+    assert incremental < full, (incremental, full)
+
+
+def test_refresh_reports_diff():
+    catalog = {'P{}'.format(i): ('c',) for i in range(100)}
+
+    class _Stub(object):
+        def ListProductsLite(self, request, timeout=None):
+            return list(catalog.items())
+
+    cache = CatalogCache(_Stub())
+    first = cache.refresh()
+    assert cache.refresh() is first
+    catalog['P1'] = ('d',)
+    del catalog['P2']
+    catalog['P100'] = ('c',)
+    second = cache.refresh()
+    assert second.version > first.version
+    stats = cache.stats()
+    assert (stats['added'], stats['removed'], stats['changed']) == (1, 1, 1)
+    assert stats['products'] == 100
+
+
+def test_snapshot_file_survives_restart(tmp_path):
+    path = str(tmp_path / 'catalog.snapshot')
+    catalog = [('P1', ('a', 'b')), ('P2', ())]
+
+    class _Stub(object):
+        def ListProductsLite(self, request, timeout=None):
+            return list(catalog)
+
+    CatalogCache(_Stub(), snapshot_path=path).refresh()
+
+    class _Unavailable(object):
+        def ListProductsLite(self, request, timeout=None):
+            raise RuntimeError('productcatalogservice is down')
+
+    restarted = CatalogCache(_Unavailable(), snapshot_path=path)
+    index = restarted.load_snapshot()
+    assert list(zip(index.product_ids, index.categories)) == catalog
+    # served as is while the (failing) refresh runs in the background
+    assert restarted.index() is index
+
+
+def test_corrupt_snapshot_file_is_ignored(tmp_path):
+    path = tmp_path / 'catalog.snapshot'
+    path.write_bytes(b'RCAT\x01\x00garbage')
+    assert CatalogCache(None, snapshot_path=str(path)).load_snapshot() is None
+
+
+@pytest.mark.parametrize('mode', ['random', 'category'])
+def test_reads_during_continuous_refreshes(mode):
+    cache = CatalogCache(_ChangingCatalog(), interval=3600)
+    cache.refresh()
+    service = RecommendationService(cache, mode=mode)
+    stop = threading.Event()
+    errors = []
+    latencies = []
+    refreshes = []
+
+    def refresher():
+        while not stop.is_set():
+            cache.refresh()
+            refreshes.append(1)
+
+    def reader():
+        local = []
+        try:
+            while not stop.is_set():
+                index = cache.index()
+                _check_index(index)
+                request = demo_pb2.ListRecommendationsRequest(
+                    user_id='user', product_ids=list(index.product_ids[:3]))
+                start = time.perf_counter()
+                response = service.ListRecommendations(request, None)
+                local.append(time.perf_counter() - start)
+                assert len(response.product_ids) == 5
+                assert len({_snapshot_of(x) for x in response.product_ids}) == 1
+        except Exception as err:
+            errors.append(err)
+        latencies.extend(local)
+
+    threads = [threading.Thread(target=refresher)]
+    threads += [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads:
+        t.start()
+    time.sleep(1.5)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    assert not errors, errors[0]
+    assert len(refreshes) >= 5
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)]
+    assert p99 < FETCH_DELAY / 2, 'p99 {:.1f}ms'.format(p99 * 1e3)
+
+
+class _Context(object):
+    """Servicer context of a call with the given time left."""
+
+    def __init__(self, remaining):
+        self._remaining = remaining
+
+    def time_remaining(self):
+        return self._remaining
+
+    def abort(self, code, details):
+        raise AssertionError('aborted with {}: {}'.format(code, details))
+
+
+# what grpc's time_remaining() reports for a call without a deadline
+NO_DEADLINE = 9.2e18
+
+
+@pytest.mark.parametrize('warm', [False, True])
+def test_call_without_deadline_waits_for_fetch(warm):
+    cache = CatalogCache(_ChangingCatalog(), ttl=0.01, max_staleness=0.02)
+    if warm:
+        cache.refresh()
+        # too stale to serve, the call has to wait for a fetch
+        time.sleep(0.05)
+    service = RecommendationService(cache)
+    index = service.index(_Context(NO_DEADLINE))
+    _check_index(index)
+    assert cache.stats()['timeouts'] == 0
+
+
+class _RpcError(grpc.RpcError):
+    def __init__(self, code):
+        self._code = code
+
+    def code(self):
+        return self._code
+
+
+def _products(tag):
+    return [('{}-P{}'.format(tag, i), ('c',)) for i in range(3)]
+
+
+class _DelayedCalls(object):
+    """ListProductsLite whose n-th call answers, or fails, after delays[n] seconds."""
+
+    def __init__(self, delays, error=None):
+        self._delays = list(delays)
+        self._error = error
+        self._pool = futures.ThreadPoolExecutor(max_workers=4)
+        self.calls = 0
+
+    def _answer(self, n):
+        time.sleep(self._delays[n])
+        if self._error is not None:
+            raise self._error
+        return _products('call{}'.format(n))
+
+    def __call__(self, request, timeout=None):
+        n = self.calls
+        self.calls += 1
+        return self._answer(n)
+
+    def future(self, request, timeout=None):
+        n = self.calls
+        self.calls += 1
+        return self._pool.submit(self._answer, n)
+
+
+class _AsyncDelayedCalls(object):
+    """_DelayedCalls for grpc.aio stubs."""
+
+    def __init__(self, delays):
+        self._delays = list(delays)
+        self.calls = 0
+
+    async def __call__(self, request, timeout=None):
+        n = self.calls
+        self.calls += 1
+        await asyncio.sleep(self._delays[n])
+        return _products('call{}'.format(n))
+
+
+class _Stub(object):
+    def __init__(self, method):
+        self.ListProductsLite = method
+
+
+def _aged(cache, seconds):
+    """Makes the cache's snapshot `seconds` older; returns its index."""
+    index, fetched_at = cache._snapshot
+    cache._snapshot = (index, fetched_at - seconds)
+    return index
+
+
+def _timed(fn):
+    start = time.monotonic()
+    result = fn()
+    return result, time.monotonic() - start
+
+
+def _concurrently(n, fn):
+    """Calls `fn` from `n` threads at once; returns (result, seconds) per call."""
+    with futures.ThreadPoolExecutor(max_workers=n) as pool:
+        return list(pool.map(lambda _: _timed(fn), range(n)))
+
+
+async def _timed_async(fn):
+    start = time.monotonic()
+    result = await fn()
+    return result, time.monotonic() - start
+
+
+def _concurrently_async(n, cache):
+    """Reads `cache.index()` from `n` coroutines at once."""
+    async def main():
+        results = await asyncio.gather(*[_timed_async(cache.index) for _ in range(n)])
+        # let a revalidation started by the reads finish
+        while cache._inflight is not None:
+            await asyncio.sleep(0.01)
+        return results
+
+    return asyncio.run(main())
+
+
+def _wait_for_revalidation(cache, index):
+    deadline = time.monotonic() + 2.0
+    while cache._snapshot[0] is index:
+        assert time.monotonic() < deadline, 'revalidation did not finish'
+        time.sleep(0.01)
+
+
+def test_cold_callers_share_one_fetch():
+    method = _DelayedCalls([FETCH_DELAY] * 2)
+    cache = CatalogCache(_Stub(method))
+    results = _concurrently(8, cache.index)
+    assert method.calls == 1
+    assert len({id(index) for index, _ in results}) == 1
+    assert results[0][0].product_ids[0] == 'call0-P0'
+
+
+def test_stale_snapshot_is_served_while_one_fetch_revalidates():
+    method = _DelayedCalls([0.0] + [FETCH_DELAY] * 2)
+    cache = CatalogCache(_Stub(method), ttl=10.0, max_staleness=100.0)
+    cache.refresh()
+    first = _aged(cache, 50.0)
+    results = _concurrently(8, cache.index)
+    assert all(index is first for index, _ in results)
+    assert max(seconds for _, seconds in results) < FETCH_DELAY / 2
+    _wait_for_revalidation(cache, first)
+    assert method.calls == 2
+    # fresh again, served without another fetch
+    assert cache.index().product_ids[0] == 'call1-P0'
+    assert method.calls == 2
+
+
+def test_too_stale_snapshot_makes_callers_wait():
+    method = _DelayedCalls([0.0] + [FETCH_DELAY] * 2)
+    cache = CatalogCache(_Stub(method), ttl=10.0, max_staleness=100.0)
+    cache.refresh()
+    _aged(cache, 150.0)
+    results = _concurrently(8, cache.index)
+    assert method.calls == 2
+    assert all(index.product_ids[0] == 'call1-P0' for index, _ in results)
+    assert min(seconds for _, seconds in results) > FETCH_DELAY / 2
+
+
+def test_async_cold_callers_share_one_fetch():
+    method = _AsyncDelayedCalls([FETCH_DELAY] * 2)
+    cache = AsyncCatalogCache(_Stub(method))
+    results = _concurrently_async(8, cache)
+    assert method.calls == 1
+    assert len({id(index) for index, _ in results}) == 1
+
+
+def test_async_stale_snapshot_is_served_while_one_fetch_revalidates():
+    method = _AsyncDelayedCalls([0.0] + [FETCH_DELAY] * 2)
+    cache = AsyncCatalogCache(_Stub(method), ttl=10.0, max_staleness=100.0)
+    asyncio.run(cache.refresh())
+    first = _aged(cache, 50.0)
+    results = _concurrently_async(8, cache)
+    assert all(index is first for index, _ in results)
+    assert max(seconds for _, seconds in results) < FETCH_DELAY / 2
+    assert method.calls == 2
+    assert cache._snapshot[0].product_ids[0] == 'call1-P0'
+
+
+def test_async_too_stale_snapshot_makes_callers_wait():
+    method = _AsyncDelayedCalls([0.0] + [FETCH_DELAY] * 2)
+    cache = AsyncCatalogCache(_Stub(method), ttl=10.0, max_staleness=100.0)
+    asyncio.run(cache.refresh())
+    _aged(cache, 150.0)
+    results = _concurrently_async(8, cache)
+    assert method.calls == 2
+    assert all(index.product_ids[0] == 'call1-P0' for index, _ in results)
+    assert min(seconds for _, seconds in results) > FETCH_DELAY / 2
+
+
+def test_slow_call_is_hedged():
+    method = _DelayedCalls([1.0, 0.0])
+    cache = CatalogCache(_Stub(method), hedge=True, hedge_min_delay=0.05)
+    start = time.monotonic()
+    index = cache.refresh()
+    assert time.monotonic() - start < 0.5
+    # the hedged call answered first
+    assert index.product_ids[0] == 'call1-P0'
+    assert method.calls == 2
+    assert cache.stats()['hedges'] == 1
+    # timed from when the hedged call went out, not the first one
+    assert list(cache._latencies) == [pytest.approx(0.0, abs=0.03)]
+
+
+def test_fast_call_is_not_hedged():
+    method = _DelayedCalls([0.0, 0.0])
+    cache = CatalogCache(_Stub(method), hedge=True, hedge_min_delay=0.05)
+    cache.refresh()
+    assert method.calls == 1
+    assert cache.stats()['hedges'] == 0
+
+
+def test_hedged_call_failures_raise_the_last_error():
+    method = _DelayedCalls([0.2, 0.0], error=_RpcError(grpc.StatusCode.UNAVAILABLE))
+    cache = CatalogCache(_Stub(method), hedge=True, hedge_min_delay=0.05)
+    with pytest.raises(grpc.RpcError):
+        cache.refresh()
+    assert method.calls == 2
+
+
+def test_async_slow_call_is_hedged():
+    method = _AsyncDelayedCalls([1.0, 0.0])
+    cache = AsyncCatalogCache(_Stub(method), hedge=True, hedge_min_delay=0.05)
+    index = asyncio.run(asyncio.wait_for(cache.refresh(), 0.5))
+    assert index.product_ids[0] == 'call1-P0'
+    assert cache.stats()['hedges'] == 1
+    assert list(cache._latencies) == [pytest.approx(0.0, abs=0.03)]
+
+
+class _FailAfterFirst(object):
+    def __init__(self, code=grpc.StatusCode.UNAVAILABLE):
+        self._code = code
+        self.calls = 0
+
+    def ListProductsLite(self, request, timeout=None):
+        self.calls += 1
+        if self.calls > 1:
+            raise _RpcError(self._code)
+        return _products('first')
+
+
+def test_failed_fetch_falls_back_to_last_snapshot():
+    stub = _FailAfterFirst()
+    # every snapshot is too stale to serve without a fetch
+    cache = CatalogCache(stub, ttl=0, max_staleness=0, fallback_products=['F1'])
+    first = cache.refresh()
+    assert cache.index() is first
+    assert stub.calls == 2
+    stats = cache.stats()
+    assert (stats['fallbacks'], stats['timeouts']) == (1, 0)
+
+
+def test_deadline_exceeded_fetch_counts_as_timeout():
+    cache = CatalogCache(_FailAfterFirst(grpc.StatusCode.DEADLINE_EXCEEDED), ttl=0,
+                         max_staleness=0)
+    first = cache.refresh()
+    assert cache.index() is first
+    stats = cache.stats()
+    assert (stats['fallbacks'], stats['timeouts']) == (1, 1)
+
+
+def test_failed_cold_fetch_falls_back_to_fallback_ids():
+    method = _DelayedCalls([0.0], error=_RpcError(grpc.StatusCode.UNAVAILABLE))
+    cache = CatalogCache(_Stub(method), fallback_products=['F1', 'F2'])
+    index = cache.index()
+    assert list(index.product_ids) == ['F1', 'F2']
+    assert cache.stats()['fallbacks'] == 1
+
+
+def test_slow_cold_fetch_times_out_to_fallback_ids():
+    cache = CatalogCache(_Stub(_DelayedCalls([0.5])), fallback_products=['F1'])
+    start = time.monotonic()
+    index = cache.index(timeout=0.05)
+    assert time.monotonic() - start < 0.3
+    assert list(index.product_ids) == ['F1']
+    stats = cache.stats()
+    assert (stats['fallbacks'], stats['timeouts']) == (1, 1)
+
+
+def test_failed_fetch_without_fallback_raises():
+    method = _DelayedCalls([0.0], error=_RpcError(grpc.StatusCode.UNAVAILABLE))
+    cache = CatalogCache(_Stub(method))
+    with pytest.raises(grpc.RpcError):
+        cache.index()
+    assert cache.stats()['fallbacks'] == 0
@@ -0,0 +1,215 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Hand-rolled protobuf wire format handling for the recommendation hot paths.
+
+The recommendation service only needs product ids and categories, but
+parsing the response with demo_pb2 (forced to the pure-Python protobuf
+implementation in the Dockerfile) builds every Product with its
+description, picture and price. decode_products walks the serialized bytes
+instead, reads fields 1 (id) and 6 (categories) of each Product and jumps
+over everything else.
+
+encode_recommendations does the reverse for ListRecommendationsResponse,
+which is just a repeated string, without building a demo_pb2 message, and
+encode_recommendations_batch wraps such responses into a
+ListRecommendationsBatchResponse. encode_products writes a
+ListProductsResponse with only ids and categories, which decode_products
+reads back.
+"""
+
+from google.protobuf.message import DecodeError
+
+import demo_pb2
+
+# wire types
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+_FIXED32 = 5
+
+# ListProductsResponse.products, Product.id and Product.categories
+_PRODUCTS_TAG = (1 << 3) | _LENGTH_DELIMITED
+_ID_TAG = (1 << 3) | _LENGTH_DELIMITED
+_CATEGORIES_TAG = (6 << 3) | _LENGTH_DELIMITED
+# ListRecommendationsResponse.product_ids, ListRecommendationsBatchResponse.responses
+_RECOMMENDED_TAG = (1 << 3) | _LENGTH_DELIMITED
+_RESPONSES_TAG = (1 << 3) | _LENGTH_DELIMITED
+
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        try:
+            b = data[pos]
+        except IndexError:
+            raise DecodeError('truncated varint')
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+        if shift >= 64:
+            raise DecodeError('varint too long')
+
+
+def _skip_field(data, pos, wire_type):
+    if wire_type == _VARINT:
+        _, pos = _read_varint(data, pos)
+    elif wire_type == _LENGTH_DELIMITED:
+        length, pos = _read_varint(data, pos)
+        pos += length
+    elif wire_type == _FIXED64:
+        pos += 8
+    elif wire_type == _FIXED32:
+        pos += 4
+    else:
+        raise DecodeError('unsupported wire type {}'.format(wire_type))
+    return pos
+
+
+def _read_length(data, pos, limit):
+    if pos >= limit:
+        raise DecodeError('truncated message')
+    # single-byte lengths are by far the most common, skip the loop for them
+    b = data[pos]
+    if b < 0x80:
+        length, pos = b, pos + 1
+    else:
+        length, pos = _read_varint(data, pos)
+    if pos + length > limit:
+        raise DecodeError('truncated message')
+    return length, pos
+
+
+def _decode_product(data, pos, end):
+    product_id = ''
+    categories = []
+    while pos < end:
+        tag = data[pos]
+        if tag < 0x80:
+            pos += 1
+        else:
+            tag, pos = _read_varint(data, pos)
+        if tag == _ID_TAG:
+            length, pos = _read_length(data, pos, end)
+            # last one wins, as in a regular protobuf parse
+            product_id = str(data[pos:pos + length], 'utf-8')
+            pos += length
+        elif tag == _CATEGORIES_TAG:
+            length, pos = _read_length(data, pos, end)
+            categories.append(str(data[pos:pos + length], 'utf-8'))
+            pos += length
+        else:
+            pos = _skip_field(data, pos, tag & 0x7)
+    if pos != end:
+        raise DecodeError('truncated message')
+    return product_id, tuple(categories)
+
+
+def decode_products(data):
+    """Returns (id, categories) for each product in a serialized ListProductsResponse.
+
+    Raises DecodeError if `data` is truncated or corrupt.
+    """
+    products = []
+    append = products.append
+    pos = 0
+    end = len(data)
+    try:
+        while pos < end:
+            tag = data[pos]
+            if tag < 0x80:
+                pos += 1
+            else:
+                tag, pos = _read_varint(data, pos)
+            if tag == _PRODUCTS_TAG:
+                length, pos = _read_length(data, pos, end)
+                append(_decode_product(data, pos, pos + length))
+                pos += length
+            else:
+                pos = _skip_field(data, pos, tag & 0x7)
+    except UnicodeDecodeError as err:
+        # as a regular protobuf parse reports it
+        raise DecodeError('invalid UTF-8 in string field: {}'.format(err))
+    if pos != end:
+        raise DecodeError('truncated message')
+    return products
+
+
+def _encode_varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _encode_string(tag, value):
+    encoded = value.encode('utf-8')
+    return bytes((tag,)) + _encode_varint(len(encoded)) + encoded
+
+
+def encode_products(products):
+    """Returns a serialized ListProductsResponse of (id, categories) pairs."""
+    out = []
+    for product_id, categories in products:
+        product = _encode_string(_ID_TAG, product_id) + b''.join(
+            _encode_string(_CATEGORIES_TAG, category) for category in categories)
+        out.append(bytes((_PRODUCTS_TAG,)) + _encode_varint(len(product)) + product)
+    return b''.join(out)
+
+
+def encode_recommendations(product_ids):
+    """Returns a serialized ListRecommendationsResponse holding `product_ids`."""
+    out = []
+    for product_id in product_ids:
+        encoded = product_id.encode('utf-8')
+        length = len(encoded)
+        out.append(bytes((_RECOMMENDED_TAG, length)) if length < 0x80
+                   else bytes((_RECOMMENDED_TAG,)) + _encode_varint(length))
+        out.append(encoded)
+    return b''.join(out)
+
+
+def encode_recommendations_batch(responses):
+    """Returns a serialized ListRecommendationsBatchResponse.
+
+    `responses` are serialized ListRecommendationsResponses, such as the ones
+    returned by encode_recommendations, and are embedded as they are.
+    """
+    out = []
+    for data in responses:
+        out.append(bytes((_RESPONSES_TAG,)) + _encode_varint(len(data)))
+        out.append(data)
+    return b''.join(out)
+
+
+class ProductCatalogLiteStub(object):
+    """ProductCatalogService stub whose ListProducts only yields ids and categories.
+
+    It calls the regular ListProducts method; only the response is decoded
+    with decode_products instead of demo_pb2.ListProductsResponse.
+    """
+
+    def __init__(self, channel):
+        self.ListProductsLite = channel.unary_unary(
+                '/hipstershop.ProductCatalogService/ListProducts',
+                request_serializer=demo_pb2.Empty.SerializeToString,
+                response_deserializer=decode_products,
+                )
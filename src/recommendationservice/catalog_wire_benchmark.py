@@ -0,0 +1,69 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares decode_products with a full ListProductsResponse parse.
+
+    python catalog_wire_benchmark.py [num_products ...]
+"""
+
+import os
+import sys
+import timeit
+
+# match the protobuf implementation the Dockerfile runs with
+os.environ.setdefault('PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION', 'python')
+
+import demo_pb2
+from catalog_wire import decode_products
+
+
+def make_catalog(num_products):
+    response = demo_pb2.ListProductsResponse()
+    for i in range(num_products):
+        product = response.products.add()
+        product.id = 'PRODUCT{:08d}'.format(i)
+        product.name = 'Product {}'.format(i)
+        product.description = 'A reasonably long description of product {}.'.format(i) * 3
+        product.picture = '/static/img/products/product-{}.jpg'.format(i)
+        product.price_usd.currency_code = 'USD'
+        product.price_usd.units = i % 100
+        product.price_usd.nanos = 990000000
+        product.categories.extend(['accessories', 'kitchen'])
+    return response.SerializeToString()
+
+
+def full_parse(data):
+    cat_response = demo_pb2.ListProductsResponse.FromString(data)
+    return [(x.id, tuple(x.categories)) for x in cat_response.products]
+
+
+def bench(fn, data):
+    timer = timeit.Timer(lambda: fn(data))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10, 1000, 100000]
+    print('{:>10} {:>10} {:>14} {:>14} {:>9}'.format(
+        'products', 'bytes', 'full parse', 'lite', 'speedup'))
+    for size in sizes:
+        data = make_catalog(size)
+        assert decode_products(data) == full_parse(data)
+        full = bench(full_parse, data)
+        fast = bench(decode_products, data)
+        print('{:>10} {:>10} {:>12.1f}us {:>12.1f}us {:>8.1f}x'.format(
+            size, len(data), full * 1e6, fast * 1e6, full / fast))
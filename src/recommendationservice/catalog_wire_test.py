@@ -0,0 +1,119 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+from google.protobuf.message import DecodeError
+
+import demo_pb2
+from catalog_wire import (decode_products, encode_products, encode_recommendations,
+                          encode_recommendations_batch)
+
+
+def _full_response():
+    response = demo_pb2.ListProductsResponse()
+    response.products.add(
+        id='OLJCESPC7Z', name='Sunglasses', description='Add a modern touch.',
+        picture='/static/img/products/sunglasses.jpg',
+        price_usd=demo_pb2.Money(currency_code='USD', units=19, nanos=990000000),
+        categories=['accessories'])
+    # multi-byte lengths: an id, a category and a product longer than 127 bytes
+    response.products.add(id='P' * 300, description='d' * 1000,
+                          categories=['c' * 200, 'kitchen', 'kitchen'])
+    response.products.add(id='EMPTY')
+    return response
+
+
+def test_decodes_ids_and_categories_and_skips_the_rest():
+    assert decode_products(_full_response().SerializeToString()) == [
+        ('OLJCESPC7Z', ('accessories',)),
+        ('P' * 300, ('c' * 200, 'kitchen', 'kitchen')),
+        ('EMPTY', ()),
+    ]
+
+
+def test_empty_response():
+    assert decode_products(b'') == []
+
+
+def test_skips_unknown_fields_of_every_wire_type():
+    unknown = (
+        b'\x98\x06\x96\x01'                  # field 99, varint 150 (two-byte tag and value)
+        b'\x11' + b'\x01' * 8 +              # field 2, fixed64
+        b'\x1d' + b'\x02' * 4 +              # field 3, fixed32
+        b'\x22\x03abc')                      # field 4, length-delimited
+    product = b'\x0a\x02P1' + unknown + b'\x32\x01a'
+    data = unknown + b'\x0a' + bytes((len(product),)) + product + unknown
+    assert decode_products(data) == [('P1', ('a',))]
+
+
+def test_repeated_id_last_one_wins():
+    product = b'\x0a\x02P1\x32\x01a\x0a\x02P2\x32\x01b'
+    data = b'\x0a' + bytes((len(product),)) + product
+    assert decode_products(data) == [('P2', ('a', 'b'))]
+    assert demo_pb2.ListProductsResponse.FromString(data).products[0].id == 'P2'
+
+
+def test_non_minimal_varint_lengths():
+    # length 2 written in three bytes, still valid protobuf
+    product = b'\x0a\x82\x80\x00P1'
+    data = b'\x0a' + bytes((len(product),)) + product
+    assert decode_products(data) == [('P1', ())]
+
+
+def test_encode_products_round_trip():
+    products = [('P1', ('a', 'b')), ('Ü' * 100, ()), ('P3', ('x' * 300,))]
+    data = encode_products(products)
+    assert decode_products(data) == products
+    parsed = demo_pb2.ListProductsResponse.FromString(data)
+    assert [(p.id, tuple(p.categories)) for p in parsed.products] == products
+
+
+def test_every_truncation_fails_or_decodes_whole_products():
+    data = _full_response().SerializeToString()
+    boundaries = set()
+    pos = 0
+    for product in _full_response().products:
+        pos += len(demo_pb2.ListProductsResponse(products=[product]).SerializeToString())
+        boundaries.add(pos)
+    for cut in range(1, len(data)):
+        if cut in boundaries:
+            assert len(decode_products(data[:cut])) >= 1
+            continue
+        with pytest.raises(DecodeError):
+            decode_products(data[:cut])
+
+
+@pytest.mark.parametrize('data', [
+    b'\x0a\x05P1',                           # product longer than the data
+    b'\x0a\x04\x0a\x05P1',                   # id longer than its product
+    b'\x0a\x03\x11\x01\x02',                 # fixed64 past the end of the product
+    b'\x0b',                                 # wire type 3 (start group)
+    b'\x0a' + b'\xff' * 10 + b'\x01',        # varint longer than 64 bits
+    b'\x0a\x80',                             # truncated varint
+    b'\x0a\x03\x0a\x01\xff',                 # id that isn't UTF-8
+])
+def test_corrupt_input_raises_decode_error(data):
+    with pytest.raises(DecodeError):
+        decode_products(data)
+
+
+def test_encode_recommendations_parses_as_protobuf():
+    ids = ['P1', 'Ü' * 100]
+    data = encode_recommendations(ids)
+    assert list(demo_pb2.ListRecommendationsResponse.FromString(data).product_ids) == ids
+    batch = demo_pb2.ListRecommendationsBatchResponse.FromString(
+        encode_recommendations_batch([data, encode_recommendations([])]))
+    assert [list(r.product_ids) for r in batch.responses] == [ids, []]
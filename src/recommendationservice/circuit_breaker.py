@@ -0,0 +1,124 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import threading
+import time
+
+from logger import getJSONLogger
+logger = getJSONLogger('recommendationservice-breaker')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency while its circuit is open."""
+
+
+class CircuitBreaker(object):
+    """Closed/open/half-open circuit breaker over a rolling time window.
+
+    Outcomes of the last `window` seconds are kept. Once there are at least
+    `min_calls` of them and either the share of failures reaches
+    `failure_rate` or the share of calls slower than `slow_call` seconds
+    reaches `slow_rate`, the circuit opens: allow() returns False for
+    `open_seconds`. Then one trial call at a time is let through
+    (half-open); a success closes the circuit again, a failure re-opens it.
+    """
+
+    def __init__(self, name, window=60.0, min_calls=3, failure_rate=0.5,
+                 slow_call=2.0, slow_rate=0.8, open_seconds=30.0):
+        self.name = name
+        self._window = window
+        self._min_calls = min_calls
+        self._failure_rate = failure_rate
+        self._slow_call = slow_call
+        self._slow_rate = slow_rate
+        self._open_seconds = open_seconds
+        self._lock = threading.Lock()
+        # (finished_at, failed, slow), oldest first
+        self._outcomes = collections.deque()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trial = False
+        self.transitions = 0
+        self.rejections = 0
+
+    @property
+    def state(self):
+        return self._state
+
+    def allow(self):
+        """Returns whether a call may go through now."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self._open_seconds:
+                    self.rejections += 1
+                    return False
+                self._transition(HALF_OPEN, 'open for {:g}s'.format(self._open_seconds))
+            if self._trial:
+                self.rejections += 1
+                return False
+            self._trial = True
+            return True
+
+    def record(self, latency, failed):
+        """Records the outcome of a call that allow() let through."""
+        now = time.monotonic()
+        slow = latency >= self._slow_call
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._trial = False
+                if failed or slow:
+                    self._open(now, 'trial call {}'.format('failed' if failed else 'slow'))
+                else:
+                    self._outcomes.clear()
+                    self._transition(CLOSED, 'trial call succeeded')
+                return
+            if self._state == OPEN:
+                return
+            outcomes = self._outcomes
+            outcomes.append((now, failed, slow))
+            while outcomes and outcomes[0][0] < now - self._window:
+                outcomes.popleft()
+            if len(outcomes) < self._min_calls:
+                return
+            failures = sum(1 for _, f, _ in outcomes if f)
+            slow_calls = sum(1 for _, _, s in outcomes if s)
+            if failures >= self._failure_rate * len(outcomes):
+                self._open(now, '{} of {} calls failed'.format(failures, len(outcomes)))
+            elif slow_calls >= self._slow_rate * len(outcomes):
+                self._open(now, '{} of {} calls slower than {}s'.format(
+                    slow_calls, len(outcomes), self._slow_call))
+
+    def stats(self):
+        return dict(state=self._state, transitions=self.transitions,
+                    rejections=self.rejections)
+
+    def _open(self, now, reason):
+        self._opened_at = now
+        self._outcomes.clear()
+        self._transition(OPEN, reason)
+
+    def _transition(self, state, reason):
+        logger.warning("circuit breaker {}: {} -> {} ({})".format(
+            self.name, self._state, state, reason))
+        self._state = state
+        self.transitions += 1
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import pytest
+
+import circuit_breaker
+from catalog import AsyncCatalogCache, CatalogCache
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(circuit_breaker, 'time', clock)
+    return clock
+
+
+def _breaker(**kwargs):
+    settings = dict(window=60.0, min_calls=3, failure_rate=0.5, slow_call=2.0, slow_rate=0.8,
+                    open_seconds=30.0)
+    settings.update(kwargs)
+    return CircuitBreaker('test', **settings)
+
+
+def _open(breaker, clock):
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record(0.1, failed=True)
+    assert breaker.state == OPEN
+
+
+def test_stays_closed_below_min_calls(clock):
+    breaker = _breaker()
+    breaker.record(0.1, failed=True)
+    breaker.record(0.1, failed=True)
+    assert breaker.state == CLOSED
+    breaker.record(0.1, failed=True)
+    assert breaker.state == OPEN
+
+
+def test_opens_on_failure_rate(clock):
+    breaker = _breaker(min_calls=4)
+    for failed in (False, False, False, True, True):
+        breaker.record(0.1, failed)
+    assert breaker.state == CLOSED
+    breaker.record(0.1, failed=True)
+    # 3 of 6
+    assert breaker.state == OPEN
+    assert breaker.transitions == 1
+
+
+def test_opens_on_slow_rate(clock):
+    breaker = _breaker()
+    breaker.record(0.1, failed=False)
+    for _ in range(3):
+        breaker.record(2.5, failed=False)
+    assert breaker.state == CLOSED
+    breaker.record(2.5, failed=False)
+    # 4 of 5
+    assert breaker.state == OPEN
+
+
+def test_forgets_outcomes_outside_window(clock):
+    breaker = _breaker()
+    breaker.record(0.1, failed=True)
+    breaker.record(0.1, failed=True)
+    clock.now += 61
+    breaker.record(0.1, failed=True)
+    assert breaker.state == CLOSED
+
+
+def test_open_rejects_until_half_open(clock):
+    breaker = _breaker()
+    _open(breaker, clock)
+    assert not breaker.allow()
+    clock.now += 29
+    assert not breaker.allow()
+    assert breaker.rejections == 2
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+
+
+def test_half_open_lets_one_trial_at_a_time(clock):
+    breaker = _breaker()
+    _open(breaker, clock)
+    clock.now += 30
+    assert breaker.allow()
+    assert not breaker.allow()
+    assert not breaker.allow()
+    breaker.record(0.1, failed=False)
+    assert breaker.state == CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+@pytest.mark.parametrize('latency,failed', [(0.1, True), (2.5, False)])
+def test_failed_or_slow_trial_reopens(clock, latency, failed):
+    breaker = _breaker()
+    _open(breaker, clock)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record(latency, failed)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    clock.now += 30
+    assert breaker.allow()
+
+
+def test_stats():
+    breaker = _breaker()
+    assert breaker.stats() == dict(state=CLOSED, transitions=0, rejections=0)
+
+
+def _half_open_breaker(clock):
+    breaker = _breaker()
+    _open(breaker, clock)
+    clock.now += 30
+    return breaker
+
+
+def test_trial_ending_in_any_error_is_recorded(clock):
+    class _Broken(object):
+        def ListProductsLite(self, request, timeout=None):
+            raise RuntimeError('not an RpcError')
+
+    breaker = _half_open_breaker(clock)
+    cache = CatalogCache(_Broken(), breaker=breaker)
+    with pytest.raises(RuntimeError):
+        cache.refresh()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        cache.refresh()
+    clock.now += 30
+    # not stuck waiting for the first trial's outcome
+    assert breaker.allow()
+
+
+def test_cancelled_async_trial_is_recorded(clock):
+    class _Hanging(object):
+        async def ListProductsLite(self, request, timeout=None):
+            await asyncio.sleep(3600)
+
+    breaker = _half_open_breaker(clock)
+
+    async def main():
+        cache = AsyncCatalogCache(_Hanging(), breaker=breaker)
+        fetch = cache._start_fetch()
+        await asyncio.sleep(0)
+        fetch.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await fetch
+
+    asyncio.run(main())
+    assert breaker.state == OPEN
+    clock.now += 30
+    assert breaker.allow()
@@ -23,12 +23,29 @@ import demo_pb2_grpc
 from logger import getJSONLogger
 logger = getJSONLogger('recommendationservice-server')
 
+
+def list_recommendations_batch(stub, requests, max_batch_size=100, timeout=None):
+    """Sends ListRecommendationsRequests in as few ListRecommendationsBatch calls as possible.
+
+    Requests are split into batches of at most `max_batch_size`. Returns
+    one ListRecommendationsResponse per request, in the same order.
+    """
+    responses = []
+    for start in range(0, len(requests), max_batch_size):
+        batch = demo_pb2.ListRecommendationsBatchRequest(
+            requests=requests[start:start + max_batch_size])
+        responses.extend(stub.ListRecommendationsBatch(batch, timeout=timeout).responses)
+    return responses
+
+
 if __name__ == "__main__":
     # get port
     if len(sys.argv) > 1:
         port = sys.argv[1]
     else:
         port = "8080"
+    # optional number of users to ask for in one batch
+    num_users = int(sys.argv[2]) if len(sys.argv) > 2 else 0
 
     # set up server stub
     channel = grpc.insecure_channel('localhost:'+port)
@@ -37,5 +54,11 @@ if __name__ == "__main__":
     # form request
     request = demo_pb2.ListRecommendationsRequest(user_id="test", product_ids=["test"])
     # make call to server
-    response = stub.ListRecommendations(request)
-    logger.info(response)
+    if num_users:
+        requests = [demo_pb2.ListRecommendationsRequest(user_id="test{}".format(i), product_ids=["test"])
+                    for i in range(num_users)]
+        for response in list_recommendations_batch(stub, requests):
+            logger.info(response)
+    else:
+        response = stub.ListRecommendations(request)
+        logger.info(response)
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import demo_pb2
+from client import list_recommendations_batch
+
+
+class _EchoStub(object):
+    """Answers each request of a batch with its own user id; records batch sizes."""
+
+    def __init__(self):
+        self.batch_sizes = []
+        self.timeouts = []
+
+    def ListRecommendationsBatch(self, request, timeout=None):
+        self.batch_sizes.append(len(request.requests))
+        self.timeouts.append(timeout)
+        response = demo_pb2.ListRecommendationsBatchResponse()
+        for r in request.requests:
+            response.responses.add(product_ids=[r.user_id])
+        return response
+
+
+def _requests(n):
+    return [demo_pb2.ListRecommendationsRequest(user_id='u{}'.format(i)) for i in range(n)]
+
+
+def test_splits_into_batches_of_max_size():
+    stub = _EchoStub()
+    responses = list_recommendations_batch(stub, _requests(250), max_batch_size=100, timeout=2)
+    assert stub.batch_sizes == [100, 100, 50]
+    assert stub.timeouts == [2, 2, 2]
+    assert [r.product_ids[0] for r in responses] == ['u{}'.format(i) for i in range(250)]
+
+
+def test_exact_multiple_of_max_size():
+    stub = _EchoStub()
+    assert len(list_recommendations_batch(stub, _requests(4), max_batch_size=2)) == 4
+    assert stub.batch_sizes == [2, 2]
+
+
+def test_no_requests_sends_nothing():
+    stub = _EchoStub()
+    assert list_recommendations_batch(stub, []) == []
+    assert stub.batch_sizes == []
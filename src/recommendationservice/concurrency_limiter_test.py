@@ -0,0 +1,242 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import collections
+import time
+
+import grpc
+import pytest
+
+import concurrency_limiter
+import demo_pb2
+import demo_pb2_grpc
+from concurrency_limiter import (AsyncLoadSheddingInterceptor, ConcurrencyLimiter,
+                                 LoadSheddingInterceptor, SheddingExecutor)
+from metrics import MetricsInterceptor, Registry
+
+HANDLER_DELAY = 0.2
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(concurrency_limiter, 'time', clock)
+    return clock
+
+
+def _run_windows(limiter, clock, windows, concurrency=12, rtt=0.001, short_deadlines=0,
+                 drops=0):
+    """Runs `concurrency` calls of `rtt` seconds at a time for `windows` windows.
+
+    Calls over the limit are rejected and counted by the limiter.
+    """
+    for _ in range(windows):
+        start = clock.now
+        while clock.now - start < 0.5:
+            permits = [limiter.acquire() for _ in range(concurrency)]
+            permits = [permit for permit in permits if permit is not None]
+            clock.now += rtt
+            for permit in permits:
+                permit.release()
+        for _ in range(short_deadlines):
+            limiter.acquire().discard()
+        for _ in range(drops):
+            limiter.acquire().release(dropped=True)
+
+
+def test_acquire_rejects_over_limit():
+    limiter = ConcurrencyLimiter(initial_limit=2)
+    first, second = limiter.acquire(), limiter.acquire()
+    assert limiter.acquire() is None
+    first.release()
+    # released only once
+    first.release()
+    assert limiter.inflight == 1
+    third = limiter.acquire()
+    assert third is not None
+    second.release()
+    third.release()
+    stats = limiter.stats()
+    assert (stats['accepted'], stats['rejected'], stats['dropped']) == (3, 1, 0)
+
+
+def test_limit_grows_while_latency_is_flat(clock):
+    limiter = ConcurrencyLimiter(initial_limit=20, max_limit=200)
+    _run_windows(limiter, clock, 20, concurrency=15)
+    assert limiter.limit > 20
+
+
+def test_limit_shrinks_when_calls_queue(clock):
+    limiter = ConcurrencyLimiter(initial_limit=20)
+    _run_windows(limiter, clock, 5, concurrency=8, rtt=0.001)
+    _run_windows(limiter, clock, 20, concurrency=8, rtt=0.010)
+    assert limiter.limit < 20
+
+
+def test_short_deadline_rejections_leave_limit_alone(clock):
+    limiter = ConcurrencyLimiter(initial_limit=20, max_limit=20)
+    _run_windows(limiter, clock, 40, short_deadlines=1)
+    assert limiter.limit == 20
+    stats = limiter.stats()
+    assert (stats['rejected'], stats['dropped'], stats['inflight']) == (0, 0, 0)
+
+
+def test_dropped_calls_shrink_limit(clock):
+    limiter = ConcurrencyLimiter(initial_limit=20, max_limit=20)
+    _run_windows(limiter, clock, 40, drops=1)
+    # below the 12 calls the service handles fine
+    assert limiter.limit < 12
+    stats = limiter.stats()
+    assert stats['dropped'] == 40 and stats['rejected'] > 0
+
+
+def test_unreleased_permit_counts_as_dropped():
+    limiter = ConcurrencyLimiter()
+    limiter.acquire()
+    assert limiter.inflight == 0
+    assert limiter.stats()['dropped'] == 1
+
+
+_Details = collections.namedtuple('_Details', ('method', 'invocation_metadata'))
+
+
+def test_interceptor_exempts_health_checks():
+    limiter = ConcurrencyLimiter(initial_limit=1)
+    interceptor = LoadSheddingInterceptor(limiter)
+    handler = grpc.unary_unary_rpc_method_handler(lambda request, context: None)
+    permit = limiter.acquire()
+    health = interceptor.intercept_service(
+        lambda details: handler, _Details('/grpc.health.v1.Health/Check', ()))
+    assert health is handler
+    shed = interceptor.intercept_service(
+        lambda details: handler, _Details('/hipstershop.RecommendationService/X', ()))
+    assert shed.unary_unary is concurrency_limiter._reject
+    permit.release()
+
+
+class _Slow(demo_pb2_grpc.RecommendationServiceServicer):
+    def ListRecommendations(self, request, context):
+        time.sleep(HANDLER_DELAY)
+        return demo_pb2.ListRecommendationsResponse(product_ids=['A'])
+
+
+def _serve(executor, limiter, min_deadline=0.0, interceptors=()):
+    server = grpc.server(executor, interceptors=(list(interceptors)
+                                                 + [LoadSheddingInterceptor(limiter, min_deadline)]))
+    demo_pb2_grpc.add_RecommendationServiceServicer_to_server(_Slow(), server)
+    port = server.add_insecure_port('127.0.0.1:0')
+    server.start()
+    return server, port
+
+
+def _timed_calls(port, n, timeout=None):
+    """Sends `n` concurrent calls; returns (status code, seconds) per call."""
+    results = []
+    with grpc.insecure_channel('127.0.0.1:{}'.format(port)) as channel:
+        stub = demo_pb2_grpc.RecommendationServiceStub(channel)
+        stub.ListRecommendations(demo_pb2.ListRecommendationsRequest(), timeout=5)
+        start = time.monotonic()
+        calls = [stub.ListRecommendations.future(demo_pb2.ListRecommendationsRequest(),
+                                                 timeout=timeout)
+                 for _ in range(n)]
+        for call in calls:
+            call.add_done_callback(
+                lambda c: results.append((c.code(), time.monotonic() - start)))
+        for call in calls:
+            call.exception()
+    return results
+
+
+def _tracing_interceptors():
+    pytest.importorskip('opentelemetry')
+    import tracing
+    return tracing.server_interceptors(tracing.trace.get_tracer(__name__))
+
+
+@pytest.mark.parametrize('interceptors', [
+    lambda: [],
+    # both wrap the handler the shedding interceptor returns
+    lambda: [MetricsInterceptor(Registry())],
+    lambda: [MetricsInterceptor(Registry())] + _tracing_interceptors(),
+], ids=['alone', 'metrics', 'metrics-and-tracing'])
+def test_rejections_do_not_wait_for_worker_threads(interceptors):
+    # two calls run, two wait for a thread and the others are shed
+    limiter = ConcurrencyLimiter(initial_limit=4, min_limit=4, max_limit=4)
+    server, port = _serve(SheddingExecutor(max_workers=2), limiter,
+                          interceptors=interceptors())
+    try:
+        results = _timed_calls(port, 12)
+    finally:
+        server.stop(0)
+    rejected = [t for code, t in results if code == grpc.StatusCode.RESOURCE_EXHAUSTED]
+    served = [t for code, t in results if code == grpc.StatusCode.OK]
+    assert len(served) == 4 and len(rejected) == 8
+    assert max(rejected) < HANDLER_DELAY / 2, rejected
+    assert min(served) >= HANDLER_DELAY
+
+
+def test_short_deadline_is_rejected_before_running():
+    limiter = ConcurrencyLimiter()
+    server, port = _serve(SheddingExecutor(max_workers=2), limiter, min_deadline=1.0)
+    try:
+        with grpc.insecure_channel('127.0.0.1:{}'.format(port)) as channel:
+            stub = demo_pb2_grpc.RecommendationServiceStub(channel)
+            start = time.monotonic()
+            with pytest.raises(grpc.RpcError) as err:
+                stub.ListRecommendations(demo_pb2.ListRecommendationsRequest(), timeout=0.5)
+            assert err.value.code() == grpc.StatusCode.DEADLINE_EXCEEDED
+            assert time.monotonic() - start < HANDLER_DELAY
+    finally:
+        server.stop(0)
+    stats = limiter.stats()
+    assert (stats['inflight'], stats['dropped']) == (0, 0)
+
+
+class _AsyncSlow(demo_pb2_grpc.RecommendationServiceServicer):
+    async def ListRecommendations(self, request, context):
+        await asyncio.sleep(HANDLER_DELAY)
+        return demo_pb2.ListRecommendationsResponse(product_ids=['A'])
+
+
+def test_async_interceptor_sheds_over_limit():
+    limiter = ConcurrencyLimiter(initial_limit=2, min_limit=2, max_limit=2)
+
+    async def main():
+        server = grpc.aio.server(interceptors=[AsyncLoadSheddingInterceptor(limiter)])
+        demo_pb2_grpc.add_RecommendationServiceServicer_to_server(_AsyncSlow(), server)
+        port = server.add_insecure_port('127.0.0.1:0')
+        await server.start()
+        try:
+            async with grpc.aio.insecure_channel('127.0.0.1:{}'.format(port)) as channel:
+                stub = demo_pb2_grpc.RecommendationServiceStub(channel)
+                calls = [stub.ListRecommendations(demo_pb2.ListRecommendationsRequest())
+                         for _ in range(5)]
+                return [await call.code() for call in calls]
+        finally:
+            await server.stop(0)
+
+    codes = asyncio.run(main())
+    assert codes.count(grpc.StatusCode.OK) == 2
+    assert codes.count(grpc.StatusCode.RESOURCE_EXHAUSTED) == 3
@@ -154,6 +154,11 @@ class RecommendationServiceStub(object):
                 request_serializer=demo__pb2.ListRecommendationsRequest.SerializeToString,
                 response_deserializer=demo__pb2.ListRecommendationsResponse.FromString,
                 )
+        self.ListRecommendationsBatch = channel.unary_unary(
+                '/hipstershop.RecommendationService/ListRecommendationsBatch',
+                request_serializer=demo__pb2.ListRecommendationsBatchRequest.SerializeToString,
+                response_deserializer=demo__pb2.ListRecommendationsBatchResponse.FromString,
+                )
 
 
 class RecommendationServiceServicer(object):
@@ -167,6 +172,12 @@ class RecommendationServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def ListRecommendationsBatch(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_RecommendationServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -175,6 +186,11 @@ def add_RecommendationServiceServicer_to_server(servicer, server):
                     request_deserializer=demo__pb2.ListRecommendationsRequest.FromString,
                     response_serializer=demo__pb2.ListRecommendationsResponse.SerializeToString,
             ),
+            'ListRecommendationsBatch': grpc.unary_unary_rpc_method_handler(
+                    servicer.ListRecommendationsBatch,
+                    request_deserializer=demo__pb2.ListRecommendationsBatchRequest.FromString,
+                    response_serializer=demo__pb2.ListRecommendationsBatchResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'hipstershop.RecommendationService', rpc_method_handlers)
@@ -204,6 +220,23 @@ class RecommendationService(object):
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
 
+    @staticmethod
+    def ListRecommendationsBatch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/hipstershop.RecommendationService/ListRecommendationsBatch',
+            demo__pb2.ListRecommendationsBatchRequest.SerializeToString,
+            demo__pb2.ListRecommendationsBatchResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
 
 class ProductCatalogServiceStub(object):
     """---------------Product Catalog----------------
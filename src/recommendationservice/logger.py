@@ -14,26 +14,243 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+"""JSON loggers that never write to stdout on the calling thread.
+
+Every logger returned by getJSONLogger shares one QueueHandler: logging a
+record puts it on a bounded queue and returns. A QueueListener thread
+formats the records and writes them to stdout in batches of up to
+LOG_BATCH_SIZE, with one write and flush per batch. When the queue holds
+LOG_QUEUE_SIZE records, the LOG_QUEUE_POLICY decides: "drop" (the default)
+discards the record and counts it, "block" waits for room. Dropped records
+are reported in the log once the writer catches up.
+
+Records are written as one JSON object per line by JSONFormatter, with the
+ids of the OpenTelemetry span active where the record was logged, if any.
+"""
+
+import atexit
+import datetime
+import json
 import logging
+import logging.handlers
+import os
+import queue
 import sys
-from pythonjsonlogger import jsonlogger
+import threading
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+try:
+  from opentelemetry import trace
+except ImportError:
+  trace = None
+
+# LogRecord attributes that aren't extra fields
+_RECORD_ATTRS = frozenset(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {
+  'message', 'asctime', 'otel_ids'}
+
+
+class JSONFormatter(logging.Formatter):
+  """Formats records as single-line JSON objects.
+
+  Emits asctime, levelname, name, filename, lineno, message, otelTraceID
+  and otelSpanID (when a span was active), extra fields, then
+  `static_fields`, which are serialized once. Timestamps reuse the text of
+  the current second and trace and span ids are hex formatted once each.
+  `backend` is "orjson", "json" or "auto" (orjson when installed).
+  """
+
+  def __init__(self, static_fields=None, backend='auto'):
+    super().__init__()
+    if backend == 'auto':
+      backend = 'orjson' if orjson is not None else 'json'
+    if backend == 'orjson':
+      if orjson is None:
+        raise ValueError('orjson is not installed')
+      self._dumps = lambda fields: orjson.dumps(fields, default=str).decode('utf-8')
+    else:
+      self._dumps = json.JSONEncoder(separators=(',', ':'), default=str).encode
+    self.backend = backend
+    # '{...}' becomes ',...}', to splice in place of the closing brace
+    self._static_suffix = '}'
+    if static_fields:
+      self._static_suffix = ',' + json.dumps(static_fields, separators=(',', ':'))[1:]
+    self._second = None
+    self._second_text = ''
+    self._hex = {}
+
+  def format(self, record):
+    fields = {
+      'asctime': self._asctime(record.created),
+      'levelname': record.levelname,
+      'name': record.name,
+      'filename': record.filename,
+      'lineno': record.lineno,
+    }
+    otel_ids = getattr(record, 'otel_ids', None)
+    if otel_ids is not None:
+      fields['otelTraceID'] = self._hex_id(otel_ids[0], 32)
+      fields['otelSpanID'] = self._hex_id(otel_ids[1], 16)
+    fields['message'] = record.getMessage()
+    if record.exc_info and not record.exc_text:
+      record.exc_text = self.formatException(record.exc_info)
+    if record.exc_text:
+      fields['exc_info'] = record.exc_text
+    for key in record.__dict__.keys() - _RECORD_ATTRS:
+      fields[key] = record.__dict__[key]
+    return self._dumps(fields)[:-1] + self._static_suffix
+
+  def _asctime(self, created):
+    second = int(created)
+    if second != self._second:
+      self._second = second
+      self._second_text = datetime.datetime.fromtimestamp(
+        second, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+    return '{}.{:03d}Z'.format(self._second_text, int((created - second) * 1000))
+
+  def _hex_id(self, value, width):
+    # records of one request share their ids; only the writer thread formats
+    text = self._hex.get(value)
+    if text is None:
+      if len(self._hex) >= 4096:
+        self._hex.clear()
+      text = self._hex[value] = format(value, '0{}x'.format(width))
+    return text
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+  """QueueHandler that drops records, or waits, when the queue is full."""
+
+  def __init__(self, queue_, block=False):
+    super().__init__(queue_)
+    self._block = block
+    self._lock = threading.Lock()
+    self.dropped = 0
+
+  def prepare(self, record):
+    record = super().prepare(record)
+    if trace is not None:
+      # the writer thread formats the record, outside of the caller's span
+      context = trace.get_current_span().get_span_context()
+      if context.is_valid:
+        record.otel_ids = (context.trace_id, context.span_id)
+    return record
 
+  def enqueue(self, record):
+    if self._block:
+      self.queue.put(record)
+      return
+    try:
+      self.queue.put_nowait(record)
+    except queue.Full:
+      with self._lock:
+        self.dropped += 1
 
 
-#class CustomJsonFormatter(jsonlogger.JsonFormatter):
-#  def add_fields(self, log_record, record, message_dict):
-#    super(CustomJsonFormatter, self).add_fields(log_record, record, message_dict)
-#    if not log_record.get('otelTraceID'):
-#      log_record['otelTraceID'] = trace.format_trace_id(trace.get_current_span().get_span_context().trace_id)
-#    if not log_record.get('otelSpanID'):
-#      log_record['otelSpanID'] = trace.format_span_id(trace.get_current_span().get_span_context().span_id)
+class _BatchStreamHandler(logging.StreamHandler):
+  """Buffers formatted records and writes them once the queue is drained."""
+
+  def __init__(self, stream, queue_handler, batch_size):
+    super().__init__(stream)
+    self._queue_handler = queue_handler
+    self._batch_size = batch_size
+    self._pending = []
+    self._reported_drops = queue_handler.dropped
+    self.written = 0
+    self.batches = 0
+
+  def emit(self, record):
+    try:
+      self._pending.append(self.format(record))
+    except Exception:
+      self.handleError(record)
+      return
+    if len(self._pending) >= self._batch_size or self._queue_handler.queue.empty():
+      self.flush()
+
+  def flush(self):
+    with self.lock:
+      dropped = self._queue_handler.dropped
+      if dropped != self._reported_drops:
+        self._pending.append(self.format(logging.LogRecord(
+          __name__, logging.WARNING, __file__, 0, 'log queue full, dropped %d records',
+          (dropped - self._reported_drops,), None)))
+        self._reported_drops = dropped
+      if not self._pending:
+        return
+      try:
+        self.stream.write('\n'.join(self._pending) + '\n')
+        self.stream.flush()
+      except Exception:
+        pass
+      self.written += len(self._pending)
+      self.batches += 1
+      self._pending = []
+
+
+class _Listener(logging.handlers.QueueListener):
+  def enqueue_sentinel(self):
+    # the queue may be full, wait for the writer to make room
+    self.queue.put(self._sentinel)
+
+
+_handler = None
+_writer = None
+_listener = None
+
+
+def _start():
+  global _handler, _writer, _listener
+  block = os.environ.get('LOG_QUEUE_POLICY', "drop").lower() == "block"
+  records = queue.Queue(maxsize=int(os.environ.get('LOG_QUEUE_SIZE', "10000")))
+  if _handler is None:
+    _handler = _DroppingQueueHandler(records, block=block)
+  else:
+    # a forked child has no listener thread, and the queue's locks may
+    # have been held by the parent's one; what the parent's writer holds
+    # is the parent's to write
+    _handler.queue = records
+    _writer._pending = []
+    _writer._reported_drops = _handler.dropped
+  _writer = _BatchStreamHandler(sys.stdout, _handler,
+                                int(os.environ.get('LOG_BATCH_SIZE', "64")))
+  static_fields = dict(pid=os.getpid())
+  if os.environ.get('OTEL_SERVICE_NAME'):
+    static_fields['service'] = os.environ['OTEL_SERVICE_NAME']
+  _writer.setFormatter(JSONFormatter(static_fields, os.environ.get('LOG_JSON_BACKEND', "auto")))
+  _listener = _Listener(records, _writer)
+  _listener.start()
+
+
+def stopLogging():
+  """Writes out the queued records and stops the writer thread."""
+  if _listener is not None and _listener._thread is not None:
+    _listener.stop()
+    _writer.flush()
+
+
+def getLogStats():
+  """Returns counters of the logging pipeline."""
+  return dict(queued=_handler.queue.qsize(), dropped=_handler.dropped,
+              written=_writer.written, batches=_writer.batches)
+
 
 def getJSONLogger(name):
   logger = logging.getLogger(name)
-  handler = logging.StreamHandler(sys.stdout)
-  #formatter = CustomJsonFormatter('%(asctime)s %(levelname)s [%(name)s] [%(filename)s:%(lineno)d] [trace_id=%(otelTraceID)s span_id=%(otelSpanID)s] - %(message)s')
-  #handler.setFormatter(formatter)
-  logger.addHandler(handler)
+  # the same logger is returned for the same name, only add the handler once
+  if _handler not in logger.handlers:
+    logger.addHandler(_handler)
   logger.setLevel(logging.INFO)
   logger.propagate = False
   return logger
+
+
+_start()
+atexit.register(stopLogging)
+# no fork in the middle of a write, or the child would inherit and repeat it
+os.register_at_fork(before=lambda: _writer.acquire(),
+                    after_in_parent=lambda: _writer.release(),
+                    after_in_child=_start)
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import logging
+import queue
+
+import pytest
+
+import logger
+from logger import getJSONLogger
+
+
+def test_handler_added_once():
+    first = getJSONLogger('logger-test')
+    second = getJSONLogger('logger-test')
+    assert first is second
+    assert len(first.handlers) == 1
+
+
+def test_full_queue_drops_and_reports():
+    records = queue.Queue(maxsize=2)
+    handler = logger._DroppingQueueHandler(records)
+    out = io.StringIO()
+    writer = logger._BatchStreamHandler(out, handler, batch_size=10)
+    log = logging.Logger('logger-test-drop')
+    log.addHandler(handler)
+    for i in range(5):
+        log.info('record %d', i)
+    assert handler.dropped == 3
+    while not records.empty():
+        writer.handle(records.get())
+    lines = out.getvalue().splitlines()
+    assert lines == ['record 0', 'record 1', 'log queue full, dropped 3 records']
+    assert writer.batches == 1
+
+
+def test_batches_until_queue_is_drained():
+    records = queue.Queue()
+    handler = logger._DroppingQueueHandler(records)
+    out = io.StringIO()
+    writer = logger._BatchStreamHandler(out, handler, batch_size=3)
+    log = logging.Logger('logger-test-batch')
+    log.addHandler(handler)
+    for i in range(7):
+        log.info('record %d', i)
+    while not records.empty():
+        writer.handle(records.get())
+    assert len(out.getvalue().splitlines()) == 7
+    # two full batches, then the rest once the queue is empty
+    assert writer.batches == 3
+
+
+@pytest.mark.parametrize('backend', ['json', 'orjson'])
+def test_json_formatter(backend):
+    if backend == 'orjson':
+        pytest.importorskip('orjson')
+    formatter = logger.JSONFormatter(dict(pid=7), backend=backend)
+    record = logging.LogRecord('svc', logging.INFO, '/src/server.py', 42, 'hello %s', ('you',),
+                               None)
+    record.created = 1700000000.25
+    record.otel_ids = (0xabc, 0x12)
+    record.summary = {'requests': 3}
+    fields = json.loads(formatter.format(record))
+    assert fields == {
+        'asctime': '2023-11-14T22:13:20.250Z',
+        'levelname': 'INFO',
+        'name': 'svc',
+        'filename': 'server.py',
+        'lineno': 42,
+        'otelTraceID': '0' * 29 + 'abc',
+        'otelSpanID': '0' * 14 + '12',
+        'message': 'hello you',
+        'summary': {'requests': 3},
+        'pid': 7,
+    }
+
+
+def test_json_formatter_without_span_or_static_fields():
+    formatter = logger.JSONFormatter(backend='json')
+    record = logging.LogRecord('svc', logging.WARNING, 'x.py', 1, 'plain', (), None)
+    fields = json.loads(formatter.format(record))
+    assert 'otelTraceID' not in fields
+    assert fields['message'] == 'plain'
+    assert fields['levelname'] == 'WARNING'
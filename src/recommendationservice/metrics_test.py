@@ -0,0 +1,164 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import urllib.request
+from concurrent import futures
+
+import grpc
+import pytest
+
+import demo_pb2
+import demo_pb2_grpc
+from circuit_breaker import CircuitBreaker
+from metrics import (AsyncMetricsInterceptor, MetricsInterceptor, Registry,
+                     start_http_server, state_collector, stats_collector)
+
+_METHOD = '/hipstershop.RecommendationService/ListRecommendations'
+
+
+def _samples(registry):
+    samples = {}
+    for line in registry.render().splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+class _Recommendations(demo_pb2_grpc.RecommendationServiceServicer):
+    def ListRecommendations(self, request, context):
+        if request.user_id == 'nobody':
+            context.abort(grpc.StatusCode.NOT_FOUND, 'no such user')
+        return demo_pb2.ListRecommendationsResponse(product_ids=['A'])
+
+
+class _AsyncRecommendations(demo_pb2_grpc.RecommendationServiceServicer):
+    async def ListRecommendations(self, request, context):
+        if request.user_id == 'nobody':
+            await context.abort(grpc.StatusCode.NOT_FOUND, 'no such user')
+        return demo_pb2.ListRecommendationsResponse(product_ids=['A'])
+
+
+def _check_rpc_metrics(registry):
+    samples = _samples(registry)
+    method = 'grpc_method="{}"'.format(_METHOD)
+    assert samples['grpc_server_handled_total{%s,grpc_code="OK"}' % method] == 2
+    assert samples['grpc_server_handled_total{%s,grpc_code="NOT_FOUND"}' % method] == 1
+    assert samples['grpc_server_handling_seconds_count{%s}' % method] == 3
+    assert samples['grpc_server_handling_seconds_bucket{%s,le="+Inf"}' % method] == 3
+    assert samples['grpc_server_inflight_rpcs{%s}' % method] == 0
+
+
+def _call(stub, user_id):
+    try:
+        stub.ListRecommendations(demo_pb2.ListRecommendationsRequest(user_id=user_id))
+    except grpc.RpcError as err:
+        assert err.code() == grpc.StatusCode.NOT_FOUND
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram('latency_seconds', 'Latency.', ('op',), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.labels('get').observe(value)
+    samples = _samples(registry)
+    assert samples['latency_seconds_bucket{op="get",le="0.1"}'] == 2
+    assert samples['latency_seconds_bucket{op="get",le="1"}'] == 3
+    assert samples['latency_seconds_bucket{op="get",le="+Inf"}'] == 4
+    assert samples['latency_seconds_count{op="get"}'] == 4
+    assert samples['latency_seconds_sum{op="get"}'] == pytest.approx(2.65)
+
+
+def test_labels_are_escaped_and_collectors_skip_non_numbers():
+    registry = Registry()
+    registry.counter('errors_total', 'Errors.', ('reason',)).labels('say "hi"\n').inc()
+    registry.add_collector(stats_collector(
+        'cache', 'Cache', lambda: dict(hits=3, size=1.5, state='open', min_rtt=None),
+        counters=('hits',)))
+    samples = _samples(registry)
+    assert samples['errors_total{reason="say \\"hi\\"\\n"}'] == 1
+    assert samples['cache_hits_total'] == 3
+    assert samples['cache_size'] == 1.5
+    assert not any(name.startswith(('cache_state', 'cache_min_rtt')) for name in samples)
+
+
+def test_state_collector_exports_current_state():
+    breaker = CircuitBreaker('catalog', min_calls=1)
+    registry = Registry()
+    registry.add_collector(state_collector(
+        'circuit_state', 'Circuit state', lambda: breaker.stats()['state'],
+        ('closed', 'open', 'half_open')))
+    assert _samples(registry)['circuit_state{state="closed"}'] == 1
+    breaker.record(0.1, failed=True)
+    samples = _samples(registry)
+    assert samples['circuit_state{state="open"}'] == 1
+    assert samples['circuit_state{state="closed"}'] == 0
+    assert samples['circuit_state{state="half_open"}'] == 0
+
+
+def test_interceptor_records_status_codes():
+    registry = Registry()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2),
+                         interceptors=[MetricsInterceptor(registry)])
+    demo_pb2_grpc.add_RecommendationServiceServicer_to_server(_Recommendations(), server)
+    port = server.add_insecure_port('127.0.0.1:0')
+    server.start()
+    try:
+        with grpc.insecure_channel('127.0.0.1:{}'.format(port)) as channel:
+            stub = demo_pb2_grpc.RecommendationServiceStub(channel)
+            for user_id in ('a', 'nobody', 'b'):
+                _call(stub, user_id)
+    finally:
+        server.stop(0)
+    _check_rpc_metrics(registry)
+
+
+def test_async_interceptor_records_status_codes():
+    registry = Registry()
+
+    async def main():
+        server = grpc.aio.server(interceptors=[AsyncMetricsInterceptor(registry)])
+        demo_pb2_grpc.add_RecommendationServiceServicer_to_server(_AsyncRecommendations(), server)
+        port = server.add_insecure_port('127.0.0.1:0')
+        await server.start()
+        try:
+            async with grpc.aio.insecure_channel('127.0.0.1:{}'.format(port)) as channel:
+                stub = demo_pb2_grpc.RecommendationServiceStub(channel)
+                for user_id in ('a', 'nobody', 'b'):
+                    try:
+                        await stub.ListRecommendations(
+                            demo_pb2.ListRecommendationsRequest(user_id=user_id))
+                    except grpc.RpcError as err:
+                        assert err.code() == grpc.StatusCode.NOT_FOUND
+        finally:
+            await server.stop(0)
+
+    asyncio.run(main())
+    _check_rpc_metrics(registry)
+
+
+def test_http_server_serves_metrics():
+    registry = Registry()
+    registry.gauge('up', 'Up.').labels().set(1)
+    server = start_http_server(0, registry)
+    try:
+        url = 'http://127.0.0.1:{}/metrics'.format(server.server_address[1])
+        with urllib.request.urlopen(url) as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert b'\nup 1\n' in response.read()
+    finally:
+        server.shutdown()
@@ -0,0 +1,162 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import random
+import threading
+
+from logger import getJSONLogger
+logger = getJSONLogger('recommendationservice-popularity')
+
+
+class AliasTable(object):
+    """Walker/Vose alias table: O(n) to build, O(1) per weighted draw."""
+
+    def __init__(self, weights, version=None):
+        self.version = version
+        n = len(weights)
+        total = float(sum(weights))
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        if n == 0 or total <= 0:
+            return
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # whatever is left is 1.0 up to rounding errors
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def __len__(self):
+        return len(self.prob)
+
+    def draw(self, rng=random):
+        i = rng.randrange(len(self.prob))
+        return i if rng.random() < self.prob[i] else self.alias[i]
+
+
+class Popularity(object):
+    """Product popularity weights and their alias table for the catalog snapshot.
+
+    Weights come from a JSON file of {product_id: weight} (`path`, re-read
+    when it changes) or, without a file, from counting the product ids of
+    served requests (record()). Only products in the catalog are counted,
+    so clients can't grow the counts with made-up ids. Products without a
+    weight get `smoothing`, so that everything in the catalog can still be
+    recommended.
+
+    Tables are built on a background thread, as soon as a new catalog
+    snapshot shows up and every `interval` seconds when the weights changed.
+    Request handlers only pick up the latest finished table with table().
+    """
+
+    def __init__(self, path=None, interval=30.0, smoothing=1.0):
+        self._path = path
+        self._interval = interval
+        self._smoothing = smoothing
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._mtime = None
+        self._dirty = True
+        self._index = None
+        self._table = None
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def record(self, product_ids, index):
+        """Counts the `product_ids` of a request that are in the catalog `index`."""
+        if self._path is not None:
+            return
+        ordinals = index.ordinals
+        with self._lock:
+            for product_id in product_ids:
+                if product_id in ordinals:
+                    self._counts[product_id] = self._counts.get(product_id, 0) + 1
+            self._dirty = True
+
+    def table(self, index):
+        """Returns the alias table for `index`, or None while it is being built."""
+        table = self._table
+        if table is not None and table.version == index.version:
+            return table
+        if self._index is not index:
+            self._index = index
+            self._wakeup.set()
+        return None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='popularity-builder', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def rebuild(self):
+        index = self._index
+        if index is None:
+            return
+        self._load_file()
+        table = self._table
+        if not self._dirty and table is not None and table.version == index.version:
+            return
+        with self._lock:
+            if self._path is None:
+                # forget products that left the catalog
+                self._counts = {k: v for k, v in self._counts.items() if k in index.ordinals}
+            counts = dict(self._counts)
+            self._dirty = False
+        smoothing = self._smoothing
+        weights = [counts.get(product_id, 0) + smoothing for product_id in index.product_ids]
+        self._table = AliasTable(weights, index.version)
+
+    def _load_file(self):
+        if self._path is None:
+            return
+        try:
+            mtime = os.stat(self._path).st_mtime
+            if mtime == self._mtime:
+                return
+            with open(self._path) as f:
+                counts = {k: float(v) for k, v in json.load(f).items()}
+        except (OSError, ValueError) as err:
+            logger.warning("failed to load popularity weights: {}".format(err))
+            return
+        with self._lock:
+            self._counts = counts
+            self._mtime = mtime
+            self._dirty = True
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.clear()
+            try:
+                self.rebuild()
+            except Exception as err:
+                logger.warning("failed to rebuild popularity table: {}".format(err))
+            self._wakeup.wait(self._interval)
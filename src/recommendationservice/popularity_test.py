@@ -0,0 +1,113 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import json
+import random
+
+import pytest
+
+from popularity import AliasTable, Popularity
+from product_index import ProductIndex
+
+
+def _index(n, version=1):
+    return ProductIndex([('P{}'.format(i), ()) for i in range(n)], version)
+
+
+def test_alias_table_follows_weights():
+    weights = [1, 2, 3, 4, 0]
+    table = AliasTable(weights)
+    rng = random.Random(3)
+    draws = 100000
+    counts = collections.Counter(table.draw(rng) for _ in range(draws))
+    assert counts[4] == 0
+    for i, weight in enumerate(weights):
+        assert counts[i] / draws == pytest.approx(weight / 10, abs=0.01)
+
+
+@pytest.mark.parametrize('weights', [[], [0, 0]])
+def test_alias_table_without_weight_is_uniform(weights):
+    table = AliasTable(weights)
+    assert len(table) == len(weights)
+    assert all(p == 1.0 for p in table.prob)
+
+
+def test_sample_weighted_excludes_and_picks_distinct():
+    index = _index(10)
+    table = AliasTable([1.0] * 10)
+    rng = random.Random(5)
+    for _ in range(200):
+        picks = index.sample_weighted(['P0', 'P1', 'UNKNOWN'], 5, table, rng)
+        assert len(picks) == len(set(picks)) == 5
+        assert not {'P0', 'P1'} & set(picks)
+
+
+def test_sample_weighted_fills_up_when_weight_is_on_excluded():
+    index = _index(10)
+    # all the weight is on P0, which the request already has
+    table = AliasTable([1.0] + [0.0] * 9)
+    picks = index.sample_weighted(['P0'], 5, table, random.Random(1))
+    assert len(set(picks)) == 5 and 'P0' not in picks
+
+
+def test_sample_weighted_is_capped_at_available_products():
+    index = _index(3)
+    picks = index.sample_weighted(['P0'], 5, AliasTable([1, 1, 1]), random.Random(2))
+    assert sorted(picks) == ['P1', 'P2']
+
+
+def test_sample_weighted_prefers_popular_products():
+    index = _index(20)
+    table = AliasTable([100.0] + [1.0] * 19)
+    rng = random.Random(4)
+    hits = sum('P0' in index.sample_weighted([], 1, table, rng) for _ in range(1000))
+    assert hits > 700
+
+
+def test_record_counts_only_catalog_products():
+    popularity = Popularity()
+    index = _index(3)
+    for i in range(1000):
+        popularity.record(['P1', 'made-up-{}'.format(i)], index)
+    assert popularity._counts == {'P1': 1000}
+    popularity.table(index)
+    popularity.rebuild()
+    table = popularity.table(index)
+    # P1 has 1001 of the 1003 weight
+    assert table.prob[1] == 1.0
+    assert table.prob[0] < 0.01
+
+
+def test_rebuild_forgets_products_that_left_the_catalog():
+    popularity = Popularity()
+    popularity.record(['P1', 'P2'], _index(3))
+    smaller = _index(2, version=2)
+    popularity.table(smaller)
+    popularity.rebuild()
+    assert popularity._counts == {'P1': 1}
+    assert len(popularity.table(smaller)) == 2
+
+
+def test_weights_file_ignores_record(tmp_path):
+    path = tmp_path / 'popularity.json'
+    path.write_text(json.dumps({'P2': 50}))
+    popularity = Popularity(path=str(path))
+    index = _index(3)
+    popularity.record(['P0'] * 100, index)
+    popularity.table(index)
+    popularity.rebuild()
+    assert popularity._counts == {'P2': 50.0}
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import time
+
+from logger import getJSONLogger, stopLogging
+logger = getJSONLogger('recommendationservice-supervisor')
+
+
+def _worker_main(index, target, args):
+    # lets a worker pick per-worker resources, like its metrics port
+    os.environ['WORKER_INDEX'] = str(index)
+    # the supervisor turns Ctrl-C into a SIGTERM for every worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # not the supervisor's forwarding handler, until the worker profiles on it
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    try:
+        target(*args)
+    finally:
+        # multiprocessing skips atexit handlers, write out queued log records
+        stopLogging()
+
+
+class Supervisor(object):
+    """Pre-fork supervisor that keeps `num_workers` processes running `target`.
+
+    Workers are forked before anything in this process has created a gRPC
+    channel or server (gRPC doesn't survive a fork once it has started its
+    threads), so each worker has its own interpreter and GIL. They bind the
+    same port with SO_REUSEPORT and the kernel spreads connections across
+    them.
+
+    Crashed workers are restarted, at most once per `restart_delay` seconds
+    each. SIGTERM and SIGINT are forwarded to the workers as SIGTERM so that
+    they drain, and workers still running `grace` seconds later are killed.
+    SIGUSR1 is forwarded as is, so that every worker writes a profile.
+    """
+
+    def __init__(self, target, args, num_workers, grace=5.0, restart_delay=1.0):
+        self._target = target
+        self._args = args
+        self._num_workers = num_workers
+        self._grace = grace
+        self._restart_delay = restart_delay
+        self._context = multiprocessing.get_context('fork')
+        self._stopping = False
+        self._workers = []
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGUSR1, self._forward)
+        workers = self._workers = [self._spawn(i) for i in range(self._num_workers)]
+        started = [time.monotonic()] * self._num_workers
+        while not self._stopping:
+            multiprocessing.connection.wait(
+                [p.sentinel for p in workers], timeout=self._restart_delay)
+            for i, p in enumerate(workers):
+                if self._stopping or p.is_alive():
+                    continue
+                logger.warning("worker {} (pid {}) exited with code {}, restarting".format(
+                    i, p.pid, p.exitcode))
+                # back off so that a worker crashing on startup doesn't spin
+                time.sleep(max(0.0, started[i] + self._restart_delay - time.monotonic()))
+                workers[i] = self._spawn(i)
+                started[i] = time.monotonic()
+        self._drain(workers)
+
+    def _spawn(self, i):
+        p = self._context.Process(
+            target=_worker_main, args=(i, self._target, self._args),
+            name='worker-{}'.format(i))
+        p.start()
+        logger.info("started worker {} (pid {})".format(i, p.pid))
+        return p
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def _forward(self, signum, frame):
+        for p in self._workers:
+            if p.is_alive():
+                os.kill(p.pid, signum)
+
+    def _drain(self, workers):
+        logger.info("stopping {} workers".format(len(workers)))
+        for p in workers:
+            if p.is_alive():
+                p.terminate()
+        deadline = time.monotonic() + self._grace
+        for p in workers:
+            p.join(max(0.0, deadline - time.monotonic()))
+            if p.is_alive():
+                logger.warning("worker pid {} did not drain in time, killing it".format(p.pid))
+                p.kill()
+                p.join()
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import itertools
+import random
+
+# ids added, removed and changed (different categories) between two catalogs
+CatalogDiff = collections.namedtuple('CatalogDiff', 'added removed changed')
+
+
+class ProductIndex(object):
+    """Products of one catalog snapshot, numbered with dense ordinals.
+
+    Built once per snapshot so that requests never have to copy or hash the
+    whole catalog: sample() only looks at the excluded ids and the ids it
+    returns, and related() only at the category posting lists of the
+    products in the cart.
+
+    An index is immutable once built. Request threads share it without any
+    locking, and CatalogCache replaces it as a whole (copy-on-write) instead
+    of updating it in place, so a request always sees one consistent
+    snapshot however many refreshes happen while it runs.
+
+    `products` is a sequence of (product_id, categories) pairs. `version`
+    identifies the snapshot, e.g. for invalidating results derived from it.
+    """
+
+    __slots__ = ('version', 'product_ids', 'ordinals', 'categories', 'postings', 'contents')
+
+    # above this fraction of changed products, updated() rebuilds from scratch
+    FULL_REBUILD_RATIO = 0.1
+
+    def __init__(self, products, version=0):
+        # dict() drops duplicate ids but keeps catalog order
+        products = dict(products)
+        product_ids = tuple(products)
+        categories = tuple(tuple(c) for c in products.values())
+        # inverted index: category -> ordinals of the products in it
+        postings = {}
+        for i, product_categories in enumerate(categories):
+            for category in product_categories:
+                postings.setdefault(category, []).append(i)
+        self._init(version, product_ids,
+                   {product_id: i for i, product_id in enumerate(product_ids)},
+                   categories, {c: tuple(ordinals) for c, ordinals in postings.items()})
+
+    def _init(self, version, product_ids, ordinals, categories, postings, contents=None):
+        _set = object.__setattr__
+        _set(self, 'version', version)
+        _set(self, 'product_ids', product_ids)
+        _set(self, 'ordinals', ordinals)
+        _set(self, 'categories', categories)
+        _set(self, 'postings', postings)
+        # id -> categories, what diff() compares the next catalog against
+        if contents is None:
+            contents = dict(zip(product_ids, categories))
+        _set(self, 'contents', contents)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ProductIndex is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('ProductIndex is immutable')
+
+    def updated(self, products, version):
+        """Returns the index of `products` as of `version` and its CatalogDiff.
+
+        `products` holds (product_id, categories tuple) pairs, as returned by
+        catalog_wire.decode_products. Only the products whose categories
+        changed, and added or removed ones, are applied to a copy of this
+        index, so the work on the derived structures scales with the size
+        of the change; copying the containers is plain C-level copying.
+        Returns this index itself when nothing changed, and a fresh build
+        when a large part of the catalog did.
+        """
+        products = dict(products)
+        diff = self.diff(products)
+        if not (diff.added or diff.removed or diff.changed):
+            return self, diff
+        num_changes = len(diff.added) + len(diff.removed) + len(diff.changed)
+        if num_changes > self.FULL_REBUILD_RATIO * max(len(self), len(products)):
+            return ProductIndex(products.items(), version), diff
+        return self._apply(diff, products, version), diff
+
+    def diff(self, products):
+        """Compares this index with `products`, a dict of id -> categories tuple.
+
+        The (id, categories) pairs are the content every derived structure
+        is built from, so e.g. a new price or description is not a change.
+        """
+        current = self.contents
+        if products == current:
+            return CatalogDiff(frozenset(), frozenset(), frozenset())
+        get = current.get
+        return CatalogDiff(
+            frozenset(products.keys() - current.keys()),
+            frozenset(current.keys() - products.keys()),
+            # new ids compare equal to themselves here
+            frozenset(k for k, v in products.items() if get(k, v) != v))
+
+    def _apply(self, diff, products, version):
+        old_ordinals = self.ordinals
+        old_categories = self.categories
+        product_ids = list(self.product_ids)
+        categories = list(old_categories)
+        ordinals = dict(old_ordinals)
+        contents = dict(self.contents)
+        moved = set()
+
+        for product_id in diff.removed:
+            # keep ordinals dense: the last product moves into the hole
+            i = ordinals.pop(product_id)
+            del contents[product_id]
+            last = len(product_ids) - 1
+            if i != last:
+                moved_id = product_ids[last]
+                product_ids[i] = moved_id
+                categories[i] = categories[last]
+                ordinals[moved_id] = i
+                moved.add(moved_id)
+            del product_ids[last]
+            del categories[last]
+        for product_id in diff.changed:
+            categories[ordinals[product_id]] = contents[product_id] = products[product_id]
+        for product_id in diff.added:
+            ordinals[product_id] = len(product_ids)
+            product_ids.append(product_id)
+            categories.append(products[product_id])
+            contents[product_id] = products[product_id]
+
+        # posting entries to drop, by old ordinal, and to add, by new ordinal;
+        # every other entry keeps its ordinal
+        dropped = {}
+        for product_id in diff.removed | diff.changed | moved:
+            i = old_ordinals[product_id]
+            for category in old_categories[i]:
+                dropped.setdefault(category, []).append(i)
+        joined = {}
+        for product_id in diff.changed | diff.added | moved:
+            i = ordinals.get(product_id)
+            if i is None:
+                # moved, then removed itself
+                continue
+            for category in categories[i]:
+                joined.setdefault(category, []).append(i)
+        # each touched posting list is rebuilt once, filtered in C rather
+        # than edited entry by entry; order within a posting doesn't matter
+        postings = dict(self.postings)
+        for category in dropped.keys() | joined.keys():
+            posting = postings.get(category, ())
+            if category in dropped:
+                posting = tuple(itertools.filterfalse(set(dropped[category]).__contains__,
+                                                      posting))
+            posting += tuple(joined.get(category, ()))
+            if posting:
+                postings[category] = posting
+            else:
+                postings.pop(category, None)
+        index = object.__new__(ProductIndex)
+        index._init(version, tuple(product_ids), ordinals, tuple(categories), postings, contents)
+        return index
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def excluded(self, exclude_ids):
+        ordinals = self.ordinals
+        return {ordinals[x] for x in exclude_ids if x in ordinals}
+
+    def sample(self, exclude_ids, k, rng=random):
+        """Returns up to `k` distinct random product ids not in `exclude_ids`."""
+        return [self.product_ids[i]
+                for i in self.sample_ordinals(self.excluded(exclude_ids), k, rng)]
+
+    def sample_ordinals(self, excluded, k, rng=random):
+        num_products = len(self.product_ids)
+        num_available = num_products - len(excluded)
+        k = min(k, num_available)
+        if k <= 0:
+            return []
+        if 2 * (num_available - k) < num_products:
+            # exclusions and picks cover most of the catalog, rejection
+            # would mostly miss: sample from the explicit difference instead
+            candidates = [i for i in range(num_products) if i not in excluded]
+            return rng.sample(candidates, k)
+        # rejection sampling: every draw hits with probability > 1/2
+        chosen = set()
+        result = []
+        randrange = rng.randrange
+        while len(result) < k:
+            i = randrange(num_products)
+            if i in excluded or i in chosen:
+                continue
+            chosen.add(i)
+            result.append(i)
+        return result
+
+    def sample_weighted(self, exclude_ids, k, table, rng=random):
+        """Like sample(), but draws from the alias table of popularity weights.
+
+        Draws that hit excluded or already chosen products are retried a
+        bounded number of times; if the weight is concentrated on those,
+        uniform picks fill up the rest.
+        """
+        excluded = self.excluded(exclude_ids)
+        k = min(k, len(self.product_ids) - len(excluded))
+        chosen = []
+        seen = set(excluded)
+        for _ in range(4 * k + 16):
+            if len(chosen) >= k:
+                break
+            i = table.draw(rng)
+            if i not in seen:
+                seen.add(i)
+                chosen.append(i)
+        if len(chosen) < k:
+            chosen.extend(self.sample_ordinals(seen, k - len(chosen), rng))
+        return [self.product_ids[i] for i in chosen]
+
+    def related(self, product_ids, k, max_postings=64, rng=random):
+        """Returns up to `k` product ids ranked by categories shared with `product_ids`.
+
+        Candidates are scored by the number of categories they share with the
+        given products; ties are broken randomly. At most `max_postings`
+        entries (a random window) are read from each posting list, so broad
+        categories don't turn into catalog scans. Random products fill in
+        when there aren't enough related ones.
+        """
+        excluded = self.excluded(product_ids)
+        scores = {}
+        for i in excluded:
+            for category in self.categories[i]:
+                posting = self.postings[category]
+                if len(posting) > max_postings:
+                    start = rng.randrange(len(posting))
+                    posting = (posting[start:start + max_postings]
+                               + posting[:max(0, start + max_postings - len(posting))])
+                for j in posting:
+                    if j not in excluded:
+                        scores[j] = scores.get(j, 0) + 1
+        ranked = sorted(scores, key=lambda j: (-scores[j], rng.random()))[:k]
+        if len(ranked) < k:
+            ranked.extend(self.sample_ordinals(excluded.union(ranked), k - len(ranked), rng))
+        return [self.product_ids[i] for i in ranked]
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import threading
+import time
+
+import profiler
+
+
+def _spin(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+
+def _profile_busy_thread(**kwargs):
+    stop = threading.Event()
+    thread = threading.Thread(target=_spin, args=(stop,), name='busy')
+    thread.start()
+    try:
+        return profiler.profile(**kwargs)
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_collapsed_shows_busy_thread():
+    result = _profile_busy_thread(seconds=0.2, rate=200)
+    lines = result.collapsed().splitlines()
+    busy = [line for line in lines if line.startswith('busy;')]
+    assert busy
+    stack, count = busy[0].rsplit(' ', 1)
+    assert '_spin (profiler_test.py:' in stack
+    assert int(count) > 0
+    # the sampler leaves itself out
+    assert not any(line.startswith('profiler;') for line in lines)
+
+
+def test_speedscope_format():
+    result = _profile_busy_thread(seconds=0.1, rate=100)
+    document = json.loads(result.speedscope('test'))
+    frames = document['shared']['frames']
+    sampled = document['profiles'][0]
+    assert sampled['type'] == 'sampled'
+    assert len(sampled['samples']) == len(sampled['weights'])
+    assert sum(sampled['weights']) == result.samples - result.dropped
+    assert all(0 <= i < len(frames) for sample in sampled['samples'] for i in sample)
+    assert any(frame['name'] == '_spin' for frame in frames)
+
+
+def test_max_stacks_counts_dropped_samples():
+    result = profiler.Profile(rate=100, max_stacks=1)
+    result.add('a', ('x',))
+    result.add('a', ('x',))
+    result.add('a', ('y',))
+    assert result.counts == {('a', ('x',)): 2}
+    assert result.samples == 3
+    assert result.dropped == 1
+
+
+def test_one_profile_at_a_time():
+    started = threading.Event()
+    thread = threading.Thread(target=lambda: (started.set(), profiler.profile(seconds=0.3)))
+    thread.start()
+    started.wait()
+    try:
+        status = None
+        for _ in range(50):
+            status = profiler.profile_route('seconds=0')[0]
+            if status == 409:
+                break
+            time.sleep(0.005)
+        assert status == 409
+    finally:
+        thread.join()
+    assert profiler.profile_route('seconds=0')[0] == 200
+
+
+def test_route_rejects_bad_parameters():
+    assert profiler.profile_route('format=pprof')[0] == 400
+    assert profiler.profile_route('seconds=soon')[0] == 400
+
+
+def test_rate_and_duration_are_capped():
+    result = profiler.profile(seconds=-1, rate=10 ** 6)
+    assert result.rate == profiler.MAX_RATE
+    assert result.seconds < 0.1
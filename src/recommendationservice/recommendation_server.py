@@ -14,42 +14,149 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import os
-import random
+import signal
+import threading
 import time
-from concurrent import futures
 
 import grpc
 from grpc_health.v1 import health_pb2 as health_pb2
 from grpc_health.v1 import health_pb2_grpc as health_pb2_grpc
 import demo_pb2
 import demo_pb2_grpc
+from catalog import AsyncCatalogCache, CatalogCache
+from catalog_channel import catalog_stub
+from catalog_wire import encode_recommendations, encode_recommendations_batch
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from concurrency_limiter import SheddingExecutor, interceptors_from_env
+from metrics import (AsyncMetricsInterceptor, MetricsInterceptor, Registry, metrics_port,
+                     start_http_server, state_collector, stats_collector)
+from popularity import Popularity
+from prefork import Supervisor
+from profiler import install_signal_handler, profile_route
+from request_log import RequestLog, request_log_from_env, summarized
+from result_cache import ResultCache, cart_key
+from similarity import SimilarityMatrix
+from tracing import client_interceptors, server_interceptors, tracer_from_env
 
-from logger import getJSONLogger
+from logger import getJSONLogger, getLogStats
 logger = getJSONLogger('recommendationservice-server')
 
 
 
 
 class RecommendationService(demo_pb2_grpc.RecommendationServiceServicer):
+    def __init__(self, catalog, mode="random", similarity=None, results=None,
+                 popularity=None, deadline_reserve=0.05, request_log=None):
+        self.catalog = catalog
+        # logs a sample of the requests and summarizes all of them
+        self.request_log = request_log or RequestLog(logger, 'ListRecommendations',
+                                                     summary_interval=0)
+        self.deadline_reserve = deadline_reserve
+        self.mode = mode
+        self.similarity = similarity
+        self.results = results
+        self.popularity = popularity
+
+    @summarized
     def ListRecommendations(self, request, context):
-        max_responses = 5
-        # fetch list of products from product catalog stub
-        cat_response = product_catalog_stub.ListProducts(demo_pb2.Empty())
-        product_ids = [x.id for x in cat_response.products]
-        filtered_products = list(set(product_ids)-set(request.product_ids))
-        num_products = len(filtered_products)
-        num_return = min(max_responses, num_products)
-        # sample list of indicies to return
-        indices = random.sample(range(num_products), num_return)
-        # fetch product ids from indices
-        prod_list = [filtered_products[i] for i in indices]
-        logger.info("[Recv ListRecommendations] product_ids={}".format(prod_list))
+        return self.response(self.index(context), request)
+
+    @summarized
+    def ListRecommendationsSerialized(self, request, context):
+        """ListRecommendations returning the already serialized response."""
+        _, data = self.recommend(self.index(context), request)
+        return data
+
+    @summarized
+    def ListRecommendationsBatch(self, request, context):
+        return self.batch_response(self.index(context), request)
+
+    @summarized
+    def ListRecommendationsBatchSerialized(self, request, context):
+        """ListRecommendationsBatch returning the already serialized response."""
+        return self.batch_response_serialized(self.index(context), request)
+
+    def catalog_timeout(self, context):
+        """How long a request may wait for a catalog fetch: its deadline minus a reserve."""
+        remaining = context.time_remaining() if context is not None else None
+        if remaining is None:
+            return None
+        return max(0.0, remaining - self.deadline_reserve)
+
+    def index(self, context):
+        try:
+            return self.catalog.index(self.catalog_timeout(context))
+        except (grpc.RpcError, CircuitOpenError, TimeoutError):
+            context.abort(grpc.StatusCode.UNAVAILABLE, "product catalog unavailable")
+
+    def response(self, index, request):
+        prod_list, _ = self.recommend(index, request)
         # build and return response
         response = demo_pb2.ListRecommendationsResponse()
         response.product_ids.extend(prod_list)
         return response
 
+    def batch_response(self, index, request):
+        # one snapshot serves the whole batch
+        response = demo_pb2.ListRecommendationsBatchResponse()
+        for r in request.requests:
+            prod_list, _ = self.recommend(index, r)
+            response.responses.add().product_ids.extend(prod_list)
+        return response
+
+    def batch_response_serialized(self, index, request):
+        return encode_recommendations_batch(
+            [self.recommend(index, r)[1] for r in request.requests])
+
+    def recommend(self, index, request):
+        """Returns the recommended product ids and the serialized response."""
+        if self.popularity is not None:
+            self.popularity.record(request.product_ids, index)
+        if self.results is None:
+            prod_list = self.pick(index, request)
+            data = encode_recommendations(prod_list)
+        else:
+            # the storefront asks again for the same user and cart while
+            # they browse, serve those from the cache
+            key = cart_key(request.user_id, request.product_ids)
+            cached = self.results.get(key, index.version)
+            if cached is None:
+                prod_list = self.pick(index, request)
+                data = encode_recommendations(prod_list)
+                self.results.put(key, index.version, (prod_list, data), 2 * len(data))
+            else:
+                prod_list, data = cached
+        self.request_log.products(prod_list)
+        if self.request_log.sampled():
+            logger.info("[Recv ListRecommendations] product_ids={}".format(prod_list))
+        return prod_list, data
+
+    def pick(self, index, request):
+        max_responses = 5
+        # pick products from the local catalog snapshot, leaving out the
+        # ones in the request
+        if self.mode == "category":
+            prod_list = index.related(request.product_ids, max_responses)
+        elif self.mode == "similarity":
+            # merge the precomputed neighbour lists of the request's products,
+            # keeping the ones still in the catalog, and fill up at random
+            prod_list = [x for x in self.similarity.related(request.product_ids)
+                         if x in index.ordinals][:max_responses]
+            prod_list.extend(index.sample(
+                list(request.product_ids) + prod_list, max_responses - len(prod_list)))
+        elif self.mode == "popular":
+            # weighted by popularity once the snapshot's alias table is built
+            table = self.popularity.table(index)
+            if table is not None:
+                prod_list = index.sample_weighted(request.product_ids, max_responses, table)
+            else:
+                prod_list = index.sample(request.product_ids, max_responses)
+        else:
+            prod_list = index.sample(request.product_ids, max_responses)
+        return prod_list
+
     def Check(self, request, context):
         return health_pb2.HealthCheckResponse(
             status=health_pb2.HealthCheckResponse.SERVING)
@@ -59,33 +166,327 @@ class RecommendationService(demo_pb2_grpc.RecommendationServiceServicer):
             status=health_pb2.HealthCheckResponse.UNIMPLEMENTED)
 
 
-if __name__ == "__main__":
-    logger.info("initializing recommendationservice")
+class AsyncRecommendationService(RecommendationService):
+    """RecommendationService for the grpc.aio server, backed by an AsyncCatalogCache."""
 
-    port = os.environ.get('PORT', "8080")
-    catalog_addr = os.environ.get('PRODUCT_CATALOG_SERVICE_ADDR', '')
-    if catalog_addr == "":
-        raise Exception('PRODUCT_CATALOG_SERVICE_ADDR environment variable not set')
-    logger.info("product catalog address: " + catalog_addr)
-    channel = grpc.insecure_channel(catalog_addr)
-    product_catalog_stub = demo_pb2_grpc.ProductCatalogServiceStub(channel)
+    async def index(self, context):
+        try:
+            return await self.catalog.index(self.catalog_timeout(context))
+        except (grpc.RpcError, CircuitOpenError, asyncio.TimeoutError):
+            await context.abort(grpc.StatusCode.UNAVAILABLE, "product catalog unavailable")
 
-    # create gRPC server
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10),)
+    @summarized
+    async def ListRecommendations(self, request, context):
+        return self.response(await self.index(context), request)
 
-    # add class to gRPC server
-    service = RecommendationService()
+    @summarized
+    async def ListRecommendationsSerialized(self, request, context):
+        _, data = self.recommend(await self.index(context), request)
+        return data
+
+    @summarized
+    async def ListRecommendationsBatch(self, request, context):
+        return self.batch_response(await self.index(context), request)
+
+    @summarized
+    async def ListRecommendationsBatchSerialized(self, request, context):
+        return self.batch_response_serialized(await self.index(context), request)
+
+    async def Check(self, request, context):
+        return health_pb2.HealthCheckResponse(
+            status=health_pb2.HealthCheckResponse.SERVING)
+
+    async def Watch(self, request, context):
+        return health_pb2.HealthCheckResponse(
+            status=health_pb2.HealthCheckResponse.UNIMPLEMENTED)
+
+
+def add_serialized_recommendations_handler(servicer, server):
+    """Serves ListRecommendations(Batch) from the servicer's *Serialized methods.
+
+    The handler has no response serializer, so the bytes the servicer returns
+    (often straight from the result cache) go out as they are instead of
+    through a demo_pb2 message and the pure-Python protobuf serializer.
+    gRPC uses the first generic handler that knows a method, so this must be
+    registered before add_RecommendationServiceServicer_to_server.
+    """
+    rpc_method_handlers = {
+            'ListRecommendations': grpc.unary_unary_rpc_method_handler(
+                    servicer.ListRecommendationsSerialized,
+                    request_deserializer=demo_pb2.ListRecommendationsRequest.FromString,
+                    response_serializer=None,
+            ),
+            'ListRecommendationsBatch': grpc.unary_unary_rpc_method_handler(
+                    servicer.ListRecommendationsBatchSerialized,
+                    request_deserializer=demo_pb2.ListRecommendationsBatchRequest.FromString,
+                    response_serializer=None,
+            ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+            'hipstershop.RecommendationService', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+
+
+def add_recommendation_service(service, server):
+    """Registers `service` for RecommendationService and health checks on `server`."""
+    if serialized_responses():
+        add_serialized_recommendations_handler(service, server)
     demo_pb2_grpc.add_RecommendationServiceServicer_to_server(service, server)
     health_pb2_grpc.add_HealthServicer_to_server(service, server)
 
+
+def catalog_settings():
+    return dict(
+        interval=float(os.environ.get('CATALOG_REFRESH_INTERVAL', "60")),
+        jitter=float(os.environ.get('CATALOG_REFRESH_JITTER', "0.1")),
+        ttl=float(os.environ.get('CATALOG_TTL', "120")),
+        max_staleness=float(os.environ.get('CATALOG_MAX_STALENESS', "600")),
+        snapshot_path=os.environ.get('CATALOG_SNAPSHOT_FILE') or None,
+        fetch_timeout=float(os.environ.get('CATALOG_FETCH_TIMEOUT', "5")),
+        hedge=os.environ.get('CATALOG_HEDGE', "false").lower() in ("true", "1"),
+        hedge_min_delay=float(os.environ.get('CATALOG_HEDGE_MIN_DELAY', "0.05")),
+        fallback_products=[x for x in os.environ.get('FALLBACK_PRODUCT_IDS', "").split(",") if x],
+        breaker=catalog_breaker())
+
+
+def channel_settings():
+    return dict(
+        channels=int(os.environ.get('CATALOG_CHANNELS', "1")),
+        lb_policy=os.environ.get('CATALOG_LB_POLICY', "round_robin"),
+        keepalive_time=float(os.environ.get('CATALOG_KEEPALIVE_TIME', "300")),
+        keepalive_timeout=float(os.environ.get('CATALOG_KEEPALIVE_TIMEOUT', "20")),
+        max_message_bytes=int(os.environ.get('CATALOG_MAX_MESSAGE_BYTES', str(16 << 20))))
+
+
+def catalog_breaker():
+    if os.environ.get('CATALOG_BREAKER', "true").lower() not in ("true", "1"):
+        return None
+    return CircuitBreaker(
+        'productcatalogservice',
+        window=float(os.environ.get('CATALOG_BREAKER_WINDOW', "60")),
+        min_calls=int(os.environ.get('CATALOG_BREAKER_MIN_CALLS', "3")),
+        failure_rate=float(os.environ.get('CATALOG_BREAKER_FAILURE_RATE', "0.5")),
+        slow_call=float(os.environ.get('CATALOG_BREAKER_SLOW_CALL', "2")),
+        slow_rate=float(os.environ.get('CATALOG_BREAKER_SLOW_RATE', "0.8")),
+        open_seconds=float(os.environ.get('CATALOG_BREAKER_OPEN_SECONDS', "30")))
+
+
+def serialized_responses():
+    return os.environ.get('SERIALIZED_RESPONSES', "true").lower() in ("true", "1")
+
+
+def make_service(service_class, catalog):
+    mode = os.environ.get('RECOMMENDATION_MODE', "random")
+    similarity = None
+    if mode == "similarity":
+        similarity = SimilarityMatrix(os.environ.get('SIMILARITY_FILE', "similarity.bin"))
+    results = None
+    max_entries = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', "10000"))
+    if max_entries > 0:
+        results = ResultCache(
+            max_entries=max_entries,
+            max_bytes=int(os.environ.get('RESULT_CACHE_MAX_BYTES', str(16 << 20))),
+            ttl=float(os.environ.get('RESULT_CACHE_TTL', "30")))
+        interval = float(os.environ.get('RESULT_CACHE_STATS_INTERVAL', "60"))
+        if interval > 0:
+            threading.Thread(target=log_cache_stats, args=(results, interval),
+                             name='result-cache-stats', daemon=True).start()
+    popularity = None
+    if mode == "popular":
+        popularity = Popularity(
+            path=os.environ.get('POPULARITY_FILE') or None,
+            interval=float(os.environ.get('POPULARITY_REBUILD_INTERVAL', "30")))
+        popularity.start()
+    return service_class(catalog, mode=mode, similarity=similarity, results=results,
+                         popularity=popularity,
+                         deadline_reserve=float(os.environ.get('CATALOG_DEADLINE_RESERVE', "0.05")),
+                         request_log=request_log_from_env(logger, 'ListRecommendations'))
+
+
+def metrics_registry():
+    return Registry() if metrics_port() is not None else None
+
+
+def catalog_fetch_latency(registry):
+    if registry is None:
+        return None
+    return registry.histogram(
+        'catalog_fetch_duration_seconds',
+        'Duration of ListProducts calls to productcatalogservice.').labels()
+
+
+def metrics_interceptors(registry, aio=False):
+    if registry is None:
+        return []
+    return [(AsyncMetricsInterceptor if aio else MetricsInterceptor)(registry)]
+
+
+def start_metrics(registry, catalog, service, interceptors, executor=None):
+    """Exports the state of the caches, limiter and executor and serves /metrics."""
+    if registry is None:
+        return
+    registry.add_collector(stats_collector(
+        'catalog', 'Product catalog cache', catalog.stats,
+        counters=('rebuilds', 'timeouts', 'hedges', 'fallbacks', 'circuit_transitions',
+                  'circuit_rejections')))
+    if 'circuit_state' in catalog.stats():
+        registry.add_collector(state_collector(
+            'catalog_circuit_state', 'Product catalog circuit breaker state',
+            lambda: catalog.stats()['circuit_state'], (CLOSED, OPEN, HALF_OPEN)))
+    if service.results is not None:
+        registry.add_collector(stats_collector(
+            'result_cache', 'Recommendation result cache', service.results.stats,
+            counters=('hits', 'misses', 'evictions')))
+    for interceptor in interceptors:
+        limiter = getattr(interceptor, 'limiter', None)
+        if limiter is not None:
+            registry.add_collector(stats_collector(
+                'concurrency_limit', 'Adaptive concurrency limit', limiter.stats,
+                counters=('accepted', 'rejected', 'dropped')))
+    registry.add_collector(stats_collector(
+        'log', 'Log pipeline', getLogStats, counters=('dropped', 'written', 'batches')))
+    if executor is not None:
+        # calls accepted by grpc and waiting for a worker thread
+        registry.add_collector(lambda: [(
+            'grpc_server_executor_queue_depth', 'gauge', 'Calls waiting for a worker thread.',
+            [({}, executor._work_queue.qsize())])])
+    start_http_server(metrics_port(), registry, routes={'/debug/profile': profile_route})
+
+
+def log_cache_stats(results, interval):
+    while True:
+        time.sleep(interval)
+        logger.info("result cache stats: {}".format(results.stats()))
+
+
+def serve(port, catalog_addr, grace):
+    tracer = tracer_from_env('recommendationservice')
+    # only ids and categories are needed, skip decoding the rest of each Product
+    product_catalog_stub, _ = catalog_stub(catalog_addr, interceptors=client_interceptors(tracer),
+                                           **channel_settings())
+
+    # keep an in-process catalog snapshot, refreshed in the background
+    registry = metrics_registry()
+    catalog = CatalogCache(product_catalog_stub, fetch_latency=catalog_fetch_latency(registry),
+                           **catalog_settings())
+    if catalog.load_snapshot() is not None:
+        # serve the snapshot from disk right away, refresh in the background
+        catalog.refresh_in_background()
+    else:
+        try:
+            catalog.refresh()
+        except (grpc.RpcError, CircuitOpenError) as err:
+            logger.warning("initial product catalog fetch failed: {}".format(err))
+    catalog.start()
+
+    # create gRPC server; SO_REUSEPORT lets pre-forked workers share the port,
+    # the interceptors record metrics (shed calls included), trace calls and
+    # shed calls past the adaptive concurrency limit
+    executor = SheddingExecutor(max_workers=10)
+    shedding = interceptors_from_env()
+    server = grpc.server(executor,
+                         options=[('grpc.so_reuseport', 1)],
+                         interceptors=(metrics_interceptors(registry)
+                                       + server_interceptors(tracer) + shedding))
+
+    # add class to gRPC server
+    service = make_service(RecommendationService, catalog)
+    start_metrics(registry, catalog, service, shedding, executor)
+    add_recommendation_service(service, server)
+
     # start server
     logger.info("listening on port: " + port)
     server.add_insecure_port('[::]:'+port)
     server.start()
 
+    # profile on SIGUSR1, drain in-flight requests on SIGTERM
+    install_signal_handler()
+
+    def stop(signum, frame):
+        logger.info("received signal {}, shutting down".format(signum))
+        server.stop(grace)
+    signal.signal(signal.SIGTERM, stop)
+
     # keep alive
     try:
-         while True:
-            time.sleep(10000)
+        server.wait_for_termination()
     except KeyboardInterrupt:
-            server.stop(0)
+        server.stop(0)
+
+
+async def serve_aio(port, catalog_addr, grace):
+    tracer = tracer_from_env('recommendationservice')
+    product_catalog_stub, _ = catalog_stub(catalog_addr, aio=True,
+                                           interceptors=client_interceptors(tracer, aio=True),
+                                           **channel_settings())
+
+    registry = metrics_registry()
+    catalog = AsyncCatalogCache(product_catalog_stub,
+                                fetch_latency=catalog_fetch_latency(registry),
+                                **catalog_settings())
+    if catalog.load_snapshot() is not None:
+        catalog.refresh_in_background()
+    else:
+        try:
+            await catalog.refresh()
+        except (grpc.RpcError, CircuitOpenError) as err:
+            logger.warning("initial product catalog fetch failed: {}".format(err))
+    catalog.start()
+
+    # handlers run as coroutines on the event loop, no thread pool needed
+    shedding = interceptors_from_env(aio=True)
+    server = grpc.aio.server(options=[('grpc.so_reuseport', 1)],
+                             interceptors=(metrics_interceptors(registry, aio=True)
+                                           + server_interceptors(tracer, aio=True) + shedding))
+
+    service = make_service(AsyncRecommendationService, catalog)
+    start_metrics(registry, catalog, service, shedding)
+    add_recommendation_service(service, server)
+
+    logger.info("listening on port: " + port)
+    server.add_insecure_port('[::]:'+port)
+    await server.start()
+    install_signal_handler()
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGTERM, lambda: asyncio.ensure_future(server.stop(grace)))
+    try:
+        await server.wait_for_termination()
+    finally:
+        catalog.stop()
+        await server.stop(0)
+
+
+def run(port, catalog_addr, server_mode, grace):
+    if server_mode == "aio":
+        logger.info("starting asyncio (grpc.aio) server")
+        try:
+            asyncio.run(serve_aio(port, catalog_addr, grace))
+        except KeyboardInterrupt:
+            pass
+    else:
+        serve(port, catalog_addr, grace)
+
+
+if __name__ == "__main__":
+    logger.info("initializing recommendationservice")
+
+    port = os.environ.get('PORT', "8080")
+    catalog_addr = os.environ.get('PRODUCT_CATALOG_SERVICE_ADDR', '')
+    if catalog_addr == "":
+        raise Exception('PRODUCT_CATALOG_SERVICE_ADDR environment variable not set')
+    logger.info("product catalog address: " + catalog_addr)
+
+    server_mode = os.environ.get('SERVER_MODE', "thread")
+    if server_mode not in ("thread", "aio"):
+        raise Exception('unknown SERVER_MODE: ' + server_mode)
+    mode = os.environ.get('RECOMMENDATION_MODE', "random")
+    if mode not in ("random", "category", "similarity", "popular"):
+        raise Exception('unknown RECOMMENDATION_MODE: ' + mode)
+    grace = float(os.environ.get('SHUTDOWN_GRACE_PERIOD', "4"))
+    workers = int(os.environ.get('WORKERS', "1"))
+    if workers > 1:
+        logger.info("starting {} worker processes".format(workers))
+        Supervisor(run, (port, catalog_addr, server_mode, grace), workers,
+                   grace=grace + 1).run()
+    else:
+        run(port, catalog_addr, server_mode, grace)
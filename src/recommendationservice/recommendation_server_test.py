@@ -0,0 +1,206 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import contextlib
+import inspect
+import logging
+import threading
+from concurrent import futures
+
+import grpc
+import pytest
+
+import demo_pb2
+import demo_pb2_grpc
+from product_index import ProductIndex
+from recommendation_server import (AsyncRecommendationService, RecommendationService,
+                                   add_recommendation_service)
+from result_cache import ResultCache
+
+LIST_RECOMMENDATIONS = '/hipstershop.RecommendationService/ListRecommendations'
+LIST_RECOMMENDATIONS_BATCH = '/hipstershop.RecommendationService/ListRecommendationsBatch'
+
+
+class _StaticCatalog(object):
+    def __init__(self, n):
+        self._index = ProductIndex([('P{}'.format(i), ('c',)) for i in range(n)], 1)
+
+    def index(self, timeout=None):
+        return self._index
+
+
+class _AsyncStaticCatalog(_StaticCatalog):
+    async def index(self, timeout=None):
+        return self._index
+
+
+@pytest.fixture(autouse=True)
+def quiet_request_logs():
+    server_logger = logging.getLogger('recommendationservice-server')
+    level = server_logger.level
+    server_logger.setLevel(logging.WARNING)
+    yield
+    server_logger.setLevel(level)
+
+
+def _recorded(calls, name, method):
+    if inspect.iscoroutinefunction(method):
+        async def recorded(request, context):
+            calls.append(name)
+            return await method(request, context)
+    else:
+        def recorded(request, context):
+            calls.append(name)
+            return method(request, context)
+    return recorded
+
+
+def _service(mode, catalog_size=6, **kwargs):
+    """A service of `mode` that records which of its methods serve calls."""
+    if mode == 'aio':
+        service = AsyncRecommendationService(_AsyncStaticCatalog(catalog_size), **kwargs)
+    else:
+        service = RecommendationService(_StaticCatalog(catalog_size), **kwargs)
+    service.calls = []
+    for name in ('ListRecommendations', 'ListRecommendationsSerialized',
+                 'ListRecommendationsBatch', 'ListRecommendationsBatchSerialized'):
+        setattr(service, name, _recorded(service.calls, name, getattr(service, name)))
+    return service
+
+
+@contextlib.contextmanager
+def _running(service, mode):
+    """Serves `service` on a grpc.server, or a grpc.aio server on a loop thread."""
+    if mode == 'sync':
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+        add_recommendation_service(service, server)
+        port = server.add_insecure_port('127.0.0.1:0')
+        server.start()
+        try:
+            yield port
+        finally:
+            server.stop(0)
+        return
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def start():
+        server = grpc.aio.server()
+        add_recommendation_service(service, server)
+        port = server.add_insecure_port('127.0.0.1:0')
+        await server.start()
+        return server, port
+
+    server, port = asyncio.run_coroutine_threadsafe(start(), loop).result()
+    try:
+        yield port
+    finally:
+        asyncio.run_coroutine_threadsafe(server.stop(0), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+def _raw_call(channel, method, request):
+    """Calls `method` and returns the response bytes as they came off the wire."""
+    return channel.unary_unary(method, request_serializer=type(request).SerializeToString)(
+        request, timeout=5)
+
+
+@pytest.mark.parametrize('mode', ['sync', 'aio'])
+def test_serialized_handler_takes_precedence(mode):
+    service = _service(mode)
+    request = demo_pb2.ListRecommendationsRequest(user_id='u', product_ids=['P0'])
+    batch = demo_pb2.ListRecommendationsBatchRequest(requests=[request, request])
+    with _running(service, mode) as port:
+        with grpc.insecure_channel('127.0.0.1:{}'.format(port)) as channel:
+            data = _raw_call(channel, LIST_RECOMMENDATIONS, request)
+            batch_data = _raw_call(channel, LIST_RECOMMENDATIONS_BATCH, batch)
+            stub = demo_pb2_grpc.RecommendationServiceStub(channel)
+            parsed = stub.ListRecommendations(request, timeout=5)
+    assert service.calls == ['ListRecommendationsSerialized',
+                             'ListRecommendationsBatchSerialized',
+                             'ListRecommendationsSerialized']
+    response = demo_pb2.ListRecommendationsResponse.FromString(data)
+    assert sorted(response.product_ids) == ['P1', 'P2', 'P3', 'P4', 'P5']
+    assert sorted(parsed.product_ids) == ['P1', 'P2', 'P3', 'P4', 'P5']
+    responses = demo_pb2.ListRecommendationsBatchResponse.FromString(batch_data).responses
+    assert [sorted(r.product_ids) for r in responses] == [['P1', 'P2', 'P3', 'P4', 'P5']] * 2
+
+
+@pytest.mark.parametrize('mode', ['sync', 'aio'])
+def test_serialized_responses_off_uses_servicer(mode, monkeypatch):
+    monkeypatch.setenv('SERIALIZED_RESPONSES', 'false')
+    service = _service(mode)
+    request = demo_pb2.ListRecommendationsRequest(user_id='u', product_ids=['P0'])
+    with _running(service, mode) as port:
+        with grpc.insecure_channel('127.0.0.1:{}'.format(port)) as channel:
+            stub = demo_pb2_grpc.RecommendationServiceStub(channel)
+            response = stub.ListRecommendations(request, timeout=5)
+            batch = stub.ListRecommendationsBatch(
+                demo_pb2.ListRecommendationsBatchRequest(requests=[request]), timeout=5)
+    assert service.calls == ['ListRecommendations', 'ListRecommendationsBatch']
+    assert sorted(response.product_ids) == ['P1', 'P2', 'P3', 'P4', 'P5']
+    assert len(batch.responses) == 1
+
+
+def _excluding(i):
+    # with 6 products and 5 picks, the response is every product but P<i>
+    return demo_pb2.ListRecommendationsRequest(user_id='u{}'.format(i),
+                                               product_ids=['P{}'.format(i)])
+
+
+def _others(i):
+    return sorted('P{}'.format(j) for j in range(6) if j != i)
+
+
+@pytest.mark.parametrize('serialized', ['true', 'false'])
+@pytest.mark.parametrize('mode', ['sync', 'aio'])
+def test_batch_answers_each_request_in_order(mode, serialized, monkeypatch):
+    monkeypatch.setenv('SERIALIZED_RESPONSES', serialized)
+    order = [3, 0, 5, 1, 1, 4]
+    with _running(_service(mode), mode) as port:
+        with grpc.insecure_channel('127.0.0.1:{}'.format(port)) as channel:
+            stub = demo_pb2_grpc.RecommendationServiceStub(channel)
+            response = stub.ListRecommendationsBatch(demo_pb2.ListRecommendationsBatchRequest(
+                requests=[_excluding(i) for i in order]), timeout=5)
+            empty = stub.ListRecommendationsBatch(
+                demo_pb2.ListRecommendationsBatchRequest(), timeout=5)
+    assert [sorted(r.product_ids) for r in response.responses] == [_others(i) for i in order]
+    assert len(empty.responses) == 0
+
+
+@pytest.mark.parametrize('serialized', [True, False])
+def test_batch_entries_share_the_result_cache(serialized):
+    service = RecommendationService(_StaticCatalog(100), results=ResultCache())
+    request = demo_pb2.ListRecommendationsBatchRequest(
+        requests=[_excluding(1), _excluding(2), _excluding(1)])
+    index = service.catalog.index()
+    if serialized:
+        data = service.batch_response_serialized(index, request)
+        responses = demo_pb2.ListRecommendationsBatchResponse.FromString(data).responses
+    else:
+        responses = service.batch_response(index, request).responses
+    # 5 random picks out of 99: the same cart answered twice means a hit
+    assert responses[0].product_ids == responses[2].product_ids
+    stats = service.results.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 2, 2)
+    # and single calls reuse what the batch cached
+    single = service.response(index, _excluding(2))
+    assert single.product_ids == responses[1].product_ids
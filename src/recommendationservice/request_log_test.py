@@ -0,0 +1,57 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+import pytest
+
+from request_log import RequestLog, summarized
+
+
+class _Handler(object):
+    def __init__(self, request_log):
+        self.request_log = request_log
+
+    @summarized
+    def Call(self, request, context):
+        if request == 'fail':
+            raise ValueError(request)
+        self.request_log.products(request)
+        return request
+
+
+@pytest.mark.parametrize('every,logged', [(1, 100), (10, 10), (0, 0)])
+def test_samples_one_in_every(every, logged):
+    request_log = RequestLog(logging.getLogger('test'), 'Call', every=every)
+    assert sum(request_log.sampled() for _ in range(100)) == logged
+
+
+def test_summary_counts_all_requests():
+    request_log = RequestLog(logging.getLogger('test'), 'Call', every=0, max_latencies=8)
+    handler = _Handler(request_log)
+    for _ in range(20):
+        handler.Call(['A', 'B'], None)
+    handler.Call(['A'], None)
+    with pytest.raises(ValueError):
+        handler.Call('fail', None)
+    summary = request_log.summary()
+    assert summary['requests'] == 22
+    assert summary['failed'] == 1
+    assert summary['top_products'][:2] == [('A', 21), ('B', 20)]
+    latency = summary['latency_ms']
+    assert 0 <= latency['p50'] <= latency['p99'] <= latency['max']
+    # the next summary starts from scratch
+    assert request_log.summary()['requests'] == 0
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures what pre-serialized ListRecommendations responses save.
+
+    python response_benchmark.py [--clients 8] [--requests 2000]
+
+First times serializing one response through demo_pb2 against the
+hand-rolled encoder, then runs an in-process server under concurrent load,
+once with the regular servicer and once with the serialized-response
+handler, with a warm result cache in both cases.
+"""
+
+import argparse
+import logging
+import os
+import threading
+import time
+import timeit
+from concurrent import futures
+
+# match the protobuf implementation the Dockerfile runs with
+os.environ.setdefault('PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION', 'python')
+
+import grpc
+import demo_pb2
+import demo_pb2_grpc
+from catalog_wire import encode_recommendations
+from product_index import ProductIndex
+from recommendation_server import RecommendationService, add_serialized_recommendations_handler
+from result_cache import ResultCache
+
+PRODUCT_IDS = ['PRODUCT{:08d}'.format(i) for i in range(5)]
+
+
+class _StaticCatalog(object):
+    def __init__(self, num_products):
+        self._index = ProductIndex(
+            [('PRODUCT{:08d}'.format(i), ()) for i in range(num_products)], version=1)
+
+    def index(self, timeout=None):
+        return self._index
+
+
+def protobuf_serialize():
+    response = demo_pb2.ListRecommendationsResponse()
+    response.product_ids.extend(PRODUCT_IDS)
+    return response.SerializeToString()
+
+
+def micro():
+    for name, fn in (('demo_pb2 message', protobuf_serialize),
+                     ('encode_recommendations', lambda: encode_recommendations(PRODUCT_IDS))):
+        timer = timeit.Timer(fn)
+        number, _ = timer.autorange()
+        per_call = min(timer.repeat(repeat=3, number=number)) / number
+        print('{:>24}: {:8.2f}us per response'.format(name, per_call * 1e6))
+
+
+def load(serialized, clients, requests):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    service = RecommendationService(_StaticCatalog(1000), results=ResultCache())
+    if serialized:
+        add_serialized_recommendations_handler(service, server)
+    demo_pb2_grpc.add_RecommendationServiceServicer_to_server(service, server)
+    port = server.add_insecure_port('localhost:0')
+    server.start()
+
+    channel = grpc.insecure_channel('localhost:{}'.format(port))
+    # leave the response as bytes so that only server-side costs differ
+    call = channel.unary_unary(
+        '/hipstershop.RecommendationService/ListRecommendations',
+        request_serializer=demo_pb2.ListRecommendationsRequest.SerializeToString,
+        response_deserializer=None)
+    latencies = []
+
+    def client(n):
+        request = demo_pb2.ListRecommendationsRequest(
+            user_id='user{}'.format(n), product_ids=['PRODUCT00000001'])
+        local = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            call(request)
+            local.append(time.perf_counter() - start)
+        latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    channel.close()
+    server.stop(0)
+
+    latencies.sort()
+    print('{:>24}: {:8.0f} rpc/s  p50 {:6.2f}ms  p99 {:6.2f}ms'.format(
+        'serialized handler' if serialized else 'servicer',
+        len(latencies) / elapsed,
+        latencies[len(latencies) // 2] * 1e3,
+        latencies[int(len(latencies) * 0.99)] * 1e3))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+    # the per-request log line would dominate the comparison
+    logging.getLogger('recommendationservice-server').setLevel(logging.WARNING)
+
+    micro()
+    for serialized in (False, True):
+        load(serialized, args.clients, args.requests)
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import hashlib
+import threading
+import time
+
+# rough per-entry overhead of the key tuple, the digest, the value and the
+# OrderedDict slot, on top of the size given to put()
+_ENTRY_OVERHEAD = 256
+
+
+def cart_key(user_id, product_ids):
+    """Cache key for a user and the set of products in their request."""
+    cart = '\0'.join(sorted(set(product_ids))).encode('utf-8')
+    return user_id, hashlib.blake2b(cart, digest_size=16).digest()
+
+
+class ResultCache(object):
+    """LRU cache of recommendation results with a TTL.
+
+    Bounded both by number of entries and by (estimated) bytes. Entries
+    belong to a catalog snapshot version: the first lookup or insert with a
+    newer version drops everything cached for the previous one, and calls
+    still running on an older snapshot neither hit nor store.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=16 << 20, ttl=30.0):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (value, size, expires_at), least recently used first
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key) if self._check_version(version) else None
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[2] <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, version, value, size):
+        """Caches `value`, which takes about `size` bytes, for `key`."""
+        size += _ENTRY_OVERHEAD + len(key[0])
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            if not self._check_version(version):
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + self._ttl)
+            self._bytes += size
+            while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(entries=len(self._entries), bytes=self._bytes, hits=self.hits,
+                        misses=self.misses, evictions=self.evictions)
+
+    def _check_version(self, version):
+        """Moves to `version` if it is newer; returns False if it is older."""
+        if version == self._version:
+            return True
+        if self._version is not None and version < self._version:
+            return False
+        self._entries.clear()
+        self._bytes = 0
+        self._version = version
+        return True
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
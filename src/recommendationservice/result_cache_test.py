@@ -0,0 +1,122 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+import result_cache
+from result_cache import ResultCache, cart_key
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(result_cache, 'time', clock)
+    return clock
+
+
+def _key(n):
+    return cart_key('u', ['P{}'.format(n)])
+
+
+# what put() charges for a user id of one character and no value
+_ENTRY = result_cache._ENTRY_OVERHEAD + 1
+
+
+def test_cart_key_ignores_order_and_duplicates():
+    assert cart_key('u', ['P1', 'P2', 'P1']) == cart_key('u', ['P2', 'P1'])
+    assert cart_key('u', ['P1']) != cart_key('v', ['P1'])
+    assert cart_key('u', ['P1']) != cart_key('u', ['P1', 'P2'])
+    # separated, not concatenated
+    assert cart_key('u', ['P1', 'P2']) != cart_key('u', ['P1P2'])
+    assert cart_key('u', []) == cart_key('u', ())
+
+
+def test_evicts_least_recently_used():
+    cache = ResultCache(max_entries=2)
+    cache.put(_key(1), 1, 'a', 0)
+    cache.put(_key(2), 1, 'b', 0)
+    assert cache.get(_key(1), 1) == 'a'
+    cache.put(_key(3), 1, 'c', 0)
+    assert cache.get(_key(2), 1) is None
+    assert (cache.get(_key(1), 1), cache.get(_key(3), 1)) == ('a', 'c')
+    stats = cache.stats()
+    assert (stats['entries'], stats['evictions'], stats['hits'], stats['misses']) == (2, 1, 3, 1)
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = ResultCache(ttl=30.0)
+    cache.put(_key(1), 1, 'a', 0)
+    clock.now += 29.9
+    assert cache.get(_key(1), 1) == 'a'
+    clock.now += 0.1
+    assert cache.get(_key(1), 1) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_put_again_replaces_value_and_size():
+    cache = ResultCache()
+    cache.put(_key(1), 1, 'a', 100)
+    cache.put(_key(1), 1, 'b', 10)
+    assert cache.get(_key(1), 1) == 'b'
+    assert cache.stats()['bytes'] == _ENTRY + 10
+
+
+def test_bounded_by_bytes():
+    cache = ResultCache(max_bytes=3 * (_ENTRY + 100))
+    for n in range(5):
+        cache.put(_key(n), 1, n, 100)
+    stats = cache.stats()
+    assert (stats['entries'], stats['bytes'], stats['evictions']) == (3, 3 * (_ENTRY + 100), 2)
+    assert [cache.get(_key(n), 1) for n in range(5)] == [None, None, 2, 3, 4]
+
+
+def test_oversized_entry_is_not_cached():
+    cache = ResultCache(max_bytes=_ENTRY + 100)
+    cache.put(_key(1), 1, 'a', 50)
+    cache.put(_key(2), 1, 'b', 101)
+    assert cache.get(_key(2), 1) is None
+    # and doesn't push out what is there
+    assert cache.get(_key(1), 1) == 'a'
+    assert cache.stats()['evictions'] == 0
+
+
+def test_newer_version_drops_entries():
+    cache = ResultCache()
+    cache.put(_key(1), 1, 'a', 0)
+    assert cache.get(_key(1), 2) is None
+    assert cache.stats()['entries'] == 0
+    cache.put(_key(1), 2, 'b', 0)
+    assert cache.get(_key(1), 2) == 'b'
+
+
+def test_older_version_is_a_miss_and_not_stored():
+    cache = ResultCache()
+    cache.put(_key(1), 2, 'new', 0)
+    # a call still running on the previous snapshot
+    assert cache.get(_key(1), 1) is None
+    cache.put(_key(2), 1, 'old', 0)
+    assert cache.get(_key(1), 2) == 'new'
+    assert cache.get(_key(2), 2) is None
+    stats = cache.stats()
+    assert (stats['entries'], stats['hits'], stats['misses']) == (1, 1, 2)
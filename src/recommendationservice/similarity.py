@@ -0,0 +1,224 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Item-to-item similarity matrix, built offline and memory-mapped at runtime.
+
+File layout (little-endian):
+
+    header     magic "RSIM", version u16, id width u16, k u32, n u32
+    ids        n ids, UTF-8, NUL-padded to `id width` bytes, sorted
+    neighbours n rows of k (row u32, score f32) entries, best first;
+               unused entries have row 0xffffffff
+
+Every row has the same size, so the neighbours of a product are one slice
+at a computed offset, and the sorted fixed-width id table is binary searched
+in place. Nothing is parsed at load time, and replicas on the same node
+share the pages through the page cache.
+
+To build a matrix:
+
+    python similarity.py --products products.json [--baskets baskets.jsonl] \\
+        [-k 20] -o similarity.bin
+
+`--catalog-addr host:port` reads the catalog from productcatalogservice
+instead of a products.json file. `--baskets` takes one JSON list of product
+ids per line (orders, sessions...); products bought together score higher.
+"""
+
+import argparse
+import json
+import math
+import mmap
+import os
+import struct
+
+_MAGIC = b'RSIM'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHHII')
+_ENTRY = struct.Struct('<If')
+_NO_ROW = 0xffffffff
+
+
+class SimilarityMatrix(object):
+    """Read-only, memory-mapped view of a file written by write_matrix."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.id_width, self.k, self.n = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError('{} is not a version {} similarity matrix'.format(path, _VERSION))
+        self._ids_offset = _HEADER.size
+        self._rows_offset = self._ids_offset + self.n * self.id_width
+        self._row_size = self.k * _ENTRY.size
+        if len(self._mm) != self._rows_offset + self.n * self._row_size:
+            raise ValueError('{} is truncated'.format(path))
+
+    def __len__(self):
+        return self.n
+
+    def close(self):
+        self._mm.close()
+
+    def _id_at(self, row):
+        start = self._ids_offset + row * self.id_width
+        return self._mm[start:start + self.id_width]
+
+    def row_of(self, product_id):
+        """Returns the row of `product_id`, or None if it isn't in the matrix."""
+        key = product_id.encode('utf-8')
+        if len(key) > self.id_width:
+            return None
+        key = key.ljust(self.id_width, b'\0')
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._id_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n and self._id_at(lo) == key:
+            return lo
+        return None
+
+    def product_id(self, row):
+        return self._id_at(row).rstrip(b'\0').decode('utf-8')
+
+    def neighbours(self, row):
+        """Returns the (row, score) pairs of the top-k neighbours of `row`."""
+        start = self._rows_offset + row * self._row_size
+        return [(r, score) for r, score in _ENTRY.iter_unpack(self._mm[start:start + self._row_size])
+                if r != _NO_ROW]
+
+    def related(self, product_ids):
+        """Merges the neighbour lists of `product_ids`, best scores first.
+
+        Products in `product_ids` are left out. The result holds at most
+        k entries per known product id.
+        """
+        rows = set()
+        for product_id in product_ids:
+            row = self.row_of(product_id)
+            if row is not None:
+                rows.add(row)
+        scores = {}
+        for row in rows:
+            for r, score in self.neighbours(row):
+                if r not in rows:
+                    scores[r] = scores.get(r, 0.0) + score
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        return [self.product_id(r) for r in ranked]
+
+
+def write_matrix(path, neighbours, k):
+    """Writes `neighbours` (product id -> list of (product id, score)) to `path`.
+
+    The matrix is written to a temporary file that replaces `path`: running
+    replicas keep their mapping of the old file, truncating it under them
+    would crash them with SIGBUS.
+    """
+    ids = sorted(neighbours, key=lambda x: x.encode('utf-8'))
+    rows = {product_id: i for i, product_id in enumerate(ids)}
+    id_width = max([len(x.encode('utf-8')) for x in ids] or [1])
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, id_width, k, len(ids)))
+            for product_id in ids:
+                f.write(product_id.encode('utf-8').ljust(id_width, b'\0'))
+            for product_id in ids:
+                top = sorted(neighbours[product_id], key=lambda x: x[1], reverse=True)[:k]
+                for other, score in top:
+                    f.write(_ENTRY.pack(rows[other], score))
+                f.write(_ENTRY.pack(_NO_ROW, 0.0) * (k - len(top)))
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def build_neighbours(products, baskets=(), category_weight=1.0, basket_weight=1.0):
+    """Scores product pairs by shared categories and co-occurrence in baskets.
+
+    `products` is a sequence of (product id, categories) pairs. The category
+    score is the Jaccard index of the two category sets; the basket score is
+    the cosine similarity of the two products' basket occurrences.
+    """
+    categories = {product_id: set(c) for product_id, c in products}
+    scores = {product_id: {} for product_id in categories}
+
+    members = {}
+    for product_id, product_categories in categories.items():
+        for category in product_categories:
+            members.setdefault(category, []).append(product_id)
+    for ids in members.values():
+        for a in ids:
+            for b in ids:
+                if a != b and b not in scores[a]:
+                    shared = len(categories[a] & categories[b])
+                    union = len(categories[a] | categories[b])
+                    scores[a][b] = category_weight * shared / union
+
+    counts = {}
+    pairs = {}
+    for basket in baskets:
+        basket = set(x for x in basket if x in categories)
+        for a in basket:
+            counts[a] = counts.get(a, 0) + 1
+            for b in basket:
+                if a != b:
+                    pairs[(a, b)] = pairs.get((a, b), 0) + 1
+    for (a, b), count in pairs.items():
+        cosine = count / math.sqrt(counts[a] * counts[b])
+        scores[a][b] = scores[a].get(b, 0.0) + basket_weight * cosine
+
+    return {product_id: list(s.items()) for product_id, s in scores.items()}
+
+
+def _load_products(args):
+    if args.products:
+        with open(args.products) as f:
+            return [(p['id'], p.get('categories', [])) for p in json.load(f)['products']]
+    import grpc
+    import demo_pb2
+    from catalog_wire import ProductCatalogLiteStub
+    channel = grpc.insecure_channel(args.catalog_addr)
+    return ProductCatalogLiteStub(channel).ListProductsLite(demo_pb2.Empty())
+
+
+def _load_baskets(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build an item-to-item similarity matrix.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--products', help='products.json file, as used by productcatalogservice')
+    source.add_argument('--catalog-addr', help='productcatalogservice address to read the catalog from')
+    parser.add_argument('--baskets', help='file with one JSON list of co-purchased product ids per line')
+    parser.add_argument('--category-weight', type=float, default=1.0)
+    parser.add_argument('--basket-weight', type=float, default=1.0)
+    parser.add_argument('-k', type=int, default=20, help='neighbours kept per product')
+    parser.add_argument('-o', '--output', required=True)
+    args = parser.parse_args()
+
+    products = _load_products(args)
+    baskets = _load_baskets(args.baskets) if args.baskets else ()
+    neighbours = build_neighbours(products, baskets, args.category_weight, args.basket_weight)
+    write_matrix(args.output, neighbours, args.k)
+    print('wrote {} products x {} neighbours to {}'.format(len(neighbours), args.k, args.output))
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import pytest
+
+from similarity import SimilarityMatrix, build_neighbours, write_matrix
+
+PRODUCTS = [
+    ('MUG', ('kitchen',)),
+    ('PAN', ('kitchen', 'cooking')),
+    ('POT', ('kitchen', 'cooking')),
+    ('HAT', ('clothing',)),
+    ('SCARF', ('clothing', 'accessories')),
+    ('WATCH', ('accessories',)),
+]
+
+
+def _build(path, products=PRODUCTS, baskets=(), k=3):
+    write_matrix(str(path), build_neighbours(products, baskets), k)
+    return SimilarityMatrix(str(path))
+
+
+def test_build_load_related(tmp_path):
+    matrix = _build(tmp_path / 'similarity.bin')
+    try:
+        assert len(matrix) == len(PRODUCTS)
+        assert matrix.row_of('UNKNOWN') is None
+        assert matrix.product_id(matrix.row_of('PAN')) == 'PAN'
+        # POT shares both categories with PAN, MUG only one
+        assert matrix.related(['PAN']) == ['POT', 'MUG']
+        related = matrix.related(['PAN', 'POT'])
+        assert related == ['MUG']
+        assert matrix.related(['HAT', 'UNKNOWN']) == ['SCARF']
+    finally:
+        matrix.close()
+
+
+def test_baskets_raise_scores(tmp_path):
+    matrix = _build(tmp_path / 'similarity.bin', baskets=[['MUG', 'WATCH']] * 3)
+    try:
+        assert matrix.related(['WATCH'])[0] == 'MUG'
+    finally:
+        matrix.close()
+
+
+def test_neighbours_are_capped_at_k(tmp_path):
+    products = [('P{}'.format(i), ('all',)) for i in range(10)]
+    matrix = _build(tmp_path / 'similarity.bin', products, k=4)
+    try:
+        assert len(matrix.neighbours(0)) == 4
+        assert len(matrix.related(['P0'])) == 4
+    finally:
+        matrix.close()
+
+
+def test_rewrite_keeps_open_matrix_valid(tmp_path):
+    path = tmp_path / 'similarity.bin'
+    matrix = _build(path)
+    try:
+        inode = os.stat(str(path)).st_ino
+        rebuilt = _build(path, [('NEW{}'.format(i), ('all',)) for i in range(50)])
+        rebuilt.close()
+        assert os.stat(str(path)).st_ino != inode
+        assert not [x for x in os.listdir(str(tmp_path)) if x.endswith('.tmp')]
+        # still reads the file it mapped
+        assert matrix.related(['PAN']) == ['POT', 'MUG']
+    finally:
+        matrix.close()
+
+
+def test_truncated_file_is_rejected(tmp_path):
+    path = tmp_path / 'similarity.bin'
+    _build(path).close()
+    path.write_bytes(path.read_bytes()[:-4])
+    with pytest.raises(ValueError):
+        SimilarityMatrix(str(path))
@@ -0,0 +1,315 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""OpenTelemetry tracing of gRPC calls, when opentelemetry is installed.
+
+TracingInterceptor (and its grpc.aio twin) runs every unary call in a
+SERVER span, continuing the trace of the W3C traceparent the caller sent;
+the client interceptors run outgoing calls in CLIENT spans and send their
+traceparent. Spans are head sampled: ParentBased(TraceIdRatioBased(ratio))
+follows the caller's decision and samples `ratio` of new traces, and
+unsampled spans are never recorded or exported. Sampled spans are exported
+from a background thread by a BatchSpanProcessor.
+
+tracer_from_env() reads TRACING_EXPORTER ("none", the default, disables
+tracing; "otlp", "console" or "file"), TRACING_SAMPLE_RATIO, TRACING_FILE
+and OTEL_SERVICE_NAME. The OTLP exporter takes its endpoint from
+OTEL_EXPORTER_OTLP_ENDPOINT.
+"""
+
+import collections
+import functools
+import inspect
+import os
+import threading
+
+import grpc
+
+from logger import getJSONLogger
+logger = getJSONLogger('tracing')
+
+try:
+  from opentelemetry import propagate, trace
+  from opentelemetry.propagators.textmap import Getter
+  from opentelemetry.sdk.resources import Resource
+  from opentelemetry.sdk.trace import TracerProvider
+  from opentelemetry.sdk.trace.export import (BatchSpanProcessor, ConsoleSpanExporter,
+                                              SpanExporter, SpanExportResult)
+  from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+except ImportError:
+  trace = None
+
+# health checks would be most of the spans and tell nothing
+_EXEMPT_PREFIX = '/grpc.health.v1.Health/'
+
+
+if trace is not None:
+  class _MetadataGetter(Getter):
+    """Reads propagation headers from grpc metadata, a sequence of (key, value)."""
+
+    def get(self, carrier, key):
+      values = [v for k, v in carrier if k == key]
+      return values or None
+
+    def keys(self, carrier):
+      return [k for k, _ in carrier]
+
+  _getter = _MetadataGetter()
+
+  class FileSpanExporter(SpanExporter):
+    """Appends finished spans to a file, one JSON object per line."""
+
+    def __init__(self, path):
+      self._file = open(path, 'a')
+      self._lock = threading.Lock()
+
+    def export(self, spans):
+      lines = ''.join(span.to_json(indent=None) + '\n' for span in spans)
+      with self._lock:
+        self._file.write(lines)
+        self._file.flush()
+      return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+      with self._lock:
+        self._file.close()
+
+
+_attributes = {}
+
+
+def _rpc_attributes(method):
+  # built once per method; spans copy the attributes they are given
+  attributes = _attributes.get(method)
+  if attributes is None:
+    # '/package.Service/Method'
+    service, _, name = method[1:].partition('/')
+    attributes = _attributes[method] = {
+      'rpc.system': 'grpc', 'rpc.service': service, 'rpc.method': name}
+  return attributes
+
+
+def _parent(metadata):
+  # most calls carry no trace context, skip the propagators for them
+  for key, _ in metadata:
+    if key == 'traceparent':
+      return propagate.extract(metadata, getter=_getter)
+  return None
+
+
+def _end_server_span(span, context, error):
+  if not span.is_recording():
+    return
+  code = context.code() if hasattr(context, 'code') else None
+  if not isinstance(code, grpc.StatusCode):
+    code = grpc.StatusCode.UNKNOWN if error else grpc.StatusCode.OK
+  span.set_attribute('rpc.grpc.status_code', code.value[0])
+  if code != grpc.StatusCode.OK:
+    span.set_status(trace.Status(trace.StatusCode.ERROR, code.name))
+
+
+class TracingInterceptor(grpc.ServerInterceptor):
+  """Server interceptor running unary calls in spans of `tracer`."""
+
+  def __init__(self, tracer):
+    self._tracer = tracer
+
+  def intercept_service(self, continuation, handler_call_details):
+    handler = continuation(handler_call_details)
+    if not _traced(handler, handler_call_details):
+      return handler
+    method = handler_call_details.method
+    behavior = handler.unary_unary
+    tracer = self._tracer
+
+    @functools.wraps(behavior)
+    def traced(request, context):
+      # extracted here, on the worker thread, rather than where grpc looks
+      # up the handler
+      parent = _parent(context.invocation_metadata())
+      with tracer.start_as_current_span(
+          method[1:], context=parent, kind=trace.SpanKind.SERVER,
+          attributes=_rpc_attributes(method), record_exception=False,
+          set_status_on_exception=False) as span:
+        error = True
+        try:
+          response = behavior(request, context)
+          error = False
+          return response
+        finally:
+          _end_server_span(span, context, error)
+
+    return handler._replace(unary_unary=traced)
+
+
+class AsyncTracingInterceptor(grpc.aio.ServerInterceptor):
+  """TracingInterceptor for grpc.aio servers."""
+
+  def __init__(self, tracer):
+    self._tracer = tracer
+
+  async def intercept_service(self, continuation, handler_call_details):
+    handler = await continuation(handler_call_details)
+    if not _traced(handler, handler_call_details):
+      return handler
+    method = handler_call_details.method
+    behavior = handler.unary_unary
+    tracer = self._tracer
+
+    @functools.wraps(behavior)
+    async def traced(request, context):
+      parent = _parent(context.invocation_metadata() or ())
+      with tracer.start_as_current_span(
+          method[1:], context=parent, kind=trace.SpanKind.SERVER,
+          attributes=_rpc_attributes(method), record_exception=False,
+          set_status_on_exception=False) as span:
+        error = True
+        try:
+          response = behavior(request, context)
+          if inspect.isawaitable(response):
+            response = await response
+          error = False
+          return response
+        finally:
+          _end_server_span(span, context, error)
+
+    return handler._replace(unary_unary=traced)
+
+
+def _traced(handler, handler_call_details):
+  return (handler is not None and handler.unary_unary is not None
+          and not handler_call_details.method.startswith(_EXEMPT_PREFIX))
+
+
+class _ClientCallDetails(
+    collections.namedtuple('_ClientCallDetails', (
+      'method', 'timeout', 'metadata', 'credentials', 'wait_for_ready', 'compression')),
+    grpc.ClientCallDetails):
+  pass
+
+
+def _start_client_span(tracer, method):
+  if isinstance(method, bytes):
+    method = method.decode('ascii')
+  span = tracer.start_span(method[1:], kind=trace.SpanKind.CLIENT,
+                           attributes=_rpc_attributes(method))
+  headers = {}
+  propagate.inject(headers, context=trace.set_span_in_context(span))
+  return span, list(headers.items())
+
+
+def _end_client_span(span, code):
+  if span.is_recording():
+    span.set_attribute('rpc.grpc.status_code', code.value[0])
+    if code != grpc.StatusCode.OK:
+      span.set_status(trace.Status(trace.StatusCode.ERROR, code.name))
+  span.end()
+
+
+class TracingClientInterceptor(grpc.UnaryUnaryClientInterceptor):
+  """Client interceptor running unary calls in CLIENT spans and propagating them."""
+
+  def __init__(self, tracer):
+    self._tracer = tracer
+
+  def intercept_unary_unary(self, continuation, client_call_details, request):
+    span, headers = _start_client_span(self._tracer, client_call_details.method)
+    details = _ClientCallDetails(
+      client_call_details.method, client_call_details.timeout,
+      list(client_call_details.metadata or ()) + headers, client_call_details.credentials,
+      client_call_details.wait_for_ready, client_call_details.compression)
+    # also covers calls made with .future(): the span ends with the call
+    call = continuation(details, request)
+    call.add_done_callback(lambda c: _end_client_span(span, c.code()))
+    return call
+
+
+class AsyncTracingClientInterceptor(grpc.aio.UnaryUnaryClientInterceptor):
+  """TracingClientInterceptor for grpc.aio channels."""
+
+  def __init__(self, tracer):
+    self._tracer = tracer
+
+  async def intercept_unary_unary(self, continuation, client_call_details, request):
+    span, headers = _start_client_span(self._tracer, client_call_details.method)
+    metadata = grpc.aio.Metadata(*(client_call_details.metadata or ()))
+    for key, value in headers:
+      metadata.add(key, value)
+    try:
+      call = await continuation(client_call_details._replace(metadata=metadata), request)
+      # the status is only known once the call is done; the caller gets
+      # the same call and its outcome
+      await call
+    except grpc.aio.AioRpcError as err:
+      _end_client_span(span, err.code())
+    except BaseException:
+      _end_client_span(span, grpc.StatusCode.CANCELLED)
+      raise
+    else:
+      _end_client_span(span, grpc.StatusCode.OK)
+    return call
+
+
+def tracer_provider(service_name, exporter, ratio=1.0):
+  """Returns a TracerProvider sampling `ratio` of new traces and exporting to `exporter`."""
+  provider = TracerProvider(
+    sampler=ParentBased(TraceIdRatioBased(ratio)),
+    resource=Resource.create({'service.name': service_name}))
+  provider.add_span_processor(BatchSpanProcessor(exporter))
+  return provider
+
+
+def _exporter(name):
+  if name == 'console':
+    return ConsoleSpanExporter()
+  if name == 'file':
+    return FileSpanExporter(os.environ.get('TRACING_FILE', "spans.jsonl"))
+  if name == 'otlp':
+    from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+    return OTLPSpanExporter()
+  raise ValueError('unknown TRACING_EXPORTER: ' + name)
+
+
+def tracer_from_env(service_name):
+  """Sets up tracing as configured by the environment.
+
+  Returns the tracer for the interceptors, or None when tracing is off or
+  opentelemetry is not installed.
+  """
+  exporter = os.environ.get('TRACING_EXPORTER', "none").lower()
+  if exporter in ("none", "off", ""):
+    return None
+  if trace is None:
+    logger.warning("TRACING_EXPORTER is set but opentelemetry is not installed, not tracing")
+    return None
+  ratio = float(os.environ.get('TRACING_SAMPLE_RATIO', "1"))
+  provider = tracer_provider(os.environ.get('OTEL_SERVICE_NAME', service_name),
+                             _exporter(exporter), ratio)
+  trace.set_tracer_provider(provider)
+  logger.info("tracing {:g}% of new traces to {}".format(ratio * 100, exporter))
+  return provider.get_tracer(__name__)
+
+
+def server_interceptors(tracer, aio=False):
+  if tracer is None:
+    return []
+  return [(AsyncTracingInterceptor if aio else TracingInterceptor)(tracer)]
+
+
+def client_interceptors(tracer, aio=False):
+  if tracer is None:
+    return []
+  return [(AsyncTracingClientInterceptor if aio else TracingClientInterceptor)(tracer)]
@@ -0,0 +1,81 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures the per-RPC cost of TracingInterceptor at several sampling ratios.
+
+    python tracing_benchmark.py [ratio ...]
+
+Calls an intercepted no-op handler directly, so the numbers are the
+interceptor's own overhead, exporting included (to an exporter that
+discards the spans), without any network or grpc cost.
+"""
+
+import sys
+import timeit
+
+import grpc
+
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+from tracing import TracingInterceptor, tracer_provider
+
+METHOD = '/hipstershop.RecommendationService/ListRecommendations'
+
+
+class DiscardingExporter(SpanExporter):
+    def export(self, spans):
+        return SpanExportResult.SUCCESS
+
+
+class FakeContext(object):
+    def invocation_metadata(self):
+        return (('user-agent', 'grpc-python/1.43.0'),)
+
+    def code(self):
+        return None
+
+
+class HandlerCallDetails(grpc.HandlerCallDetails):
+    def __init__(self, method):
+        self.method = method
+        self.invocation_metadata = ()
+
+
+def handler(interceptor):
+    rpc_handler = grpc.unary_unary_rpc_method_handler(lambda request, context: request)
+    if interceptor is None:
+        return rpc_handler.unary_unary
+    return interceptor.intercept_service(
+        lambda details: rpc_handler, HandlerCallDetails(METHOD)).unary_unary
+
+
+def bench(behavior):
+    context = FakeContext()
+    timer = timeit.Timer(lambda: behavior(b'', context))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=5, number=number)) / number
+
+
+if __name__ == "__main__":
+    ratios = [float(arg) for arg in sys.argv[1:]] or [0.0, 0.01, 1.0]
+    baseline = bench(handler(None))
+    print('{:<16} {:>8.2f}us'.format('no interceptor', baseline * 1e6))
+    for ratio in ratios:
+        provider = tracer_provider('benchmark', DiscardingExporter(), ratio)
+        seconds = bench(handler(TracingInterceptor(provider.get_tracer(__name__))))
+        print('{:<16} {:>8.2f}us  +{:.2f}us per RPC'.format(
+            '{:g}% sampled'.format(ratio * 100), seconds * 1e6, (seconds - baseline) * 1e6))
+        provider.shutdown()
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from concurrent import futures
+
+import grpc
+import pytest
+
+pytest.importorskip('opentelemetry.sdk')
+
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+import demo_pb2
+import demo_pb2_grpc
+from tracing import client_interceptors, server_interceptors
+
+
+class _Catalog(demo_pb2_grpc.ProductCatalogServiceServicer):
+    def ListProducts(self, request, context):
+        return demo_pb2.ListProductsResponse(products=[demo_pb2.Product(id='A')])
+
+    def GetProduct(self, request, context):
+        context.abort(grpc.StatusCode.NOT_FOUND, 'no such product')
+
+
+class _AsyncCatalog(demo_pb2_grpc.ProductCatalogServiceServicer):
+    async def ListProducts(self, request, context):
+        return demo_pb2.ListProductsResponse(products=[demo_pb2.Product(id='A')])
+
+    async def GetProduct(self, request, context):
+        await context.abort(grpc.StatusCode.NOT_FOUND, 'no such product')
+
+
+def _tracer(ratio=1.0):
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider(sampler=ParentBased(TraceIdRatioBased(ratio)))
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    return provider.get_tracer(__name__), exporter
+
+
+def _check_spans(exporter):
+    spans = {(s.name, s.kind): s for s in exporter.get_finished_spans()}
+    assert len(spans) == 4
+    client = spans['hipstershop.ProductCatalogService/ListProducts', trace.SpanKind.CLIENT]
+    server = spans['hipstershop.ProductCatalogService/ListProducts', trace.SpanKind.SERVER]
+    # the server continues the client's trace
+    assert server.context.trace_id == client.context.trace_id
+    assert server.parent.span_id == client.context.span_id
+    assert server.attributes['rpc.grpc.status_code'] == grpc.StatusCode.OK.value[0]
+    for kind in (trace.SpanKind.CLIENT, trace.SpanKind.SERVER):
+        failed = spans['hipstershop.ProductCatalogService/GetProduct', kind]
+        assert failed.attributes['rpc.grpc.status_code'] == grpc.StatusCode.NOT_FOUND.value[0]
+        assert failed.status.status_code == trace.StatusCode.ERROR
+
+
+def _serve(tracer, servicer):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2),
+                         interceptors=server_interceptors(tracer))
+    demo_pb2_grpc.add_ProductCatalogServiceServicer_to_server(servicer, server)
+    port = server.add_insecure_port('127.0.0.1:0')
+    server.start()
+    return server, port
+
+
+def _calls(tracer, port):
+    channel = grpc.intercept_channel(grpc.insecure_channel('127.0.0.1:{}'.format(port)),
+                                     *client_interceptors(tracer))
+    stub = demo_pb2_grpc.ProductCatalogServiceStub(channel)
+    assert stub.ListProducts.future(demo_pb2.Empty()).result().products[0].id == 'A'
+    with pytest.raises(grpc.RpcError):
+        stub.GetProduct(demo_pb2.GetProductRequest(id='B'))
+    channel.close()
+
+
+def test_client_and_server_spans():
+    tracer, exporter = _tracer()
+    server, port = _serve(tracer, _Catalog())
+    try:
+        _calls(tracer, port)
+    finally:
+        server.stop(0)
+    _check_spans(exporter)
+
+
+def test_unsampled_traces_are_not_exported():
+    tracer, exporter = _tracer(ratio=0.0)
+    server, port = _serve(tracer, _Catalog())
+    try:
+        _calls(tracer, port)
+    finally:
+        server.stop(0)
+    assert exporter.get_finished_spans() == ()
+
+
+def test_async_client_and_server_spans():
+    tracer, exporter = _tracer()
+
+    async def main():
+        server = grpc.aio.server(interceptors=server_interceptors(tracer, aio=True))
+        demo_pb2_grpc.add_ProductCatalogServiceServicer_to_server(_AsyncCatalog(), server)
+        port = server.add_insecure_port('127.0.0.1:0')
+        await server.start()
+        try:
+            async with grpc.aio.insecure_channel(
+                    '127.0.0.1:{}'.format(port),
+                    interceptors=client_interceptors(tracer, aio=True)) as channel:
+                stub = demo_pb2_grpc.ProductCatalogServiceStub(channel)
+                response = await stub.ListProducts(demo_pb2.Empty())
+                assert response.products[0].id == 'A'
+                with pytest.raises(grpc.RpcError):
+                    await stub.GetProduct(demo_pb2.GetProductRequest(id='B'))
+        finally:
+            await server.stop(0)
+
+    asyncio.run(main())
+    _check_spans(exporter)